@@ -0,0 +1,419 @@
+# agent_router.py
+# Agent routing without a search: the question vector against one centroid per agent
+# - prototypes: per agent, the sum of the stored vectors of the chunks whose rubric names it
+#   (admission/concours -> Admissions, formation/programme/cursus -> Formations,
+#   international/échange/mobilité -> International), computed at index time ->
+#   <vector_dir>/router/ (stamped with the mapping.json it was built from, rebuilt in memory
+#   when missing or stale); the sums of every store are added then normalized, so each agent
+#   gets exactly one prototype however many chunks back it
+# - rubrics naming no agent (entreprises, lecole, recherche) are left out of the prototypes:
+#   they used to default to Admissions and pulled most questions there. The whole v3 pdf
+#   store (rubric "entreprises") is left out this way: it contributes no prototype, its
+#   router/ only records the excluded count
+# - AgentRouter.route(q_vec): one [n_agents, d] x [d] product, confidence = softmax share of
+#   the winner at ESILV_ROUTER_TEMPERATURE
+# - below ESILV_ROUTER_MIN_CONFIDENCE, or without a question vector (keyword-only
+#   questions), detect_agent() falls back to the keyword rules
+# - both are calibrated on labelled questions (code/bench/agent_questions.jsonl, needs Ollama
+#   for the embeddings) by stratified k-fold cross-validation: per fold, temperature = lowest
+#   NLL and threshold = best accuracy of router + keyword fallback on the training folds; the
+#   medians are kept and the reported accuracy is the out-of-fold one ->
+#   code/embeddings/router_calibration.json (ESILV_ROUTER_CALIBRATION), read at import; the
+#   env variables still override it
+# - without a calibration file (nor ESILV_ROUTER_MIN_CONFIDENCE) the centroid stage is off
+#   (ROUTER_CALIBRATED): detect_agent() routes with the keyword rules, as before the router
+#
+# Build for existing stores / evaluate / calibrate on the labelled questions:
+#   python code/app/agent_router.py code/embeddings/vector_store_v2 code/embeddings/vector_store_v3
+#   python code/app/agent_router.py --eval code/bench/agent_questions.jsonl code/embeddings/vector_store_v2 code/embeddings/vector_store_v3
+#   python code/app/agent_router.py --calibrate code/bench/agent_questions.jsonl code/embeddings/vector_store_v2 code/embeddings/vector_store_v3
+
+import argparse
+import json
+import os
+from collections import Counter
+
+import faiss
+import numpy as np
+
+from ann_index import index_path, index_vectors
+from docstore import same_source, source_stamp
+
+ROUTER_DIRNAME = "router"
+FORMAT_VERSION = 2
+
+AGENTS = ("Admissions", "Formations", "International")
+DEFAULT_AGENT = "Admissions"
+
+ROUTER_CALIBRATION = os.environ.get(
+    "ESILV_ROUTER_CALIBRATION",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embeddings", "router_calibration.json"),
+)
+
+
+def load_calibration(path: str = ROUTER_CALIBRATION) -> dict:
+    """{"temperature", "min_confidence", ...} written by --calibrate, {} when missing."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_CALIBRATION = load_calibration()
+# uncalibrated defaults: with 3 agents a 0.5 threshold only rejects near three-way ties
+ROUTER_TEMPERATURE = float(os.environ.get("ESILV_ROUTER_TEMPERATURE", _CALIBRATION.get("temperature", 0.03)))
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("ESILV_ROUTER_MIN_CONFIDENCE", _CALIBRATION.get("min_confidence", 0.65)))
+# an uncalibrated threshold is a guess: the centroid routes only once a calibration (or an explicit threshold) exists
+ROUTER_CALIBRATED = bool(_CALIBRATION) or "ESILV_ROUTER_MIN_CONFIDENCE" in os.environ
+
+
+# ----------------------------------------------------
+# KEYWORD RULES
+# ----------------------------------------------------
+
+def priority_agent(question: str):
+    """Rules from the question itself that always win, or None."""
+    q_lower = question.lower()
+    if "alternance" in q_lower or "apprentissage" in q_lower:
+        return "Admissions"
+    if "international" in q_lower or "mobilité" in q_lower or "échange" in q_lower:
+        return "International"
+    return None
+
+
+def keyword_agent(text: str):
+    """Agent named by a rubric or a question ("concours", "cursus"...), or None."""
+    t = (text or "").lower()
+    if "admission" in t or "concour" in t:
+        return "Admissions"
+    if "formation" in t or "programme" in t or "cursus" in t:
+        return "Formations"
+    if "international" in t or "échange" in t or "mobilité" in t:
+        return "International"
+    return None
+
+
+def agent_for_rubric(rubric: str) -> str:
+    return keyword_agent(rubric) or DEFAULT_AGENT
+
+
+# ----------------------------------------------------
+# PROTOTYPES (index time)
+# ----------------------------------------------------
+
+def _normalized(m: np.ndarray) -> np.ndarray:
+    m = np.array(m, dtype="float32", ndmin=2)
+    m /= (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+    return m
+
+
+def build_prototypes(vectors: np.ndarray, rubrics):
+    """
+    vectors: L2-normalized float32 [n, d], rubrics: rubric of each row.
+    Returns (sums [m, d] of the vectors of each agent, the m agents in AGENTS order,
+    vector count per agent, vector count per rubric naming no agent).
+    """
+    vectors = np.asarray(vectors, dtype="float32")
+    d = vectors.shape[1] if vectors.ndim == 2 else 0
+    owner = [keyword_agent(r) for r in rubrics]
+    sums, agents, counts = [], [], {}
+    for agent in AGENTS:
+        rows = np.array([a == agent for a in owner], dtype=bool)
+        if rows.any():
+            sums.append(vectors[rows].sum(axis=0))
+            agents.append(agent)
+            counts[agent] = int(rows.sum())
+    excluded = Counter((r or "").lower() for r, a in zip(rubrics, owner) if a is None)
+    sums = np.vstack(sums).astype("float32") if sums else np.zeros((0, d), dtype="float32")
+    return sums, agents, counts, dict(sorted(excluded.items()))
+
+
+def store_rubrics(mapping, ids):
+    rubrics = []
+    for i in ids:
+        doc = mapping.get(str(int(i))) or {}
+        rubrics.append(doc.get("rubric") or "")
+    return rubrics
+
+
+def write_router(vectors: np.ndarray, rubrics, out_dir: str, source_path: str = None) -> dict:
+    """
+    Per-agent vector sums of a store -> <out_dir>/ (built at index time). Returns meta.
+    source_path: the mapping.json the rubrics come from (stamped, see open_router()).
+    """
+    sums, agents, counts, excluded = build_prototypes(vectors, rubrics)
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "agent_sums.npy"), sums)
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "n_docs": int(len(rubrics)),
+        "agents": agents,
+        "counts": counts,
+        "excluded": excluded,
+    }
+    if source_path is not None:
+        meta["source"] = source_stamp(source_path)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def open_router(vector_dir: str, index, mapping):
+    """
+    (agent sums, agents) of a store from <vector_dir>/router/. Missing or stale
+    (doc count differs from the index, mapping.json rewritten since or no source
+    stamp): built in memory from the index vectors.
+    """
+    path = os.path.join(vector_dir, ROUTER_DIRNAME)
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        map_path = os.path.join(vector_dir, "mapping.json")
+        fresh = meta.get("format_version") == FORMAT_VERSION and meta["n_docs"] == index.ntotal
+        if fresh and os.path.exists(map_path):
+            fresh = meta.get("source") is not None and same_source(map_path, meta["source"])
+        if fresh:
+            return np.load(os.path.join(path, "agent_sums.npy")), meta["agents"]
+    except (OSError, ValueError, KeyError):
+        pass
+    ids, vectors = index_vectors(index)
+    sums, agents, _, _ = build_prototypes(vectors, store_rubrics(mapping, ids))
+    return sums, agents
+
+
+# ----------------------------------------------------
+# ROUTER (query time)
+# ----------------------------------------------------
+
+def softmax_confidence(scores: np.ndarray, temperature: float) -> np.ndarray:
+    """Agent probabilities from per-agent similarities [..., n_agents] (-inf: no prototype)."""
+    scores = np.asarray(scores, dtype="float64")
+    z = np.exp((scores - scores.max(axis=-1, keepdims=True)) / temperature)
+    return z / z.sum(axis=-1, keepdims=True)
+
+
+class AgentRouter:
+    def __init__(self, prototypes: np.ndarray, agents, temperature: float = None):
+        self.prototypes = np.ascontiguousarray(prototypes, dtype="float32")
+        self.agents = list(agents)
+        self.temperature = temperature if temperature is not None else ROUTER_TEMPERATURE
+        agent_pos = {a: i for i, a in enumerate(AGENTS)}
+        self.proto_agent = np.array([agent_pos[a] for a in self.agents], dtype=np.int64)
+
+    @classmethod
+    def from_stores(cls, stores, temperature: float = None):
+        """One prototype per agent: the normalized sum of the "router" sums of every store."""
+        totals = {}
+        for s in stores:
+            sums, agents = s["router"]
+            for row, agent in zip(np.asarray(sums, dtype="float32"), agents):
+                totals[agent] = totals[agent] + row if agent in totals else row.copy()
+        agents = [a for a in AGENTS if a in totals]
+        if not agents:
+            d = next((np.asarray(s["router"][0]).shape[-1] for s in stores), 0)
+            return cls(np.zeros((0, d), dtype="float32"), [], temperature)
+        return cls(_normalized(np.vstack([totals[a] for a in agents])), agents, temperature)
+
+    def __len__(self):
+        return self.prototypes.shape[0]
+
+    def scores(self, q_vec: np.ndarray) -> np.ndarray:
+        """Prototype similarity per agent, in AGENTS order (-inf: no prototype). q_vec: [d] or [n, d]."""
+        Q = np.asarray(q_vec, dtype="float32")
+        sims = Q.reshape(-1, self.prototypes.shape[1]) @ self.prototypes.T
+        best = np.full((sims.shape[0], len(AGENTS)), -np.inf, dtype="float32")
+        best[:, self.proto_agent] = sims
+        return best[0] if Q.ndim == 1 else best
+
+    def route(self, q_vec: np.ndarray):
+        """(agent, confidence in [0, 1])."""
+        if len(self) == 0:
+            return DEFAULT_AGENT, 0.0
+        probs = softmax_confidence(self.scores(q_vec), self.temperature)
+        i = int(np.argmax(probs))
+        return AGENTS[i], float(probs[i])
+
+
+# ----------------------------------------------------
+# EVALUATION / CALIBRATION (held-out labelled questions)
+# ----------------------------------------------------
+
+def read_labelled(path: str):
+    """[(question, agent)] from a JSONL of {"question": ..., "agent": ...}."""
+    labelled = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                if row.get("agent") not in AGENTS:
+                    raise ValueError(f"{path}: unknown agent {row.get('agent')!r} for {row['question']!r}")
+                labelled.append((row["question"], row["agent"]))
+    return labelled
+
+
+def fallback_agent(question: str) -> str:
+    """What detect_agent() answers below the threshold, without the search-based vote."""
+    return keyword_agent(question) or DEFAULT_AGENT
+
+
+def _routes(scores: np.ndarray, questions, temperature: float, min_confidence: float):
+    """(centroid agent, confident?, final agent) arrays: centroid at or above min_confidence, fallback_agent() below."""
+    probs = softmax_confidence(scores, temperature)
+    routed = np.array([AGENTS[i] for i in probs.argmax(axis=1)], dtype=object)
+    confident = probs.max(axis=1) >= min_confidence
+    final = np.where(confident, routed, np.array([fallback_agent(q) for q in questions], dtype=object))
+    return routed, confident, final
+
+
+def _summary(routed, confident, final, expected) -> dict:
+    want = np.asarray(expected, dtype=object)
+    right = routed == want
+    return {
+        "n": int(len(want)),
+        "router_accuracy": round(float(right.mean()), 4) if len(want) else 0.0,
+        "confident_share": round(float(confident.mean()), 4) if len(want) else 0.0,
+        "confident_accuracy": round(float(right[confident].mean()), 4) if confident.any() else 0.0,
+        "accuracy": round(float((final == want).mean()), 4) if len(want) else 0.0,
+        "routed": dict(Counter(routed.tolist())),
+    }
+
+
+def routing_stats(scores: np.ndarray, questions, expected, temperature: float, min_confidence: float) -> dict:
+    """scores: [n, n_agents] router similarities of questions no priority rule catches."""
+    return {"temperature": round(float(temperature), 5), "min_confidence": round(float(min_confidence), 3),
+            **_summary(*_routes(scores, questions, temperature, min_confidence), expected)}
+
+
+def _fit(scores: np.ndarray, questions, expected, temperatures, thresholds):
+    """
+    (temperature of lowest negative log-likelihood of the labels, lowest threshold
+    with the best accuracy of router + fallback at that temperature, that NLL).
+    """
+    labels = np.array([AGENTS.index(a) for a in expected], dtype=np.int64)
+    nll = []
+    for t in temperatures:
+        p = softmax_confidence(scores, t)[np.arange(len(labels)), labels]
+        nll.append(float(-np.log(np.maximum(p, 1e-12)).mean()))
+    temperature = float(temperatures[int(np.argmin(nll))])
+
+    best_threshold, best_accuracy = float(thresholds[0]), -1.0
+    for threshold in thresholds:
+        accuracy = float((_routes(scores, questions, temperature, threshold)[2] == np.asarray(expected)).mean())
+        if accuracy > best_accuracy:
+            best_threshold, best_accuracy = float(threshold), accuracy
+    return temperature, best_threshold, min(nll)
+
+
+def fold_ids(expected, folds: int, seed: int = 0) -> np.ndarray:
+    """Fold of each question, stratified: every agent's questions are dealt over the folds in turn."""
+    rng = np.random.default_rng(seed)
+    want = np.asarray(expected, dtype=object)
+    fold = np.zeros(len(want), dtype=np.int64)
+    start = 0
+    for agent in AGENTS:
+        rows = np.flatnonzero(want == agent)
+        rng.shuffle(rows)
+        fold[rows] = (start + np.arange(len(rows))) % folds
+        start += len(rows)
+    return fold
+
+
+def calibrate(scores: np.ndarray, questions, expected, temperatures=np.geomspace(0.002, 0.5, 60),
+              thresholds=np.arange(0.34, 1.0, 0.01), folds: int = 5, seed: int = 0) -> dict:
+    """
+    Stratified k-fold cross-validation of _fit(): each fold is routed with the
+    parameters fitted on the other folds. Returns the median temperature / threshold
+    of the folds with the out-of-fold stats (fitting and scoring on the same
+    questions would overstate the accuracy and overfit the threshold).
+    """
+    scores = np.asarray(scores)
+    questions, expected = list(questions), list(expected)
+    folds = max(2, min(folds, len(expected)))
+    fold = fold_ids(expected, folds, seed)
+    n = len(expected)
+    routed = np.empty(n, dtype=object)
+    final = np.empty(n, dtype=object)
+    confident = np.zeros(n, dtype=bool)
+    nll = np.zeros(n)
+    params = []
+    for k in range(folds):
+        train, test = np.flatnonzero(fold != k), np.flatnonzero(fold == k)
+        if not len(test):
+            continue
+        t, threshold, _ = _fit(scores[train], [questions[i] for i in train], [expected[i] for i in train],
+                               temperatures, thresholds)
+        params.append((t, threshold))
+        routed[test], confident[test], final[test] = _routes(scores[test], [questions[i] for i in test], t, threshold)
+        labels = np.array([AGENTS.index(expected[i]) for i in test], dtype=np.int64)
+        p = softmax_confidence(scores[test], t)[np.arange(len(test)), labels]
+        nll[test] = -np.log(np.maximum(p, 1e-12))
+
+    temperature = float(np.median([t for t, _ in params]))
+    min_confidence = float(np.median([th for _, th in params]))
+    return {
+        "temperature": round(temperature, 5),
+        "min_confidence": round(min_confidence, 3),
+        "folds": len(params),
+        "fold_params": [{"temperature": round(t, 5), "min_confidence": round(th, 3)} for t, th in params],
+        **_summary(routed, confident, final, expected),
+        "nll": round(float(nll.mean()), 4) if n else 0.0,
+    }
+
+
+def _read_store(vector_dir: str):
+    """Flat index + docstore (or mapping.json) of a store, without the app's Ollama imports."""
+    from docstore import open_docstore
+    index = faiss.read_index(index_path(vector_dir, "flat"))
+    mapping = open_docstore(vector_dir)
+    if mapping is None:
+        with open(os.path.join(vector_dir, "mapping.json"), "r", encoding="utf-8") as f:
+            mapping = json.load(f)
+    return index, mapping
+
+
+def labelled_scores(vector_dirs, questions_path: str):
+    """(router scores [n, n_agents], questions, expected agents) of the labelled questions
+    no priority rule catches; the questions are embedded with the app's model (Ollama)."""
+    from rag_agent_v2 import embed_batch
+    stores = []
+    for vector_dir in vector_dirs:
+        index, mapping = _read_store(vector_dir)
+        stores.append({"router": open_router(vector_dir, index, mapping)})
+    router = AgentRouter.from_stores(stores)
+    labelled = [(q, a) for q, a in read_labelled(questions_path) if priority_agent(q) is None]
+    questions = [q for q, _ in labelled]
+    scores = router.scores(embed_batch(questions)) if questions else np.zeros((0, len(AGENTS)))
+    return scores, questions, [a for _, a in labelled]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-agent prototypes for agent routing")
+    parser.add_argument("vector_dirs", nargs="+")
+    parser.add_argument("--eval", metavar="QUESTIONS", help="route labelled questions instead of writing")
+    parser.add_argument("--calibrate", metavar="QUESTIONS",
+                        help="fit temperature / threshold on labelled questions (k-fold) -> --out")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--out", default=ROUTER_CALIBRATION)
+    args = parser.parse_args()
+
+    if args.eval:
+        scores, questions, expected = labelled_scores(args.vector_dirs, args.eval)
+        print(json.dumps(routing_stats(scores, questions, expected, ROUTER_TEMPERATURE, ROUTER_MIN_CONFIDENCE),
+                         indent=2))
+    elif args.calibrate:
+        scores, questions, expected = labelled_scores(args.vector_dirs, args.calibrate)
+        calibration = calibrate(scores, questions, expected, folds=args.folds)
+        calibration["questions"] = args.calibrate
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(calibration, f, ensure_ascii=False, indent=2)
+        print(json.dumps(calibration, indent=2))
+        print("Saved:", args.out)
+    else:
+        for vector_dir in args.vector_dirs:
+            index, mapping = _read_store(vector_dir)
+            ids, vectors = index_vectors(index)
+            meta = write_router(vectors, store_rubrics(mapping, ids), os.path.join(vector_dir, ROUTER_DIRNAME),
+                                source_path=os.path.join(vector_dir, "mapping.json"))
+            print(f"{vector_dir}: prototypes for {meta['agents']} from {meta['counts']}, "
+                  f"left out {meta['excluded']}")
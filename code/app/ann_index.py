@@ -0,0 +1,306 @@
+# ann_index.py
+# Approximate (ANN) FAISS indexes built from the existing flat stores
+# - kinds: flat (IndexFlatIP), hnsw (IndexHNSWFlat), ivf_flat, ivf_pq
+# - written next to the flat index: faiss_index_<kind>.bin
+# - search-time tuning: nprobe (IVF) / efSearch (HNSW)
+# - recall@k vs latency report against the flat index (ground truth)
+#
+# Usage:
+#   python code/app/ann_index.py build code/embeddings/vector_store_v2 --kind hnsw
+#   python code/app/ann_index.py report code/embeddings/vector_store_v2 --k 10 --out ann_report_v2.json
+
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+def index_path(vector_dir: str, kind: str = "flat") -> str:
+    if kind == "flat":
+        return os.path.join(vector_dir, "faiss_index.bin")
+    return os.path.join(vector_dir, f"faiss_index_{kind}.bin")
+
+
+def base_index(index):
+    """Inner index of an IndexIDMap / IndexIDMap2 (incremental stores), else index."""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_vectors(index):
+    """
+    (ids [n] int64, vectors [n, d] float32) of a reconstructable index.
+    ids are the ids returned by index.search(): positions for plain
+    indexes, external ids for ID-mapped ones (may have holes).
+    """
+    if hasattr(index, "all_vectors"):
+        return index.all_vectors()  # quantized_index.RescoredIndex: exact float copy
+    inner = base_index(index)
+    vecs = np.ascontiguousarray(inner.reconstruct_n(0, inner.ntotal), dtype="float32")
+    if inner is not index:
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    else:
+        ids = np.arange(index.ntotal, dtype=np.int64)
+    return ids, vecs
+
+
+def flat_vectors(index) -> np.ndarray:
+    """All vectors of a reconstructable index, as a contiguous float32 [n, d] array."""
+    return index_vectors(index)[1]
+
+
+def default_nlist(n: int) -> int:
+    # ~39 training points per centroid is the FAISS minimum
+    return int(max(1, min(round(4 * np.sqrt(n)), n // 39)))
+
+
+PQ_POINTS_PER_CENTROID = 16
+
+
+def pq_bits(n: int, pq_nbits: int = 8) -> int:
+    """
+    Bits per PQ code for n training vectors: at least PQ_POINTS_PER_CENTROID points
+    per centroid, so the d * 2**bits float codebook stays small next to the codes
+    of a small store (256 centroids for 533 vectors cost more than the codes).
+    """
+    return int(min(pq_nbits, max(1, np.floor(np.log2(max(n // PQ_POINTS_PER_CENTROID, 2))))))
+
+
+def quiet_pq(pq):
+    """PQ k-means sized by pq_bits(): no "please provide at least ... training points" warning."""
+    pq.cp.min_points_per_centroid = PQ_POINTS_PER_CENTROID
+    return pq
+
+
+def build_index(vectors: np.ndarray, kind: str = "hnsw", m: int = 32, ef_construction: int = 200,
+                nlist: int = None, pq_m: int = 64, pq_nbits: int = 8, ids: np.ndarray = None):
+    """
+    vectors: L2-normalized float32 [n, d] (inner product = cosine)
+    ids: optional external ids (wrapped in an IndexIDMap2), default = positions
+    m: HNSW neighbors per node
+    nlist: IVF cells (default: default_nlist(n))
+    pq_m / pq_nbits: IVF-PQ sub-quantizers (must divide d) / max bits per code (pq_bits())
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, d = vectors.shape
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if kind == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, m, metric)
+        index.hnsw.efConstruction = ef_construction
+    elif kind in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatIP(d)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+        else:
+            if d % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide d={d}")
+            pq_nbits = pq_bits(n, pq_nbits)
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_nbits, metric)
+            quiet_pq(index.pq)
+        index.train(vectors)
+        # keep the quantizer alive with the index (SWIG ownership)
+        index.own_fields = True
+        quantizer.this.disown()
+    else:
+        raise ValueError(f"Unknown index kind: {kind!r} (expected one of {INDEX_KINDS})")
+
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype=np.int64))
+    else:
+        index.add(vectors)
+    return index
+
+
+def code_index(index):
+    """FAISS index searched by a quantized_index.RescoredIndex, else index."""
+    return index.index if hasattr(index, "rescore_factor") else index
+
+
+def accepts_selector(index) -> bool:
+    """False for IndexPQ, whose search rejects an IDSelector."""
+    return not isinstance(base_index(code_index(index)), faiss.IndexPQ)
+
+
+def search_params(index, nprobe: int = None, ef_search: int = None, sel=None):
+    """
+    FAISS SearchParameters for this index, or None (defaults).
+    sel: optional faiss.IDSelector restricting the searched ids
+    """
+    if nprobe is None and ef_search is None and sel is None:
+        return None
+
+    inner = base_index(code_index(index))
+    ivf = None
+    try:
+        ivf = faiss.extract_index_ivf(inner)
+    except Exception:
+        pass
+
+    if ivf is not None:
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(nprobe or ivf.nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search or inner.hnsw.efSearch)
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+def build_from_flat(vector_dir: str, kind: str, **params) -> str:
+    flat = faiss.read_index(index_path(vector_dir, "flat"))
+    ids, vectors = index_vectors(flat)
+    if base_index(flat) is flat:
+        ids = None
+    index = build_index(vectors, kind=kind, ids=ids, **params)
+    out = index_path(vector_dir, kind)
+    faiss.write_index(index, out)
+    return out
+
+
+# ----------------------------------------------------
+# RECALL / LATENCY REPORT
+# ----------------------------------------------------
+
+def sample_queries(vectors: np.ndarray, n_queries: int = 200, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """
+    Stand-in queries when no query log is available:
+    stored vectors + gaussian noise, re-normalized.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(vectors.shape[0], size=min(n_queries, vectors.shape[0]), replace=False)
+    q = vectors[rows] + rng.normal(0.0, noise, size=(len(rows), vectors.shape[1])).astype("float32")
+    q /= (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)
+    return np.ascontiguousarray(q, dtype="float32")
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray, k: int) -> float:
+    hits = 0
+    for t, f in zip(truth[:, :k], found[:, :k]):
+        hits += len(set(t.tolist()) & set(f.tolist()))
+    return hits / float(truth.shape[0] * k)
+
+
+def measure(index, queries: np.ndarray, k: int, params=None):
+    """(ids [nq, k], per-query latencies in ms), one query at a time like the app."""
+    ids = np.empty((queries.shape[0], k), dtype=np.int64)
+    lat = []
+    for i in range(queries.shape[0]):
+        t0 = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k, params=params)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        ids[i] = I[0]
+    return ids, np.array(lat)
+
+
+def _latency_summary(lat: np.ndarray) -> dict:
+    return {
+        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+        "p95_ms": round(float(np.percentile(lat, 95)), 4),
+        "mean_ms": round(float(lat.mean()), 4),
+    }
+
+
+def recall_latency_report(vector_dir: str, k: int = 10, n_queries: int = 200, queries: np.ndarray = None,
+                          kinds=("hnsw", "ivf_flat", "ivf_pq"),
+                          nprobe_grid=(1, 2, 4, 8, 16), ef_search_grid=(16, 32, 64, 128)) -> dict:
+    """
+    Build every ANN kind in memory from the flat index and sweep its tuning knob.
+    Ground truth = IndexFlatIP results for the same queries.
+    """
+    flat = faiss.read_index(index_path(vector_dir, "flat"))
+    vectors = flat_vectors(flat)
+    # ground truth on positions, like the ANN indexes built below
+    flat = build_index(vectors, kind="flat")
+    if queries is None:
+        queries = sample_queries(vectors, n_queries=n_queries)
+
+    truth, flat_lat = measure(flat, queries, k)
+    report = {
+        "vector_dir": vector_dir,
+        "ntotal": int(flat.ntotal),
+        "d": int(flat.d),
+        "k": k,
+        "n_queries": int(queries.shape[0]),
+        "results": [{"kind": "flat", "params": {}, "recall_at_k": 1.0, **_latency_summary(flat_lat)}],
+    }
+
+    for kind in kinds:
+        t0 = time.perf_counter()
+        index = build_index(vectors, kind=kind)
+        build_s = time.perf_counter() - t0
+
+        if kind == "hnsw":
+            grid = [{"ef_search": ef} for ef in ef_search_grid]
+        else:
+            nlist = faiss.extract_index_ivf(index).nlist
+            grid = [{"nprobe": p} for p in nprobe_grid if p <= nlist]
+
+        for knobs in grid:
+            found, lat = measure(index, queries, k, params=search_params(index, **knobs))
+            report["results"].append({
+                "kind": kind,
+                "params": knobs,
+                "build_s": round(build_s, 3),
+                "recall_at_k": round(recall_at_k(truth, found, k), 4),
+                **_latency_summary(lat),
+            })
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build ANN indexes / recall-latency report")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="write faiss_index_<kind>.bin from the flat index")
+    b.add_argument("vector_dir")
+    b.add_argument("--kind", choices=INDEX_KINDS[1:], default="hnsw")
+    b.add_argument("--m", type=int, default=32, help="HNSW neighbors")
+    b.add_argument("--ef-construction", type=int, default=200)
+    b.add_argument("--nlist", type=int, default=None)
+    b.add_argument("--pq-m", type=int, default=64)
+    b.add_argument("--pq-nbits", type=int, default=8)
+
+    r = sub.add_parser("report", help="recall@k vs latency against the flat index")
+    r.add_argument("vector_dir")
+    r.add_argument("--k", type=int, default=10)
+    r.add_argument("--queries", type=int, default=200)
+    r.add_argument("--queries-npy", default=None, help="optional [nq, d] float32 query vectors")
+    r.add_argument("--out", default=None, help="write the JSON report here")
+
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        out = build_from_flat(
+            args.vector_dir, args.kind,
+            m=args.m, ef_construction=args.ef_construction,
+            nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits,
+        )
+        print("Saved:", out)
+    else:
+        queries = np.load(args.queries_npy).astype("float32") if args.queries_npy else None
+        rep = recall_latency_report(args.vector_dir, k=args.k, n_queries=args.queries, queries=queries)
+        for row in rep["results"]:
+            print(f'{row["kind"]:9s} {json.dumps(row["params"]):18s} '
+                  f'recall@{args.k}={row["recall_at_k"]:.3f}  p50={row["p50_ms"]:.3f}ms  p95={row["p95_ms"]:.3f}ms')
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(rep, f, indent=2)
+            print("Saved:", args.out)
@@ -0,0 +1,166 @@
+# answer_cache.py
+# Semantic answer cache in front of ask_agent()
+# - Hit = same agent prompt + same retrieved chunk ids + question embedding
+#   within a cosine threshold of a cached question
+# - Keyword-only questions (answered from BM25, not embedded): same normalized text instead
+# - TTL + max size eviction (oldest first)
+# - Invalidated when the vector stores change (store fingerprint: index, mapping and the
+#   docstore/ lexical/ router/ manifests of the loaded stores; the registry re-reads it from
+#   disk every ESILV_STORE_CHECK_S seconds and reloads the stores when it changed)
+# - An answer computed on stores reloaded meanwhile is not stored (store(fingerprint=...))
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embed_cache import normalize_text
+
+
+# per-store sub-directories whose meta.json is rewritten on every rebuild
+FINGERPRINT_SUBDIRS = ("docstore", "lexical", "router")
+
+
+def store_fingerprint(vector_dirs) -> str:
+    """
+    sha1 over (path, size, mtime) of every file of the given vector stores and
+    of the meta.json of their docstore/, lexical/ and router/ sub-directories.
+    """
+    h = hashlib.sha1()
+    for d in vector_dirs:
+        if not os.path.isdir(d):
+            h.update(f"{d}:missing".encode("utf-8"))
+            continue
+        paths = [os.path.join(d, fn) for fn in sorted(os.listdir(d))]
+        paths += [os.path.join(d, sub, "meta.json") for sub in FINGERPRINT_SUBDIRS]
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _prompt_key(agent_prompt: str) -> str:
+    return hashlib.sha1((agent_prompt or "").encode("utf-8")).hexdigest()
+
+
+def _group_key(q_vec, agent_prompt: str, chunk_ids, question: str):
+    # no question vector: the text itself is part of the key (exact match)
+    text = normalize_text(question) if q_vec is None else None
+    return _prompt_key(agent_prompt), tuple(chunk_ids), text
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 6 * 3600,
+                 max_items: int = 512, fingerprint_fn=None):
+        """
+        threshold: minimal cosine similarity between question embeddings
+        fingerprint_fn: callable returning the current store fingerprint (called on
+                        every lookup / store: keep it cheap); the cache is
+                        cleared whenever it changes
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.fingerprint_fn = fingerprint_fn
+        self._fingerprint = fingerprint_fn() if fingerprint_fn else None
+
+        # entry_id -> (group_key, q_vec, answer, created_at), oldest first
+        self._entries = OrderedDict()
+        # (prompt_key, chunk_ids, text or None) -> [entry_id, ...]
+        self._groups = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_fingerprint(self):
+        if self.fingerprint_fn is None:
+            return
+        fp = self.fingerprint_fn()
+        if fp != self._fingerprint:
+            self._fingerprint = fp
+            self._entries.clear()
+            self._groups.clear()
+            self.invalidations += 1
+
+    def _drop(self, entry_id):
+        group_key = self._entries.pop(entry_id)[0]
+        ids = self._groups.get(group_key, [])
+        if entry_id in ids:
+            ids.remove(entry_id)
+        if not ids:
+            self._groups.pop(group_key, None)
+
+    def _expire(self, now: float):
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if now - entry[3] <= self.ttl_seconds and len(self._entries) <= self.max_items:
+                break
+            self._drop(entry_id)
+
+    def lookup(self, q_vec: np.ndarray, agent_prompt: str, chunk_ids, question: str = None):
+        """question: required when q_vec is None (keyword-only questions)."""
+        if q_vec is None and question is None:
+            return None
+        group_key = _group_key(q_vec, agent_prompt, chunk_ids, question)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint()
+            self._expire(now)
+
+            ids = self._groups.get(group_key)
+            if ids and q_vec is None:
+                self.hits += 1
+                return self._entries[ids[-1]][2]
+            if ids:
+                vecs = np.stack([self._entries[i][1] for i in ids])
+                sims = vecs @ np.asarray(q_vec, dtype="float32")
+                best = int(np.argmax(sims))
+                if float(sims[best]) >= self.threshold:
+                    self.hits += 1
+                    return self._entries[ids[best]][2]
+
+            self.misses += 1
+            return None
+
+    def current_fingerprint(self):
+        return self.fingerprint_fn() if self.fingerprint_fn else None
+
+    def store(self, q_vec: np.ndarray, agent_prompt: str, chunk_ids, answer: str, question: str = None,
+              fingerprint=None):
+        """fingerprint: current_fingerprint() before the retrieval; the answer is dropped if it changed since."""
+        if q_vec is None and question is None:
+            return
+        group_key = _group_key(q_vec, agent_prompt, chunk_ids, question)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint()
+            if fingerprint is not None and fingerprint != self._fingerprint:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            vec = None if q_vec is None else np.asarray(q_vec, dtype="float32")
+            self._entries[entry_id] = (group_key, vec, answer, now)
+            self._groups.setdefault(group_key, []).append(entry_id)
+            self._expire(now)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
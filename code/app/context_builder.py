@@ -0,0 +1,171 @@
+# context_builder.py
+# Prompt context for llama3.2 within a token budget (replaces content[:1100] per hit)
+# - strips the "SOURCE: pdf PDF_NAME: ... RUBRIC: ... TEXT: " header embedded in v3 chunks
+#   (the url already says which pdf / page)
+# - merges the parts of one pdf page found among the hits, in part_index order
+# - drops sentences already given by a better-ranked chunk (normalized, near-duplicates)
+# - packs chunks greedily by score until ESILV_CONTEXT_TOKENS; the last one is cut
+#   at a sentence boundary, a chunk is never longer than ESILV_CONTEXT_CHUNK_TOKENS
+# Tokens are estimated from the length (ESILV_CHARS_PER_TOKEN), no tokenizer call.
+#
+# Same line format as before: "- [store] text (source: url)" (the guardrails read the urls).
+
+import functools
+import math
+import os
+import re
+import unicodedata
+
+BUDGET_TOKENS = int(os.environ.get("ESILV_CONTEXT_TOKENS", "1500"))
+CHUNK_TOKENS = int(os.environ.get("ESILV_CONTEXT_CHUNK_TOKENS", "350"))
+CHARS_PER_TOKEN = float(os.environ.get("ESILV_CHARS_PER_TOKEN", "3.5"))
+
+MIN_FILL_TOKENS = 40        # below this, do not add a truncated chunk
+NEAR_DUP_JACCARD = 0.8      # word overlap above which a sentence counts as already seen
+MIN_DUP_WORDS = 4           # shorter sentences ("I", "ESILV", ...) are only dropped on exact match
+
+HEADER_RE = re.compile(r"^\s*SOURCE:\s*pdf\s+PDF_NAME:.*?\bTEXT:\s*", re.S)
+SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+|\s+[–•]\s+")
+WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def strip_header(text: str) -> str:
+    return HEADER_RE.sub("", text, count=1)
+
+
+def _clean(text: str) -> str:
+    text = strip_header(text or "")
+    text = re.sub(r"\.{2,}", ".", text)  # scraped "..", "..."
+    return re.sub(r"\s+", " ", text).strip()
+
+
+@functools.lru_cache(maxsize=8192)
+def _norm_words(sentence: str):
+    s = unicodedata.normalize("NFKD", sentence.lower()).encode("ascii", "ignore").decode("ascii")
+    return tuple(WORD_RE.findall(s))
+
+
+# ----------------------------------------------------
+# MERGE / DEDUP
+# ----------------------------------------------------
+
+def merge_page_parts(hits):
+    """
+    Groups of hits, best first: the parts of one pdf page become one group
+    (ranked at its best part). Each group: {"store", "url", "score", "text"}.
+    """
+    groups = []
+    by_page = {}
+    for h in hits:
+        doc = h["doc"]
+        parts = doc.get("parts_count") or 1
+        key = None
+        if parts > 1 and doc.get("part_index") is not None:
+            key = (h["store"], doc.get("source_file") or doc.get("url"), doc.get("page"))
+        if key is not None and key in by_page:
+            by_page[key]["parts"].append((doc["part_index"], doc.get("content") or ""))
+            continue
+        g = {"store": h["store"], "url": doc.get("url", ""), "score": h["score"],
+             "parts": [(doc.get("part_index") or 0, doc.get("content") or "")]}
+        groups.append(g)
+        if key is not None:
+            by_page[key] = g
+
+    for g in groups:
+        g["parts"].sort(key=lambda p: p[0])
+        g["text"] = " ".join(_clean(c) for _, c in g.pop("parts"))
+    return groups
+
+
+class SentenceDeduper:
+    """Remembers the sentences put in the context; is_new() is False for (near-)repeats."""
+
+    def __init__(self, threshold: float = NEAR_DUP_JACCARD):
+        self.threshold = threshold
+        self.exact = set()
+        self.seen = []                 # word sets of the kept sentences
+        self.by_word = {}              # word -> indexes in self.seen (candidates)
+
+    def is_new(self, sentence: str) -> bool:
+        words = _norm_words(sentence)
+        if not words or " ".join(words) in self.exact:
+            return False
+        ws = set(words)
+        if len(ws) >= MIN_DUP_WORDS:
+            candidates = set()
+            for w in ws:
+                if len(w) > 3:  # "de", "la", "les" would make every sentence a candidate
+                    candidates.update(self.by_word.get(w, ()))
+            for j in candidates:
+                other = self.seen[j]
+                if len(ws & other) / len(ws | other) >= self.threshold:
+                    return False
+        return True
+
+    def add(self, sentence: str):
+        words = _norm_words(sentence)
+        self.exact.add(" ".join(words))
+        ws = set(words)
+        self.seen.append(ws)
+        for w in ws:
+            self.by_word.setdefault(w, []).append(len(self.seen) - 1)
+
+
+# ----------------------------------------------------
+# PACKING
+# ----------------------------------------------------
+
+def _fit(sentences, max_tokens: int):
+    """Leading sentences within max_tokens (the first one is cut on words if needed)."""
+    out, used = [], 0
+    for s in sentences:
+        cost = estimate_tokens(s) + 1
+        if used + cost > max_tokens:
+            if not out:
+                words, max_chars = s.split(" "), int(max_tokens * CHARS_PER_TOKEN)
+                cut = ""
+                for w in words:
+                    if len(cut) + len(w) + 1 > max_chars:
+                        break
+                    cut = f"{cut} {w}" if cut else w
+                if cut:
+                    out.append(cut + " …")
+            break
+        out.append(s)
+        used += cost
+    return out
+
+
+def build_context(hits, budget_tokens: int = None, chunk_tokens: int = None) -> str:
+    budget = BUDGET_TOKENS if budget_tokens is None else budget_tokens
+    chunk_cap = CHUNK_TOKENS if chunk_tokens is None else chunk_tokens
+
+    dedup = SentenceDeduper()
+    lines, used = [], 0
+    for g in merge_page_parts(hits):
+        sentences = []
+        local = SentenceDeduper()  # repeats inside the chunk itself
+        for s in SENTENCE_RE.split(g["text"]):
+            if s and dedup.is_new(s) and local.is_new(s):
+                local.add(s)
+                sentences.append(s)
+        if not sentences:
+            continue
+        prefix, suffix = f"- [{g['store']}] ", f" (source: {g['url']})"
+        overhead = estimate_tokens(prefix + suffix)
+        room = min(chunk_cap, budget - used - overhead)
+        if room < MIN_FILL_TOKENS:
+            break
+        kept = _fit(sentences, room)
+        if not kept:
+            continue
+        for s in kept:
+            dedup.add(s)
+        line = prefix + " ".join(kept) + suffix
+        lines.append(line)
+        used += estimate_tokens(line) + 1
+    return "\n".join(lines)
@@ -0,0 +1,339 @@
+# docstore.py
+# Compact, memory-mapped document store (replaces mapping.json at query time)
+# Layout (<vector_dir>/docstore/):
+#   meta.json                    columns, types, categories, source mapping.json stamp
+#                                (size, mtime_ns, sha1: a rewritten mapping makes it stale)
+#   present.npy                  uint8 [n]   row exists (ids may have holes)
+#   <col>.offsets.npy + .blob    text column: int64 offsets [n+1] + UTF-8 blob
+#   <col>.codes.npy              category column: int32 codes (-1 = missing)
+#   <col>.npy                    int column: int64 (INT_MISSING = missing)
+#   <col>.has.npy / .null.npy    optional masks: key absent / explicit null
+# The v3 "SOURCE: pdf PDF_NAME: ... TEXT: " header is not stored twice:
+# it is rebuilt from the metadata columns (content_header.npy flag).
+#
+# Convert existing stores:
+#   python code/app/docstore.py code/embeddings/vector_store_v2 code/embeddings/vector_store_v3
+
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+DOCSTORE_DIRNAME = "docstore"
+FORMAT_VERSION = 1
+INT_MISSING = np.iinfo(np.int64).min
+
+# Low-cardinality text columns are dictionary-encoded
+CATEGORY_MAX_RATIO = 0.5
+
+
+def pdf_header(rubric, pdf_name, pdf_id, page) -> str:
+    # Same header as embed_esilv_v3.ipynb, whitespace-collapsed by smart_split()
+    return f"SOURCE: pdf PDF_NAME: {pdf_name} PDF_ID: {pdf_id} PAGE: {page} RUBRIC: {rubric} TEXT: "
+
+
+def _doc_header(doc: dict) -> str:
+    if not all(k in doc for k in ("rubric", "pdf_name", "source_file", "page")):
+        return ""
+    return pdf_header(doc["rubric"], doc["pdf_name"], doc["source_file"], doc["page"])
+
+
+# ----------------------------------------------------
+# WRITER / CONVERTER
+# ----------------------------------------------------
+
+def _column_kind(values) -> str:
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+        return "int"
+    if all(isinstance(v, str) for v in present):
+        uniq = len(set(present))
+        if present and uniq <= max(1, int(len(present) * CATEGORY_MAX_RATIO)):
+            return "category"
+        return "text"
+    return "json"
+
+
+def _write_text_column(out_dir: str, name: str, values):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(os.path.join(out_dir, f"{name}.blob"), "wb") as f:
+        pos = 0
+        for i, v in enumerate(values):
+            if v is not None:
+                b = v.encode("utf-8")
+                f.write(b)
+                pos += len(b)
+            offsets[i + 1] = pos
+    np.save(os.path.join(out_dir, f"{name}.offsets.npy"), offsets)
+
+
+def source_stamp(path: str) -> dict:
+    """Size, mtime and content hash of the mapping.json a docstore is built from."""
+    st = os.stat(path)
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": h.hexdigest()}
+
+
+def same_source(path: str, stamp: dict) -> bool:
+    """
+    True when path is still the file stamped. Same size and mtime: yes without
+    reading it; same size, other mtime (git checkout, copy): compare the hash.
+    """
+    st = os.stat(path)
+    if st.st_size != stamp.get("size"):
+        return False
+    if st.st_mtime_ns == stamp.get("mtime_ns"):
+        return True
+    return source_stamp(path)["sha1"] == stamp.get("sha1")
+
+
+def write_docstore(mapping: dict, out_dir: str, source_path: str = None) -> dict:
+    """
+    Write a mapping {"<id>": {...}} as a columnar docstore in out_dir.
+    source_path: the mapping.json it comes from (staleness check of open_docstore)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    n = (max(int(k) for k in mapping) + 1) if mapping else 0
+    rows = [None] * n
+    for k, doc in mapping.items():
+        rows[int(k)] = doc
+
+    present = np.array([r is not None for r in rows], dtype=np.uint8)
+    np.save(os.path.join(out_dir, "present.npy"), present)
+
+    # column order = first-seen key order (keeps dicts looking like mapping.json)
+    col_names = []
+    for r in rows:
+        for key in (r or {}):
+            if key not in col_names:
+                col_names.append(key)
+
+    # strip the duplicated pdf header from content
+    header_flag = np.zeros(n, dtype=np.uint8)
+    content_values = []
+    for i, r in enumerate(rows):
+        c = (r or {}).get("content")
+        h = _doc_header(r or {})
+        if isinstance(c, str) and h and c.startswith(h):
+            header_flag[i] = 1
+            c = c[len(h):]
+        content_values.append(c)
+    if header_flag.any():
+        np.save(os.path.join(out_dir, "content_header.npy"), header_flag)
+
+    columns = []
+    for name in col_names:
+        if name == "content":
+            values = content_values
+        else:
+            values = [(r or {}).get(name) if r is not None and name in r else None for r in rows]
+        has_key = np.array([r is not None and name in r for r in rows], dtype=np.uint8)
+        kind = _column_kind(values)
+        col = {"name": name, "kind": kind}
+
+        if kind == "int":
+            arr = np.array([INT_MISSING if v is None else v for v in values], dtype=np.int64)
+            np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+        elif kind == "category":
+            cats = sorted({v for v in values if v is not None})
+            code_of = {c: j for j, c in enumerate(cats)}
+            codes = np.array([-1 if v is None else code_of[v] for v in values], dtype=np.int32)
+            np.save(os.path.join(out_dir, f"{name}.codes.npy"), codes)
+            col["categories"] = cats
+        elif kind == "text":
+            _write_text_column(out_dir, name, values)
+        else:
+            _write_text_column(out_dir, name, [
+                None if v is None else json.dumps(v, ensure_ascii=False) for v in values
+            ])
+
+        # rows without this key / explicit nulls in text columns
+        if (has_key != present).any():
+            np.save(os.path.join(out_dir, f"{name}.has.npy"), has_key)
+            col["has_mask"] = True
+        is_null = np.array([bool(h) and v is None for h, v in zip(has_key, values)], dtype=np.uint8)
+        if kind in ("text", "json") and is_null.any():
+            np.save(os.path.join(out_dir, f"{name}.null.npy"), is_null)
+            col["null_mask"] = True
+        columns.append(col)
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "n": n,
+        "count": int(present.sum()),
+        "columns": columns,
+        "content_header": bool(header_flag.any()),
+        "source": source_stamp(source_path) if source_path else None,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def convert_mapping(vector_dir: str) -> dict:
+    """mapping.json -> <vector_dir>/docstore/"""
+    map_path = os.path.join(vector_dir, "mapping.json")
+    with open(map_path, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+    out_dir = os.path.join(vector_dir, DOCSTORE_DIRNAME)
+    return write_docstore(mapping, out_dir, source_path=map_path)
+
+
+# ----------------------------------------------------
+# READER
+# ----------------------------------------------------
+
+class DocStore:
+    """
+    Read-only, lazily memory-mapped docstore.
+    Dict-like on ids (int or "int" keys) so it can replace a mapping.json dict.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported docstore version in {path}: {self.meta.get('version')}")
+        self.n = self.meta["n"]
+        self._cols = {c["name"]: c for c in self.meta["columns"]}
+        self._arrays = {}
+
+    def _npy(self, fname: str):
+        a = self._arrays.get(fname)
+        if a is None:
+            a = np.load(os.path.join(self.path, fname), mmap_mode="r")
+            self._arrays[fname] = a
+        return a
+
+    def _blob(self, name: str):
+        fname = f"{name}.blob"
+        a = self._arrays.get(fname)
+        if a is None:
+            full = os.path.join(self.path, fname)
+            # np.memmap refuses empty files
+            a = np.memmap(full, dtype=np.uint8, mode="r") if os.path.getsize(full) else np.zeros(0, np.uint8)
+            self._arrays[fname] = a
+        return a
+
+    @staticmethod
+    def _to_id(key):
+        try:
+            return int(key)
+        except (TypeError, ValueError):
+            return -1
+
+    # --- dict-like API ---
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def __contains__(self, key):
+        i = self._to_id(key)
+        return 0 <= i < self.n and bool(self._npy("present.npy")[i])
+
+    def __getitem__(self, key):
+        doc = self.get(key)
+        if doc is None:
+            raise KeyError(key)
+        return doc
+
+    def get(self, key, default=None):
+        i = self._to_id(key)
+        if not (0 <= i < self.n) or not self._npy("present.npy")[i]:
+            return default
+
+        doc = {}
+        for name, col in self._cols.items():
+            if col.get("has_mask") and not self._npy(f"{name}.has.npy")[i]:
+                continue
+            doc[name] = self.field(i, name)
+        if self.meta.get("content_header") and "content" in doc and self._npy("content_header.npy")[i]:
+            doc["content"] = _doc_header(doc) + doc["content"]
+        return doc
+
+    def keys(self):
+        present = self._npy("present.npy")
+        return [str(i) for i in np.flatnonzero(present)]
+
+    def values(self):
+        return [self.get(k) for k in self.keys()]
+
+    def items(self):
+        return [(k, self.get(k)) for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    # --- columnar API ---
+
+    def field(self, i: int, name: str):
+        """Single field of row i (content without the rebuilt pdf header)."""
+        col = self._cols[name]
+        kind = col["kind"]
+        if kind == "int":
+            v = int(self._npy(f"{name}.npy")[i])
+            return None if v == INT_MISSING else v
+        if kind == "category":
+            code = int(self._npy(f"{name}.codes.npy")[i])
+            return None if code < 0 else col["categories"][code]
+
+        if col.get("null_mask") and self._npy(f"{name}.null.npy")[i]:
+            return None
+        offsets = self._npy(f"{name}.offsets.npy")
+        a, b = int(offsets[i]), int(offsets[i + 1])
+        s = bytes(self._blob(name)[a:b]).decode("utf-8")
+        return json.loads(s) if kind == "json" else s
+
+    def column(self, name: str):
+        """Whole column as a numpy array (codes for category columns)."""
+        kind = self._cols[name]["kind"]
+        if kind == "int":
+            return self._npy(f"{name}.npy")
+        if kind == "category":
+            return self._npy(f"{name}.codes.npy")
+        raise ValueError(f"Column {name!r} is a {kind} column")
+
+    def ids(self) -> np.ndarray:
+        """Ids of the present rows (int64), in order."""
+        return np.flatnonzero(self._npy("present.npy")).astype(np.int64)
+
+    def categories(self, name: str):
+        return list(self._cols[name].get("categories", []))
+
+    def columns(self):
+        return list(self._cols)
+
+
+def open_docstore(vector_dir: str):
+    """
+    Return the DocStore of vector_dir, or None if it is missing or
+    out of date with mapping.json (mapping rewritten by a notebook, or a
+    docstore without a source stamp: rebuild it with convert_mapping).
+    """
+    path = os.path.join(vector_dir, DOCSTORE_DIRNAME)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    store = DocStore(path)
+    map_path = os.path.join(vector_dir, "mapping.json")
+    if os.path.exists(map_path):
+        stamp = store.meta.get("source")
+        if stamp is None or not same_source(map_path, stamp):
+            return None
+    return store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python docstore.py <vector_dir> [<vector_dir> ...]")
+        sys.exit(1)
+
+    for d in sys.argv[1:]:
+        meta = convert_mapping(d)
+        print(f"{d}: {meta['count']} docs, {len(meta['columns'])} columns -> {os.path.join(d, DOCSTORE_DIRNAME)}")
@@ -0,0 +1,287 @@
+# embed_cache.py
+# Embedding caches shared by the RAG app and the indexers
+# - Bounded in-memory LRU (thread-safe, Streamlit runs sessions in threads)
+# - Persistent layers that survive restarts:
+#     VectorFileStore: content-addressed (model, text_key(text)), memory-mapped
+#                      vector file + index, shared with code/embeddings/indexing.py
+# - One key for every layer and caller: text_key() = sha1 of the NFC, whitespace-collapsed
+#   text (case kept, the embedding model is case-sensitive)
+# - Keys include the model name: a model swap never serves stale vectors
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl  # cross-process append lock (POSIX)
+except ImportError:
+    fcntl = None
+
+# Default location of the shared on-disk embedding cache (git-ignored)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embeddings", "cache", "vectors")
+
+
+# Bumped when the key derivation changes: older index.tsv entries are simply never hit
+KEY_VERSION = "2"
+
+
+def normalize_text(text: str) -> str:
+    """NFC + collapsed whitespace (same text => same key). Case is kept."""
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(text: str) -> str:
+    """Cache key of a text, shared by the query path and the indexers."""
+    return hashlib.sha1(f"{KEY_VERSION}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+# ----------------------------------------------------
+# PERSISTENT LAYER (content-addressed, memory-mapped)
+# ----------------------------------------------------
+
+def _model_dirname(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+
+
+class _ModelFile:
+    """vectors.f32 (append-only rows) + index.tsv ("sha1<TAB>row") of one model."""
+
+    def __init__(self, root: str, model: str):
+        self.dir = os.path.join(root, _model_dirname(model))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vec_path = os.path.join(self.dir, "vectors.f32")
+        self.idx_path = os.path.join(self.dir, "index.tsv")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.model = model
+        self.dim = None
+        self.rows = {}
+        self._idx_read = 0      # bytes of index.tsv already parsed
+        self._mm = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+    def refresh(self):
+        """Pick up rows appended by other processes (indexer / other workers)."""
+        if not os.path.exists(self.idx_path):
+            return
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if os.path.getsize(self.idx_path) <= self._idx_read:
+            return
+        with open(self.idx_path, "rb") as f:
+            f.seek(self._idx_read)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # ignore a partially written last line
+        for line in data[:end].decode("utf-8").splitlines():
+            key, _, row = line.partition("\t")
+            if row:
+                self.rows[key] = int(row)
+        self._idx_read += end
+
+    def vector(self, row: int):
+        if self._mm is None or row >= self._mm.shape[0]:
+            n = os.path.getsize(self.vec_path) // (4 * self.dim)
+            if row >= n:
+                return None
+            self._mm = np.memmap(self.vec_path, dtype="float32", mode="r", shape=(n, self.dim))
+        return np.array(self._mm[row])
+
+    def append(self, items):
+        """items: [(key, vec)], appended under an exclusive file lock."""
+        dim = int(items[0][1].shape[0])
+        if self.dim is None:
+            self.dim = dim
+            if not os.path.exists(self.meta_path):
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model, "dim": dim}, f)
+        if dim != self.dim:
+            raise ValueError(f"{self.model}: cached dim {self.dim} != {dim}")
+
+        with open(self.idx_path, "a", encoding="utf-8") as idx_f:
+            if fcntl is not None:
+                fcntl.flock(idx_f, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                items = [(k, v) for k, v in items if k not in self.rows]
+                if not items:
+                    return
+                row = os.path.getsize(self.vec_path) // (4 * dim) if os.path.exists(self.vec_path) else 0
+                block = np.ascontiguousarray(np.stack([v for _, v in items]), dtype="float32")
+                # vectors first, then the index lines: readers never see a row without its data
+                with open(self.vec_path, "ab") as vec_f:
+                    vec_f.write(block.tobytes())
+                lines = []
+                for i, (k, _) in enumerate(items):
+                    lines.append(f"{k}\t{row + i}\n")
+                    self.rows[k] = row + i
+                idx_f.write("".join(lines))
+                idx_f.flush()
+                self._idx_read = idx_f.tell()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(idx_f, fcntl.LOCK_UN)
+
+
+class VectorFileStore:
+    """
+    Content-addressed embedding cache on disk, keyed by (model, text_key(text)).
+    One directory per model: vectors.f32 (memory-mapped, append-only) + index.tsv.
+    Safe to share between processes (indexers, Streamlit workers) on POSIX.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR):
+        self.root = root
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _file(self, model: str) -> _ModelFile:
+        f = self._files.get(model)
+        if f is None:
+            f = self._files[model] = _ModelFile(self.root, model)
+            f.refresh()
+        return f
+
+    def get(self, model: str, text: str):
+        key = text_key(text)
+        with self._lock:
+            f = self._file(model)
+            row = f.rows.get(key)
+            if row is None:
+                f.refresh()
+                row = f.rows.get(key)
+            return None if row is None else f.vector(row)
+
+    def get_many(self, model: str, texts):
+        with self._lock:
+            f = self._file(model)
+            f.refresh()
+            out = []
+            for t in texts:
+                row = f.rows.get(text_key(t))
+                out.append(None if row is None else f.vector(row))
+            return out
+
+    def put(self, model: str, text: str, vec: np.ndarray):
+        self.put_many(model, [text], [vec])
+
+    def put_many(self, model: str, texts, vecs):
+        items = [(text_key(t), np.asarray(v, dtype="float32")) for t, v in zip(texts, vecs)]
+        if not items:
+            return
+        with self._lock:
+            self._file(model).append(items)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(f.rows) for f in self._files.values())
+
+
+# ----------------------------------------------------
+# LRU + PERSISTENT CACHE
+# ----------------------------------------------------
+
+class EmbeddingCache:
+    def __init__(self, max_items: int = 2048, persistent=None):
+        """
+        max_items: bound of the in-memory LRU
+        persistent: optional store with get(model, text) / put(model, text, vec)
+        """
+        self.max_items = max_items
+        self.persistent = persistent
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def lookup(self, model: str, text: str):
+        """Cached vector for (model, text_key(text)), or None. Misses are counted by store()."""
+        key = (model, text_key(text))
+
+        with self._lock:
+            v = self._lru.get(key)
+            if v is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return v
+
+        if self.persistent is not None:
+            v = self.persistent.get(model, text)
+            if v is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, v)
+                return v
+        return None
+
+    def store(self, model: str, text: str, vec: np.ndarray) -> np.ndarray:
+        v = np.array(vec, dtype="float32")  # own copy (vec may be a row of a batch)
+        with self._lock:
+            self.misses += 1
+        self._remember((model, text_key(text)), v)
+        if self.persistent is not None:
+            self.persistent.put(model, text, v)
+        return v
+
+    def get_or_compute(self, model: str, text: str, compute):
+        """
+        Return the cached vector for (model, text_key(text)), or call
+        compute(text) on a miss and store the result.
+        """
+        v = self.lookup(model, text)
+        if v is not None:
+            return v
+        return self.store(model, text, compute(text))
+
+    def get_or_compute_many(self, model: str, texts, compute_many):
+        """
+        Batched variant: compute_many(list_of_texts) -> [n, d] is called once
+        with the misses only (duplicates in `texts` are computed once).
+        """
+        out = [self.lookup(model, t) for t in texts]
+        todo = {}
+        for i, v in enumerate(out):
+            if v is None:
+                todo.setdefault(text_key(texts[i]), []).append(i)
+        if todo:
+            firsts = [texts[ids[0]] for ids in todo.values()]
+            vecs = compute_many(firsts)
+            for ids, text, vec in zip(todo.values(), firsts, vecs):
+                v = self.store(model, text, vec)
+                for i in ids:
+                    out[i] = v
+        return out
+
+    def _remember(self, key, v: np.ndarray):
+        # cached vectors are shared between callers: make them read-only
+        v.setflags(write=False)
+        with self._lock:
+            self._lru[key] = v
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._lru),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,277 @@
+# lexical_index.py
+# BM25 inverted index over the chunks of a store, for the exact tokens embeddings miss
+# ("BUT", "BTS", "alternance", program names...)
+# - French tokenizer: lowercase, accent folding, elisions (l', d', qu'...), stop words,
+#   plural s/x stripped
+# - written at index time next to the FAISS index: <vector_dir>/lexical/
+#   (vocab.json + CSR postings in .npy files, memory-mapped at load), stamped with the
+#   mapping.json it was built from (docstore.source_stamp): rebuilt in memory when stale
+# - rrf_fuse(): reciprocal rank fusion of the vector and BM25 rankings ("fused_score";
+#   "score" stays the cosine, "bm25" the BM25 score)
+# - is_keyword_query(): "BTS alternance" -> BM25 only, no Ollama embedding call, when one
+#   term is rare in the stores (idf >= ESILV_KEYWORD_MIN_IDF, "bts" yes, "esilv ingénieur" no)
+#
+# Build for existing stores:
+#   python code/app/lexical_index.py code/embeddings/vector_store_v2 code/embeddings/vector_store_v3
+
+import json
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from context_builder import strip_header
+from docstore import same_source, source_stamp
+
+LEXICAL_DIRNAME = "lexical"
+FORMAT_VERSION = 1
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+KEYWORD_MAX_TERMS = 3
+# a keyword query skips the embedding only if one of its terms is this rare (~8% of the chunks or less)
+KEYWORD_MIN_IDF = float(os.environ.get("ESILV_KEYWORD_MIN_IDF", "2.5"))
+
+ELISION_RE = re.compile(r"\b(?:[cdjlmnst]|qu|jusqu|lorsqu|puisqu)['’]", re.I)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset("""
+a ai au aux avec ce ces cet cette d de des du elle elles en est et etre il ils je la le les leur leurs
+l lui ma mais me mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sont sur ta
+te tes toi ton tu un une vos votre vous y dans plus comme quel quelle quels quelles quoi comment combien
+pourquoi quand ou peut faut fait etc ete avoir
+""".split())
+
+QUESTION_WORDS = frozenset("quel quelle quels quelles quoi comment combien pourquoi quand ou qui que est".split())
+
+
+def fold(text: str) -> str:
+    """Lowercase, accents removed ("Échange" -> "echange")."""
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+
+def _words(text: str):
+    return TOKEN_RE.findall(fold(ELISION_RE.sub(" ", text)))
+
+
+def _stem(w: str) -> str:
+    if len(w) > 4 and w[-1] in "sx" and not w.endswith("ss"):
+        return w[:-1]
+    return w
+
+
+def tokenize(text: str):
+    return [_stem(w) for w in _words(text) if w not in STOP_WORDS]
+
+
+def is_keyword_query(question: str) -> bool:
+    """A few terms, no question form: "BTS alternance", "double diplôme"."""
+    if "?" in question:
+        return False
+    words = _words(question)
+    if not words or len(words) > KEYWORD_MAX_TERMS + 1 or any(w in QUESTION_WORDS for w in words):
+        return False
+    return 0 < len(tokenize(question)) <= KEYWORD_MAX_TERMS
+
+
+def doc_text(doc: dict) -> str:
+    return f'{doc.get("title") or ""} {strip_header(doc.get("content") or "")}'
+
+
+# ----------------------------------------------------
+# BUILD / WRITE
+# ----------------------------------------------------
+
+ARRAYS = ("indptr", "rows", "tf", "doc_ids", "doc_len")
+
+
+def build_postings(mapping):
+    """mapping (dict or DocStore: id -> doc) -> (arrays, terms, meta), CSR postings by term."""
+    doc_ids, doc_len, postings = [], [], {}
+    for key, doc in mapping.items():
+        counts = Counter(tokenize(doc_text(doc or {})))
+        row = len(doc_ids)
+        doc_ids.append(int(key))
+        doc_len.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((row, tf))
+
+    terms = sorted(postings)
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    rows, tfs = [], []
+    for t, term in enumerate(terms):
+        plist = postings[term]
+        indptr[t + 1] = indptr[t] + len(plist)
+        rows.extend(r for r, _ in plist)
+        tfs.extend(tf for _, tf in plist)
+
+    arrays = {
+        "indptr": indptr,
+        "rows": np.asarray(rows, dtype=np.int32),
+        "tf": np.asarray(tfs, dtype=np.float32),
+        "doc_ids": np.asarray(doc_ids, dtype=np.int64),
+        "doc_len": np.asarray(doc_len, dtype=np.float32),
+    }
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "n_docs": len(doc_ids),
+        "n_terms": len(terms),
+        "avg_doc_len": float(np.mean(doc_len)) if doc_len else 0.0,
+    }
+    return arrays, terms, meta
+
+
+def write_lexical(mapping, out_dir: str, source_path: str = None) -> dict:
+    """
+    Postings of mapping -> <out_dir>/ (built at index time). Returns meta.
+    source_path: the mapping.json it comes from (staleness check of open_lexical)
+    """
+    arrays, terms, meta = build_postings(mapping)
+    if source_path is not None:
+        meta["source"] = source_stamp(source_path)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, f"{name}.npy"), arrays[name])
+    with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+# ----------------------------------------------------
+# READER
+# ----------------------------------------------------
+
+class LexicalIndex:
+    def __init__(self, arrays: dict, terms, meta: dict, k1: float = BM25_K1, b: float = BM25_B):
+        self.meta = meta
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.indptr = arrays["indptr"]
+        self.rows = arrays["rows"]
+        self.tf = arrays["tf"]
+        self.doc_ids = arrays["doc_ids"]
+        self.doc_len = np.asarray(arrays["doc_len"])
+        self.n_docs = int(meta["n_docs"])
+
+        df = np.diff(np.asarray(self.indptr)).astype(np.float32)
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+        avg = meta["avg_doc_len"] or 1.0
+        self.k1 = k1
+        self.norm = k1 * (1.0 - b + b * self.doc_len / avg)   # per-doc length normalization
+
+    @classmethod
+    def load(cls, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"lexical index format {meta.get('format_version')} != {FORMAT_VERSION}")
+        with open(os.path.join(path, "vocab.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+        return cls(arrays, terms, meta)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        return cls(*build_postings(mapping))
+
+    def __len__(self):
+        return self.n_docs
+
+    def known(self, term: str) -> bool:
+        return term in self.vocab
+
+    def term_idf(self, term: str) -> float:
+        """BM25 idf of a (tokenized) term, 0.0 when unknown."""
+        t = self.vocab.get(term)
+        return 0.0 if t is None else float(self.idf[t])
+
+    def search(self, query: str, k: int, ids: np.ndarray = None):
+        """
+        (scores [<=k], ids [<=k]) by BM25, best first; ids as in the FAISS index.
+        ids: only these documents are scored (metadata filter, see search_filter.py)
+        """
+        term_ids = Counter(self.vocab[t] for t in tokenize(query) if t in self.vocab)
+        if not term_ids or k <= 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for t, qtf in term_ids.items():
+            a, b = int(self.indptr[t]), int(self.indptr[t + 1])
+            rows = self.rows[a:b]
+            tf = self.tf[a:b]
+            scores[rows] += qtf * self.idf[t] * tf * (self.k1 + 1.0) / (tf + self.norm[rows])
+        if ids is not None:
+            scores[~np.isin(self.doc_ids, ids)] = 0.0
+
+        matched = np.flatnonzero(scores)
+        if matched.size > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return scores[matched], np.asarray(self.doc_ids[matched])
+
+
+def open_lexical(vector_dir: str, mapping=None):
+    """
+    LexicalIndex of a store, from <vector_dir>/lexical/. Missing or stale
+    (mapping.json rewritten since, or no source stamp; without mapping.json: doc
+    count differs from the mapping): built in memory from mapping, else None.
+    """
+    try:
+        index = LexicalIndex.load(os.path.join(vector_dir, LEXICAL_DIRNAME))
+        map_path = os.path.join(vector_dir, "mapping.json")
+        if os.path.exists(map_path):
+            stamp = index.meta.get("source")
+            fresh = stamp is not None and same_source(map_path, stamp)
+        else:
+            fresh = mapping is None or len(index) == len(mapping)
+        if fresh:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    return LexicalIndex.from_mapping(mapping) if mapping is not None else None
+
+
+# ----------------------------------------------------
+# RANK FUSION
+# ----------------------------------------------------
+
+def rrf_fuse(rankings, top_k: int, k: int = RRF_K):
+    """
+    Reciprocal rank fusion of hit lists (best first), by rank only:
+    "fused_score" = sum 1 / (k + rank). A hit listed by several rankings
+    keeps the fields of each ("score" of the vector ranking, "bm25"...).
+    """
+    fused = {}
+    for hits in rankings.values():
+        for rank, h in enumerate(hits):
+            key = (h["store"], h["idx"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**h, "fused_score": 0.0}
+            else:
+                for field, value in h.items():
+                    if entry.get(field) is None:
+                        entry[field] = value
+            entry["fused_score"] += 1.0 / (k + rank + 1)
+    return sorted(fused.values(), key=lambda h: h["fused_score"], reverse=True)[:top_k]
+
+
+if __name__ == "__main__":
+    from docstore import open_docstore
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python lexical_index.py <vector_dir> [<vector_dir> ...]")
+    for vector_dir in sys.argv[1:]:
+        map_path = os.path.join(vector_dir, "mapping.json")
+        mapping = open_docstore(vector_dir)
+        if mapping is None:
+            with open(map_path, "r", encoding="utf-8") as f:
+                mapping = json.load(f)
+        meta = write_lexical(mapping, os.path.join(vector_dir, LEXICAL_DIRNAME),
+                             source_path=map_path if os.path.exists(map_path) else None)
+        print(f"{vector_dir}: {meta['n_docs']} docs, {meta['n_terms']} terms")
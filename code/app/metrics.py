@@ -0,0 +1,331 @@
+# metrics.py
+# Per-stage latency metrics and traces for the RAG pipeline
+# - histograms (seconds, Prometheus buckets) and counters, process-wide and thread-safe
+# - stage("embed") / @timed("context"): time a block, optional labels (store=...)
+# - trace("ask"): spans of one request (contextvars), appended as JSON lines
+#   to ESILV_METRICS_JSONL when set
+# - export: prometheus_text(), snapshot() (JSON, with p50/p95/p99 estimates),
+#   start_http_exporter(port) serves /metrics and /metrics.json (ESILV_METRICS_PORT)
+# - get_logger(): the pipeline's log, ESILV_LOG_LEVEL=INFO by default (DEBUG shows the
+#   retrieval debug output, WARNING keeps only problems)
+# ESILV_METRICS=0 turns stage()/trace() into no-ops.
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("ESILV_METRICS", "1") != "0"
+JSONL_PATH = os.environ.get("ESILV_METRICS_JSONL", "")
+LOG_LEVEL = os.environ.get("ESILV_LOG_LEVEL", "INFO").upper()
+
+# seconds; from a cached embedding (~µs) to a slow llama3.2 answer
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# ----------------------------------------------------
+# LOGGER
+# ----------------------------------------------------
+
+def get_logger(name: str = "esilv.rag") -> logging.Logger:
+    """Logger printing to stderr at ESILV_LOG_LEVEL (DEBUG brings back the old retrieval debug output)."""
+    log = logging.getLogger(name)
+    if not getattr(log, "_esilv_configured", False):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.setLevel(getattr(logging, LOG_LEVEL, logging.INFO) if LOG_LEVEL != "OFF" else logging.CRITICAL + 1)
+        log.propagate = False
+        log._esilv_configured = True
+    return log
+
+
+# ----------------------------------------------------
+# HISTOGRAMS / COUNTERS
+# ----------------------------------------------------
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # last = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate (linear interpolation inside the bucket), like histogram_quantile()."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                lo = BUCKETS[i - 1] if i > 0 else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return BUCKETS[-1]
+
+
+def _label_key(labels: dict):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}   # (name, labels) -> Histogram
+        self.counters = {}     # (name, labels) -> float
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(seconds)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hists = [
+                {
+                    "name": name, "labels": dict(labels), "count": h.count,
+                    "sum_s": round(h.sum, 6),
+                    "mean_ms": round(1000.0 * h.sum / h.count, 3) if h.count else 0.0,
+                    "p50_ms": round(1000.0 * h.quantile(0.50), 3),
+                    "p95_ms": round(1000.0 * h.quantile(0.95), 3),
+                    "p99_ms": round(1000.0 * h.quantile(0.99), 3),
+                }
+                for (name, labels), h in sorted(self.histograms.items())
+            ]
+            counters = [{"name": name, "labels": dict(labels), "value": v}
+                        for (name, labels), v in sorted(self.counters.items())]
+        return {"histograms": hists, "counters": counters}
+
+    def prometheus_text(self, prefix: str = "esilv_") -> str:
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            by_name = {}
+            for (name, labels), h in sorted(self.histograms.items()):
+                by_name.setdefault(name, []).append((labels, h))
+            for name, series in by_name.items():
+                metric = prefix + name.replace(".", "_") + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, h in series:
+                    cum = 0
+                    for b, c in zip(BUCKETS, h.counts):
+                        cum += c
+                        lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', b)])} {cum}")
+                    lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{metric}_sum{fmt_labels(labels)} {h.sum:.6f}")
+                    lines.append(f"{metric}_count{fmt_labels(labels)} {h.count}")
+
+            by_name = {}
+            for (name, labels), v in sorted(self.counters.items()):
+                by_name.setdefault(name, []).append((labels, v))
+            for name, series in by_name.items():
+                metric = prefix + name.replace(".", "_") + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                for labels, v in series:
+                    lines.append(f"{metric}{fmt_labels(labels)} {v:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def observe(name: str, seconds: float, **labels):
+    if not ENABLED:
+        return
+    REGISTRY.observe(name, seconds, **labels)
+    tr = _current_trace.get()
+    if tr is not None:
+        tr.add_span(name, seconds, labels)
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def snapshot() -> dict:
+    return REGISTRY.snapshot()
+
+
+def prometheus_text() -> str:
+    return REGISTRY.prometheus_text()
+
+
+# ----------------------------------------------------
+# STAGES / TRACES
+# ----------------------------------------------------
+
+class Trace:
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, seconds: float, labels: dict):
+        span = {"stage": stage, "ms": round(seconds * 1000.0, 3)}
+        span.update({k: v for k, v in labels.items() if v is not None})
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace": self.name,
+            "ts": round(self.start, 3),
+            "total_ms": round((time.perf_counter() - self._t0) * 1000.0, 3),
+            **self.attrs,
+            "spans": list(self.spans),
+        }
+
+
+_current_trace = contextvars.ContextVar("esilv_trace", default=None)
+_jsonl_lock = threading.Lock()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def stage(name: str, **labels):
+    """Time the block as histogram `name` (and as a span of the current trace)."""
+    if not ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def timed(name: str):
+    """Decorator version of stage()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+@contextlib.contextmanager
+def trace(name: str, **attrs):
+    """
+    Collect the stages of one request. Nested trace() calls join the
+    outer trace. On exit the trace is appended to ESILV_METRICS_JSONL.
+    """
+    if not ENABLED or _current_trace.get() is not None:
+        yield _current_trace.get()
+        return
+    tr = Trace(name, **attrs)
+    token = _current_trace.set(tr)
+    try:
+        yield tr
+    finally:
+        _current_trace.reset(token)
+        observe(name, time.perf_counter() - tr._t0)
+        if JSONL_PATH:
+            line = json.dumps(tr.to_dict(), ensure_ascii=False)
+            with _jsonl_lock, open(JSONL_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@contextlib.contextmanager
+def attach(tr):
+    """Make tr the current trace in this context (request handed over to another thread / loop)."""
+    token = _current_trace.set(tr)
+    try:
+        yield tr
+    finally:
+        _current_trace.reset(token)
+
+
+def bind(fn):
+    """fn running in a copy of the caller's context (keeps the trace in pool threads)."""
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+# ----------------------------------------------------
+# HTTP EXPORTER
+# ----------------------------------------------------
+
+class _ExporterHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, ctype = json.dumps(snapshot()).encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, ctype = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_http_exporter(port: int = None, host: str = "127.0.0.1"):
+    """Serve /metrics (Prometheus) and /metrics.json once per process. Returns the port or None."""
+    global _exporter
+    port = port if port is not None else int(os.environ.get("ESILV_METRICS_PORT", "0") or 0)
+    if not port:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            try:
+                _exporter = ThreadingHTTPServer((host, port), _ExporterHandler)
+            except OSError:
+                return None  # another process (Streamlit rerun / worker) already serves it
+            _exporter.daemon_threads = True
+            threading.Thread(target=_exporter.serve_forever, name="metrics-exporter", daemon=True).start()
+        return _exporter.server_address[1]
@@ -0,0 +1,261 @@
+# quantized_index.py
+# Compressed stores: the resident index holds codes, the float vectors stay on disk
+# - kinds: sq8 (IndexScalarQuantizer 8 bit, 4x smaller), fp16 (2x), pq (IndexPQ, d/4 sub-quantizers,
+#   bits per code sized by the store, ann_index.pq_bits(): ~10-14x on the v2 / v3 stores, the
+#   codebook weighs as much as the codes at this size; 32x only with 8 bits on large stores)
+# - written next to the flat index: faiss_index_<kind>.bin + vectors.npy (float32 [n, d],
+#   memory-mapped, + vector_ids.npy for ID-mapped stores)
+# - RescoredIndex: searches the codes for rescore_factor x k candidates, then re-scores
+#   them with the exact float vectors (only those rows are read) -> same top-k order as flat
+# - load_store() uses it with ESILV_INDEX_KIND=sq8 | fp16 | pq (stale files -> flat index)
+#
+# Usage:
+#   python code/app/quantized_index.py build code/embeddings/vector_store_v2 --kind sq8
+#   python code/app/quantized_index.py report code/embeddings/vector_store_v2 code/embeddings/vector_store_v3 --out quant_report.json
+
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import (base_index, build_index, index_path, index_vectors, measure, pq_bits, quiet_pq,
+                       recall_at_k, sample_queries, _latency_summary)
+
+QUANT_KINDS = ("sq8", "fp16", "pq")
+RESCORE_FACTOR = int(os.environ.get("ESILV_RESCORE_FACTOR", "4"))
+
+VECTORS_FILE = "vectors.npy"
+VECTOR_IDS_FILE = "vector_ids.npy"
+
+
+def build_quantized(vectors: np.ndarray, kind: str = "sq8", pq_m: int = None, pq_nbits: int = 8,
+                    ids: np.ndarray = None):
+    """
+    vectors: L2-normalized float32 [n, d]
+    pq_m / pq_nbits: PQ sub-quantizers (must divide d, default d / 4) / max bits per code (ann_index.pq_bits())
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, d = vectors.shape
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if kind == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, metric)
+    elif kind == "fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, metric)
+    elif kind == "pq":
+        pq_m = pq_m or d // 4
+        if d % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide d={d}")
+        index = faiss.IndexPQ(d, pq_m, pq_bits(n, pq_nbits), metric)
+        quiet_pq(index.pq)
+    else:
+        raise ValueError(f"Unknown quantized kind: {kind!r} (expected one of {QUANT_KINDS})")
+
+    index.train(vectors)
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype=np.int64))
+    else:
+        index.add(vectors)
+    return index
+
+
+# ----------------------------------------------------
+# RE-SCORED INDEX
+# ----------------------------------------------------
+
+class RescoredIndex:
+    """
+    Quacks like the FAISS index MultiStoreRAG expects (search / reconstruct /
+    ntotal / d / metric_type). vectors: [n, d] float32, usually a read-only memmap;
+    ids: external id of each row (None = row number).
+    """
+
+    def __init__(self, index, vectors: np.ndarray, ids: np.ndarray = None, rescore_factor: int = RESCORE_FACTOR):
+        self.index = index
+        self.vectors = vectors
+        self.ids = ids
+        self.rescore_factor = rescore_factor
+        self.ntotal = index.ntotal
+        self.d = index.d
+        self.metric_type = index.metric_type
+        if ids is not None:
+            self._sorter = np.argsort(ids, kind="stable")
+            self._sorted_ids = ids[self._sorter]
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        if self.ids is None:
+            return ids
+        return self._sorter[np.searchsorted(self._sorted_ids, ids)]
+
+    def search(self, Q: np.ndarray, k: int, params=None):
+        Q = np.ascontiguousarray(Q, dtype="float32").reshape(-1, self.d)
+        k_short = min(max(k * self.rescore_factor, k + 8), self.ntotal)
+        _, I = self.index.search(Q, k_short, params=params)
+
+        D_out = np.full((Q.shape[0], k), -np.inf, dtype="float32")
+        I_out = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        for r in range(Q.shape[0]):
+            cand = I[r][I[r] >= 0]
+            if cand.size == 0:
+                continue
+            rows = self.rows(cand)
+            order = np.argsort(rows)                     # sequential reads of the memmap
+            exact = np.empty(cand.size, dtype="float32")
+            exact[order] = np.asarray(self.vectors[rows[order]], dtype="float32") @ Q[r]
+            top = np.argsort(-exact, kind="stable")[:k]
+            D_out[r, :top.size] = exact[top]
+            I_out[r, :top.size] = cand[top]
+        return D_out, I_out
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        return np.array(self.vectors[int(self.rows(np.array([key]))[0])], dtype="float32")
+
+    def reconstruct_batch(self, keys) -> np.ndarray:
+        return np.asarray(self.vectors[self.rows(np.asarray(keys, dtype=np.int64))], dtype="float32")
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        return np.array(self.vectors[start:start + n], dtype="float32")
+
+    def all_vectors(self):
+        """(ids, vectors) like ann_index.index_vectors(), from the float copy."""
+        ids = self.ids if self.ids is not None else np.arange(self.ntotal, dtype=np.int64)
+        return ids, self.reconstruct_n(0, self.ntotal)
+
+    def code_bytes(self) -> int:
+        return int(faiss.serialize_index(self.index).nbytes)
+
+
+def build_from_flat(vector_dir: str, kind: str, **params) -> str:
+    flat = faiss.read_index(index_path(vector_dir, "flat"))
+    ids, vectors = index_vectors(flat)
+    mapped = base_index(flat) is not flat
+    index = build_quantized(vectors, kind=kind, ids=ids if mapped else None, **params)
+
+    np.save(os.path.join(vector_dir, VECTORS_FILE), vectors)
+    ids_path = os.path.join(vector_dir, VECTOR_IDS_FILE)
+    if mapped:
+        np.save(ids_path, ids)
+    elif os.path.exists(ids_path):
+        os.remove(ids_path)
+
+    out = index_path(vector_dir, kind)
+    faiss.write_index(index, out)
+    return out
+
+
+def load_quantized(vector_dir: str, kind: str, rescore_factor: int = RESCORE_FACTOR):
+    """RescoredIndex, or None when the files are missing or older than the flat index."""
+    path = index_path(vector_dir, kind)
+    vec_path = os.path.join(vector_dir, VECTORS_FILE)
+    if not (os.path.exists(path) and os.path.exists(vec_path)):
+        return None
+    flat_path = index_path(vector_dir, "flat")
+    if os.path.exists(flat_path) and os.path.getmtime(flat_path) > min(os.path.getmtime(path),
+                                                                       os.path.getmtime(vec_path)):
+        return None  # flat index updated since (incremental.py): rebuild with `build`
+
+    index = faiss.read_index(path)
+    vectors = np.load(vec_path, mmap_mode="r")
+    ids_path = os.path.join(vector_dir, VECTOR_IDS_FILE)
+    ids = np.load(ids_path) if os.path.exists(ids_path) else None
+    if vectors.shape[0] != index.ntotal:
+        return None
+    return RescoredIndex(index, vectors, ids=ids, rescore_factor=rescore_factor)
+
+
+# ----------------------------------------------------
+# MEMORY / LATENCY / RECALL REPORT
+# ----------------------------------------------------
+
+def order_match_at_k(truth: np.ndarray, found: np.ndarray, k: int) -> float:
+    """Share of queries whose top-k ids come back in exactly the flat order."""
+    return float(np.mean([np.array_equal(t[:k], f[:k]) for t, f in zip(truth, found)]))
+
+
+def quantization_report(vector_dir: str, k: int = 10, n_queries: int = 200, queries: np.ndarray = None,
+                        kinds=QUANT_KINDS, rescore_factors=(0, 2, 4)) -> dict:
+    """
+    Every kind built in memory from the flat index; rescore factor 0 = codes only.
+    Memory: bytes of the resident index (the float vectors stay in the page cache, shared
+    by every process, and only the rescored rows are touched).
+    """
+    flat = faiss.read_index(index_path(vector_dir, "flat"))
+    _, vectors = index_vectors(flat)
+    flat = build_index(vectors, kind="flat")
+    if queries is None:
+        queries = sample_queries(vectors, n_queries=n_queries)
+
+    truth, flat_lat = measure(flat, queries, k)
+    flat_bytes = int(faiss.serialize_index(flat).nbytes)
+    report = {
+        "vector_dir": vector_dir,
+        "ntotal": int(flat.ntotal),
+        "d": int(flat.d),
+        "k": k,
+        "n_queries": int(queries.shape[0]),
+        "results": [{"kind": "flat", "rescore_factor": None, "index_bytes": flat_bytes, "compression": 1.0,
+                     "recall_at_k": 1.0, "order_match_at_k": 1.0, **_latency_summary(flat_lat)}],
+    }
+
+    for kind in kinds:
+        t0 = time.perf_counter()
+        codes = build_quantized(vectors, kind=kind)
+        build_s = time.perf_counter() - t0
+        nbytes = int(faiss.serialize_index(codes).nbytes)
+        for factor in rescore_factors:
+            index = RescoredIndex(codes, vectors, rescore_factor=factor) if factor else codes
+            found, lat = measure(index, queries, k)
+            report["results"].append({
+                "kind": kind,
+                "rescore_factor": factor or None,
+                "build_s": round(build_s, 3),
+                "index_bytes": nbytes,
+                "compression": round(flat_bytes / nbytes, 2),
+                "recall_at_k": round(recall_at_k(truth, found, k), 4),
+                "order_match_at_k": round(order_match_at_k(truth, found, k), 4),
+                **_latency_summary(lat),
+            })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantized stores (SQ8 / fp16 / PQ) with float re-scoring")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="write faiss_index_<kind>.bin + vectors.npy from the flat index")
+    b.add_argument("vector_dirs", nargs="+")
+    b.add_argument("--kind", choices=QUANT_KINDS, default="sq8")
+    b.add_argument("--pq-m", type=int, default=None, help="PQ sub-quantizers (default d / 4)")
+    b.add_argument("--pq-nbits", type=int, default=8)
+
+    r = sub.add_parser("report", help="memory / latency / recall of every kind against the flat index")
+    r.add_argument("vector_dirs", nargs="+")
+    r.add_argument("--k", type=int, default=10)
+    r.add_argument("--queries", type=int, default=200)
+    r.add_argument("--out", default=None, help="write the JSON report here")
+
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        for vector_dir in args.vector_dirs:
+            params = {"pq_m": args.pq_m, "pq_nbits": args.pq_nbits} if args.kind == "pq" else {}
+            print("Saved:", build_from_flat(vector_dir, args.kind, **params))
+    else:
+        reports = []
+        for vector_dir in args.vector_dirs:
+            rep = quantization_report(vector_dir, k=args.k, n_queries=args.queries)
+            reports.append(rep)
+            print(f"{vector_dir} ({rep['ntotal']} x {rep['d']})")
+            for row in rep["results"]:
+                factor = row["rescore_factor"] or "-"
+                print(f'  {row["kind"]:5s} rescore={factor!s:2s} {row["index_bytes"] / 1e6:7.2f} MB '
+                      f'(x{row["compression"]:<5}) recall@{args.k}={row["recall_at_k"]:.3f} '
+                      f'order={row["order_match_at_k"]:.3f} p50={row["p50_ms"]:.3f}ms p95={row["p95_ms"]:.3f}ms')
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(reports, f, indent=2)
+            print("Saved:", args.out)
@@ -2,54 +2,154 @@
 # Multi-store RAG (v2 site + v3 pdf) with Ollama embeddings + FAISS
 # - Keeps backward compatibility: exposes `index` and `mapping` (points to v2)
 # - Provides: rag_agent (MultiStoreRAG), detect_agent(), ask_agent()
-
+# - Stores are loaded lazily (StoreRegistry / get_rag()), not at import time, and reloaded when
+#   rebuilt on disk (checked every ESILV_STORE_CHECK_S=30 seconds; clears the answer cache)
+# - rag_agent.retrieve() embeds + searches once per question (RetrievalContext)
+# - optional MMR / cross-encoder rerank of an over-fetched pool (rerank.py, ESILV_RERANK)
+# - hybrid search (ESILV_HYBRID=1, off by default): BM25 (lexical_index.py) fused with the vector ranking (RRF);
+#   keyword-only questions ("BTS alternance") are answered by BM25 without an embedding call
+# - detect_agent(): question vector vs per-agent prototypes (agent_router.py), no search; keyword
+#   rules until the router is calibrated (code/embeddings/router_calibration.json)
+# - metadata filters inside the search: where={"rubric": ..., "store": ..., "source_file": ..., "page": ...}
+#   (search_filter.py); ESILV_AGENT_PARTITION=1 restricts an explicit agent's retrieval to its partition
+# - per-stage latency histograms / traces in metrics.py, debug output via its logger
+
+import heapq
 import json
+import logging
 import os
-import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import faiss
 import ollama
 
+import metrics
+from agent_router import (DEFAULT_AGENT, ROUTER_CALIBRATED, ROUTER_MIN_CONFIDENCE, AgentRouter, agent_for_rubric,
+                          keyword_agent, open_router, priority_agent)
+from context_builder import build_context, estimate_tokens
+from ann_index import build_index, index_path as ann_index_path, index_vectors, search_params
+from answer_cache import SemanticAnswerCache, store_fingerprint
+from docstore import DocStore, open_docstore
+from lexical_index import KEYWORD_MIN_IDF, is_keyword_query, open_lexical, rrf_fuse, tokenize
+from quantized_index import QUANT_KINDS, load_quantized
+from rerank import RERANK, hit_vectors, pool_size, rerank_hits
+from search_filter import (Partitions, filtered_ef, filtered_search, id_selector, normalize_where, store_allowed,
+                           store_partitions)
+from embed_cache import DEFAULT_CACHE_DIR, EmbeddingCache, VectorFileStore
+
+log = metrics.get_logger()
+
 # ----------------------------------------------------
 # EMBEDDING MODEL (Ollama)
 # ----------------------------------------------------
 
 DEBUG_EMBED = False
 
-def embed(text: str) -> np.ndarray:
-    resp = ollama.embeddings(model="mxbai-embed-large", prompt=text)
+EMBED_MODEL = "mxbai-embed-large"
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Query embedding cache: LRU in memory + the content-addressed vector cache on
+# disk shared with the indexers (survives Streamlit restarts).
+# Set ESILV_EMBED_CACHE_DIR="" to keep the cache in memory only.
+EMBED_CACHE_DIR = os.environ.get("ESILV_EMBED_CACHE_DIR", DEFAULT_CACHE_DIR)
+EMBED_CACHE = EmbeddingCache(
+    max_items=2048,
+    persistent=VectorFileStore(EMBED_CACHE_DIR) if EMBED_CACHE_DIR else None,
+)
+
+
+def _embed_uncached(text: str) -> np.ndarray:
+    with metrics.stage("ollama.embeddings"):
+        resp = ollama.embeddings(model=EMBED_MODEL, prompt=text)
     v = np.array(resp["embedding"], dtype="float32")
     v /= (np.linalg.norm(v) + 1e-12)
     if DEBUG_EMBED:
-        print("embed() called, norm=", float(np.linalg.norm(v)))
+        log.debug("embed() called, norm= %s", float(np.linalg.norm(v)))
     return v
 
 
+def embed(text: str) -> np.ndarray:
+    with metrics.stage("embed"):
+        return EMBED_CACHE.get_or_compute(EMBED_MODEL, text, _embed_uncached)
+
+
+# Texts per ollama.embed call (list input)
+EMBED_BATCH_SIZE = 64
+
+
+def _embed_many_uncached(texts) -> np.ndarray:
+    vecs = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = list(texts[start:start + EMBED_BATCH_SIZE])
+        with metrics.stage("ollama.embed"):
+            resp = ollama.embed(model=EMBED_MODEL, input=batch)
+        vecs.append(np.array(resp["embeddings"], dtype="float32"))
+    m = np.vstack(vecs)
+    m /= (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+    return m
+
+
+def embed_batch(texts) -> np.ndarray:
+    """[n, d] float32 embeddings, one Ollama call per EMBED_BATCH_SIZE cache misses."""
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    with metrics.stage("embed_batch"):
+        vecs = EMBED_CACHE.get_or_compute_many(EMBED_MODEL, texts, _embed_many_uncached)
+    return np.ascontiguousarray(np.vstack(vecs), dtype="float32")
+
+
 # ----------------------------------------------------
 # LOAD VECTOR STORE
 # ----------------------------------------------------
 
-def load_store(vector_dir: str):
-    index_path = os.path.join(vector_dir, "faiss_index.bin")
+DEBUG_LOAD = False
+
+# "flat" (default), "hnsw", "ivf_flat" or "ivf_pq" (see ann_index.py),
+# "sq8", "fp16" or "pq": compressed codes + float re-scoring (see quantized_index.py).
+# Stores without a (fresh) faiss_index_<kind>.bin fall back to the flat index.
+INDEX_KIND = os.environ.get("ESILV_INDEX_KIND", "flat")
+
+
+def load_store(vector_dir: str, index_kind: str = None):
+    """
+    Returns (index, mapping). `mapping` is the memory-mapped DocStore when
+    <vector_dir>/docstore/ is present and up to date (see docstore.py),
+    else the mapping.json dict. Both support mapping.get(str(idx)).
+    """
+    kind = index_kind or INDEX_KIND
+    index = load_quantized(vector_dir, kind) if kind in QUANT_KINDS else None
+    index_path = ann_index_path(vector_dir, kind)
+    if index is None and (kind in QUANT_KINDS or not os.path.exists(index_path)):
+        index_path = ann_index_path(vector_dir, "flat")
     map_path   = os.path.join(vector_dir, "mapping.json")
 
-    if not os.path.exists(index_path):
-        raise FileNotFoundError(f"Missing FAISS index: {index_path}")
-    if not os.path.exists(map_path):
-        raise FileNotFoundError(f"Missing mapping.json: {map_path}")
-
-    index = faiss.read_index(index_path)
-    with open(map_path, "r", encoding="utf-8") as f:
-        mapping = json.load(f)
-
-    print(f"Loaded store: {vector_dir}")
-    print("  index type:", type(index))
-    try:
-        print("  metric_type:", index.metric_type)
-    except Exception:
-        pass
-    print("  index.d:", index.d)
-    print("  mapping size:", len(mapping))
+    if index is None:
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f"Missing FAISS index: {index_path}")
+        index = faiss.read_index(index_path)
+
+    mapping = open_docstore(vector_dir)
+    if mapping is None:
+        if not os.path.exists(map_path):
+            raise FileNotFoundError(f"Missing mapping.json: {map_path}")
+        with open(map_path, "r", encoding="utf-8") as f:
+            mapping = json.load(f)
+
+    if DEBUG_LOAD:
+        log.debug("Loaded store: %s (%s)", vector_dir, os.path.basename(index_path))
+        log.debug("  index type: %s", type(index))
+        try:
+            log.debug("  metric_type: %s", index.metric_type)
+        except Exception:
+            pass
+        log.debug("  index.d: %s", index.d)
+        log.debug("  mapping size: %s %s", len(mapping),
+                  "(docstore)" if isinstance(mapping, DocStore) else "(mapping.json)")
 
     return index, mapping
 
@@ -58,39 +158,258 @@ def load_store(vector_dir: str):
 # MULTI-STORE SEARCH
 # ----------------------------------------------------
 
+# BM25 + vector rank fusion when the question text is known (stores with a lexical index);
+# off until eval_retrieval.py --hybrid shows a gain on the labelled questions
+HYBRID = os.environ.get("ESILV_HYBRID", "0") == "1"
+
+# Per-store searches run on a shared thread pool (FAISS releases the GIL)
+SEARCH_THREADS = int(os.environ.get("ESILV_SEARCH_THREADS", "8"))
+
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+
+def get_search_pool() -> ThreadPoolExecutor:
+    global _search_pool
+    if _search_pool is None:
+        with _search_pool_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="faiss-search")
+    return _search_pool
+
+
 class MultiStoreRAG:
-    def __init__(self, stores):
+    def __init__(self, stores, parallel: bool = True):
         """
         stores: list of dicts:
           [
             {"name": "v2_site", "index": index_v2, "mapping": mapping_v2},
             {"name": "v3_pdf",  "index": index_v3, "mapping": mapping_v3},
           ]
+        parallel: search the stores concurrently on the shared thread pool
         """
         self.stores = stores
+        self.parallel = parallel
 
-    def search(self, question: str, top_k_per_store: int = 6, top_k_total: int = 10):
-        q = embed(question).reshape(1, -1)
-
-        hits = []
-        for s in self.stores:
-            D, I = s["index"].search(q, top_k_per_store)
+    def search(self, question: str, top_k_per_store: int = 6, top_k_total: int = 10,
+               nprobe: int = None, ef_search: int = None, where: dict = None):
+        """
+        nprobe / ef_search: ANN tuning for IVF / HNSW stores (ignored by flat ones)
+        where: metadata filter, e.g. {"rubric": {"admissions"}} (see search_filter.py)
+        """
+        return self.search_text(question, top_k_per_store=top_k_per_store, top_k_total=top_k_total,
+                                nprobe=nprobe, ef_search=ef_search, where=where)[1]
 
-            for score, idx in zip(D[0].tolist(), I[0].tolist()):
-                key = str(int(idx))
-                doc = s["mapping"].get(key, {})
-                if not doc:
-                    continue
-                hits.append({
-                    "score": float(score),
-                    "idx": int(idx),
-                    "store": s["name"],
-                    "doc": doc,
-                })
+    def search_text(self, question: str, top_k_per_store: int = 6, top_k_total: int = 10,
+                    hybrid: bool = None, **search_kwargs):
+        """
+        (q_vec, hits) for a question. q_vec is None when a keyword-only
+        question was answered by BM25 alone (no embedding call).
+        """
+        if self.keyword_only(question, hybrid):
+            hits = self.search_lexical(question, top_k_per_store=top_k_per_store, top_k_total=top_k_total,
+                                       stores=search_kwargs.get("stores"), where=search_kwargs.get("where"))
+            if hits:
+                return None, hits
+        q = embed(question)
+        return q, self.search_vector(q, top_k_per_store=top_k_per_store, top_k_total=top_k_total,
+                                     query_text=question, hybrid=hybrid, **search_kwargs)
+
+    def _hybrid(self, hybrid: bool = None) -> bool:
+        return (HYBRID if hybrid is None else hybrid) and any(s.get("lexical") is not None for s in self.stores)
+
+    def keyword_only(self, question: str, hybrid: bool = None) -> bool:
+        """
+        Short keyword query whose terms all exist in a lexical index, one of
+        them rare (idf >= KEYWORD_MIN_IDF in a store): BM25 is enough.
+        """
+        if not self._hybrid(hybrid) or not is_keyword_query(question):
+            return False
+        lexicals = [s["lexical"] for s in self.stores if s.get("lexical") is not None]
+        terms = tokenize(question)
+        if not all(any(lx.known(t) for lx in lexicals) for t in terms):
+            return False
+        return any(len(t) >= 2 and max(lx.term_idf(t) for lx in lexicals) >= KEYWORD_MIN_IDF for t in terms)
+
+    def search_lexical(self, question: str, top_k_per_store: int = 6, top_k_total: int = 10, stores=None,
+                       where: dict = None):
+        """
+        BM25 hits of every store with a lexical index, merged by BM25 score,
+        deduplicated. The score is in "bm25"; "score" (cosine) is None.
+        """
+        where = normalize_where(where)
+        per_store = []
+        with metrics.stage("lexical.search"):
+            lexical = [s for s in self._selected(stores, where) if s.get("lexical") is not None]
+            for s, ids, k in self._plan(lexical, where, top_k_per_store, top_k_total):
+                D, I = s["lexical"].search(question, k, ids=ids)
+                hits = self._to_hits(s, D, I)
+                for h in hits:
+                    h["bm25"], h["score"] = h["score"], None
+                per_store.append(hits)
+            merged = heapq.merge(*per_store, key=lambda x: x["bm25"], reverse=True)
+            return self._dedup(merged, top_k_total)
+
+    def _fused(self, q_vec, top_k_per_store, top_k_total, query_text, **search_kwargs):
+        # both rankings over-fetched, then reciprocal rank fusion
+        pool = 2 * top_k_total
+        vector_hits = self.search_vector(q_vec, top_k_per_store=top_k_per_store, top_k_total=pool,
+                                         query_text=query_text, hybrid=False, **search_kwargs)
+        lexical_hits = self.search_lexical(query_text, top_k_per_store=max(top_k_per_store, pool),
+                                           top_k_total=pool, stores=search_kwargs.get("stores"),
+                                           where=search_kwargs.get("where"))
+        with metrics.stage("fusion"):
+            hits = rrf_fuse({"vector": vector_hits, "bm25": lexical_hits}, top_k_total)
+            # hits found by BM25 only: cosine from the stored vectors, like the others
+            missing = [h for h in hits if h["score"] is None]
+            if missing:
+                cos = hit_vectors(missing, self.stores) @ np.asarray(q_vec, dtype="float32").reshape(-1)
+                for h, c in zip(missing, cos.tolist()):
+                    h["score"] = c
+            for h in hits:
+                h.setdefault("bm25", None)
+            return hits
+
+    def search_vector(self, q_vec: np.ndarray, top_k_per_store: int = 6, top_k_total: int = 10,
+                      nprobe: int = None, ef_search: int = None, stores=None,
+                      rerank: str = None, query_text: str = None, hybrid: bool = None, where: dict = None):
+        """
+        stores: optional list of store names to search (default: all)
+        rerank: "mmr" / "cross" / "" (default ESILV_RERANK, see rerank.py);
+        query_text: the question, for the cross-encoder and the BM25 fusion
+        hybrid: fuse with BM25 when query_text is given (default ESILV_HYBRID)
+        where: metadata filter applied inside each store's search (see search_filter.py)
+        """
+        if query_text and self._hybrid(hybrid):
+            return self._fused(q_vec, top_k_per_store, top_k_total, query_text, nprobe=nprobe,
+                               ef_search=ef_search, stores=stores, rerank=rerank, where=where)
+        mode = RERANK if rerank is None else rerank
+        if mode:
+            return self._reranked(q_vec, top_k_per_store, top_k_total, mode, query_text,
+                                  nprobe=nprobe, ef_search=ef_search, stores=stores, where=where)
+        q = q_vec.reshape(1, -1)
+        where = normalize_where(where)
+        plan = self._plan(self._selected(stores, where), where, top_k_per_store, top_k_total)
+
+        def search_one(step):
+            s, ids, k = step
+            D, I = self._search_store(s, q, k, ids, nprobe, ef_search, "index.search")
+            return self._to_hits(s, D[0], I[0])
+
+        if self.parallel and len(plan) > 1:
+            per_store = list(get_search_pool().map(metrics.bind(search_one), plan))
+        else:
+            per_store = [search_one(step) for step in plan]
 
-        # sort by score desc
-        hits.sort(key=lambda x: x["score"], reverse=True)
+        # each list is already sorted by score desc: lazy k-way heap merge,
+        # dedup stops pulling as soon as top_k_total hits are kept
+        with metrics.stage("dedup"):
+            merged = heapq.merge(*per_store, key=lambda x: x["score"], reverse=True)
+            return self._dedup(merged, top_k_total)
 
+    def search_batch(self, questions, top_k_per_store: int = 6, top_k_total: int = 10,
+                     nprobe: int = None, ef_search: int = None, stores=None, where: dict = None):
+        """
+        Bulk / evaluation API: one batched embedding call, one matrix
+        index.search per store. Returns one deduplicated hit list per question
+        (same shape as search()). where: metadata filter shared by every question.
+        """
+        Q = embed_batch(questions)
+        return self.search_vectors(Q, top_k_per_store=top_k_per_store, top_k_total=top_k_total,
+                                   nprobe=nprobe, ef_search=ef_search, stores=stores, where=where)
+
+    def search_vectors(self, Q: np.ndarray, top_k_per_store: int = 6, top_k_total: int = 10,
+                       nprobe: int = None, ef_search: int = None, stores=None, rerank: str = None,
+                       where: dict = None):
+        if Q.shape[0] == 0:
+            return []
+        mode = RERANK if rerank is None else rerank
+        if mode:
+            return self._reranked_batch(Q, top_k_per_store, top_k_total, mode,
+                                        nprobe=nprobe, ef_search=ef_search, stores=stores, where=where)
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        where = normalize_where(where)
+        plan = self._plan(self._selected(stores, where), where, top_k_per_store, top_k_total)
+
+        def search_one(step):
+            s, ids, k = step
+            return self._search_store(s, Q, k, ids, nprobe, ef_search, "index.search_batch")
+
+        if self.parallel and len(plan) > 1:
+            results = list(get_search_pool().map(metrics.bind(search_one), plan))
+        else:
+            results = [search_one(step) for step in plan]
+
+        out = []
+        with metrics.stage("dedup_batch"):
+            for row in range(Q.shape[0]):
+                per_store = [self._to_hits(s, D[row], I[row]) for (s, _, _), (D, I) in zip(plan, results)]
+                merged = heapq.merge(*per_store, key=lambda x: x["score"], reverse=True)
+                out.append(self._dedup(merged, top_k_total))
+        return out
+
+    def _selected(self, stores, where):
+        return [s for s in self.stores
+                if (stores is None or s["name"] in stores) and store_allowed(s["name"], where)]
+
+    @staticmethod
+    def _plan(selected, where, top_k_per_store, top_k_total):
+        """
+        (store, partition ids or None, k) of each selected store that can match
+        where (normalized). When a single store is left it is asked for
+        top_k_total hits, like the unified index, not top_k_per_store.
+        """
+        plan = []
+        for s in selected:
+            ids = store_partitions(s).select(where)
+            if ids is not None and ids.size == 0:
+                continue
+            plan.append((s, ids))
+        k = max(top_k_per_store, top_k_total) if len(plan) == 1 else top_k_per_store
+        return [(s, ids, k) for s, ids in plan]
+
+    @staticmethod
+    def _search_store(s, Q, k, ids, nprobe, ef_search, stage):
+        """index.search of one store, restricted to ids (its partition) unless None."""
+        with metrics.stage(stage, store=s["name"]):
+            if ids is not None:
+                return filtered_search(s, Q, k, ids, nprobe=nprobe, ef_search=ef_search)
+            params = search_params(s["index"], nprobe=nprobe, ef_search=ef_search)
+            return s["index"].search(Q, k, params=params)
+
+    def _reranked(self, q_vec, top_k_per_store, top_k_total, mode, query_text, **search_kwargs):
+        # over-fetch a candidate pool, keep top_k_total of it
+        pool = pool_size(top_k_total)
+        hits = self.search_vector(q_vec, top_k_per_store=max(top_k_per_store, pool), top_k_total=pool,
+                                  rerank="", **search_kwargs)
+        return rerank_hits(q_vec, hits, top_k_total, self.stores, mode=mode, question=query_text)
+
+    def _reranked_batch(self, Q, top_k_per_store, top_k_total, mode, **search_kwargs):
+        pool = pool_size(top_k_total)
+        results = self.search_vectors(Q, top_k_per_store=max(top_k_per_store, pool), top_k_total=pool,
+                                      rerank="", **search_kwargs)
+        return [rerank_hits(q, hits, top_k_total, self.stores, mode=mode) for q, hits in zip(Q, results)]
+
+    @staticmethod
+    def _to_hits(store: dict, scores, ids):
+        hits = []
+        for score, idx in zip(scores.tolist(), ids.tolist()):
+            if idx < 0:  # fewer than k results (ANN indexes)
+                continue
+            key = str(int(idx))
+            doc = store["mapping"].get(key, {})
+            if not doc:
+                continue
+            hits.append({
+                "score": float(score),
+                "idx": int(idx),
+                "store": store["name"],
+                "doc": doc,
+            })
+        return hits
+
+    @staticmethod
+    def _dedup(hits, top_k_total: int):
         # Deduplicate: (url + first 80 chars of content)
         seen = set()
         dedup = []
@@ -107,35 +426,381 @@ class MultiStoreRAG:
 
         return dedup
 
+    def retrieve(self, question: str, top_k_per_store: int = 8, top_k_total: int = 10, **search_kwargs):
+        return RetrievalContext(question, self, top_k_per_store=top_k_per_store, top_k_total=top_k_total,
+                                **search_kwargs)
+
 
 # ----------------------------------------------------
-# BUILD RAG AGENT (v2 + v3)
+# UNIFIED (SHARDED) INDEX
 # ----------------------------------------------------
 
-BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+class UnifiedStoreRAG(MultiStoreRAG):
+    """
+    All stores' vectors in one FAISS index + a parallel store-id array.
+    Each store is a contiguous id range, so filtering by store is a FAISS
+    IDSelectorRange: one search instead of one per store, and top_k_total
+    is exact (no dependency on a per-store k).
+    Same search()/search_vector() signature; top_k_per_store is ignored.
+    """
+
+    def __init__(self, stores, index_kind: str = "flat"):
+        super().__init__(stores)
+
+        blocks = []
+        local_ids = []
+        self.offsets = {}          # store name -> (start, end) in the unified index
+        self._positions = {}       # store name -> (sorted local ids, their unified positions)
+        start = 0
+        for s in stores:
+            ids, vecs = index_vectors(s["index"])
+            self.offsets[s["name"]] = (start, start + vecs.shape[0])
+            order = np.argsort(ids, kind="stable")
+            self._positions[s["name"]] = (ids[order], start + order)
+            start += vecs.shape[0]
+            blocks.append(vecs)
+            local_ids.append(ids)
+
+        vectors = np.ascontiguousarray(np.vstack(blocks), dtype="float32")
+        self.store_ids = np.concatenate([
+            np.full(b.shape[0], i, dtype=np.int16) for i, b in enumerate(blocks)
+        ])
+        # unified position -> id in its own store (ID-mapped stores have holes)
+        self.local_ids = np.concatenate(local_ids)
+        self.index = build_index(vectors, kind=index_kind)
+
+    def _partition(self, stores, where):
+        """Unified positions allowed by the metadata predicates of where, or None (store ranges only)."""
+        if where is None or not set(where) - {"store"}:
+            return None
+        positions = [np.zeros(0, dtype=np.int64)]
+        for s in self._selected(stores, where):
+            sorted_ids, pos = self._positions[s["name"]]
+            positions.append(pos[np.searchsorted(sorted_ids, store_partitions(s).select(where))])
+        return np.sort(np.concatenate(positions))
+
+    def _search(self, Q, k, nprobe, ef_search, stores, where, positions):
+        if positions is not None:
+            return filtered_search({"index": self.index}, Q, k, positions, nprobe=nprobe, ef_search=ef_search)
+        sel = self._selector(stores, where)
+        if sel is not None:
+            n_allowed = sum(b - a for a, b in (self.offsets[s["name"]] for s in self._selected(stores, where)))
+            ef_search = filtered_ef(self.index, k, n_allowed, ef_search)
+        params = search_params(self.index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        return self.index.search(Q, k, params=params)
+
+    def _selector(self, stores, where=None):
+        if stores is None and where is None:
+            return None
+        selected = self._selected(stores, where)
+        ranges = [self.offsets[s["name"]] for s in selected]
+        if not ranges:
+            return id_selector(np.zeros(0, dtype=np.int64))
+        sels = [faiss.IDSelectorRange(a, b) for a, b in ranges]
+        sel = sels[0]
+        for other in sels[1:]:
+            sel = faiss.IDSelectorOr(sel, other)
+        # keep the range selectors alive as long as the combined one
+        sel.referenced_selectors = sels
+        return sel
+
+    def search_vector(self, q_vec: np.ndarray, top_k_per_store: int = 6, top_k_total: int = 10,
+                      nprobe: int = None, ef_search: int = None, stores=None,
+                      rerank: str = None, query_text: str = None, hybrid: bool = None, where: dict = None):
+        if query_text and self._hybrid(hybrid):
+            return self._fused(q_vec, top_k_per_store, top_k_total, query_text, nprobe=nprobe,
+                               ef_search=ef_search, stores=stores, rerank=rerank, where=where)
+        mode = RERANK if rerank is None else rerank
+        if mode:
+            return self._reranked(q_vec, top_k_per_store, top_k_total, mode, query_text,
+                                  nprobe=nprobe, ef_search=ef_search, stores=stores, where=where)
+        q = q_vec.reshape(1, -1)
+        where = normalize_where(where)
+        positions = self._partition(stores, where)
+
+        # Over-fetch for dedup; widen until top_k_total unique hits or the index is exhausted
+        k = min(max(2 * top_k_total, top_k_total + 4), self.index.ntotal)
+        while True:
+            with metrics.stage("index.search", store="unified"):
+                D, I = self._search(q, k, nprobe, ef_search, stores, where, positions)
+            hits = []
+            for score, gid in zip(D[0].tolist(), I[0].tolist()):
+                if gid < 0:
+                    continue
+                s = self.stores[int(self.store_ids[gid])]
+                local = self.local_ids[gid]
+                hits.extend(self._to_hits(s, np.array([score]), np.array([local])))
+
+            dedup = self._dedup(hits, top_k_total)
+            exhausted = int((I[0] >= 0).sum()) < k or k >= self.index.ntotal
+            if len(dedup) >= top_k_total or exhausted:
+                return dedup
+            k = min(2 * k, self.index.ntotal)
+
+    def search_vectors(self, Q: np.ndarray, top_k_per_store: int = 6, top_k_total: int = 10,
+                       nprobe: int = None, ef_search: int = None, stores=None, rerank: str = None,
+                       where: dict = None):
+        if Q.shape[0] == 0:
+            return []
+        mode = RERANK if rerank is None else rerank
+        if mode:
+            return self._reranked_batch(Q, top_k_per_store, top_k_total, mode,
+                                        nprobe=nprobe, ef_search=ef_search, stores=stores, where=where)
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        where = normalize_where(where)
+        positions = self._partition(stores, where)
+
+        k = min(max(2 * top_k_total, top_k_total + 4), self.index.ntotal)
+        with metrics.stage("index.search_batch", store="unified"):
+            D, I = self._search(Q, k, nprobe, ef_search, stores, where, positions)
+
+        out = []
+        for row in range(Q.shape[0]):
+            hits = []
+            for score, gid in zip(D[row].tolist(), I[row].tolist()):
+                if gid < 0:
+                    continue
+                s = self.stores[int(self.store_ids[gid])]
+                local = self.local_ids[gid]
+                hits.extend(self._to_hits(s, np.array([score]), np.array([local])))
+            dedup = self._dedup(hits, top_k_total)
+            if len(dedup) < top_k_total and (I[row] >= 0).sum() == k and k < self.index.ntotal:
+                # rare: too many duplicates in the over-fetched window
+                dedup = self.search_vector(Q[row], top_k_total=top_k_total, nprobe=nprobe,
+                                           ef_search=ef_search, stores=stores, rerank="", where=where)
+            out.append(dedup)
+        return out
+
+
+# ----------------------------------------------------
+# PER-REQUEST RETRIEVAL CONTEXT
+# ----------------------------------------------------
+
+class RetrievalContext:
+    """
+    One question = one embedding + one multi-store search.
+    Search with the largest k any consumer needs, then share the hits
+    between detect_agent(), the sources panel and ask_agent().
+    """
+
+    def __init__(self, question: str, rag: MultiStoreRAG,
+                 top_k_per_store: int = 8, top_k_total: int = 10, **search_kwargs):
+        self.question = question
+        # q_vec is None for keyword-only questions (BM25 hits, no embedding)
+        self.q_vec, self.hits = rag.search_text(
+            question,
+            top_k_per_store=top_k_per_store,
+            top_k_total=top_k_total,
+            **search_kwargs,
+        )
+
+    @classmethod
+    def from_hits(cls, question: str, q_vec: np.ndarray, hits):
+        """Context for an already embedded + searched question (async service)."""
+        ctx = cls.__new__(cls)
+        ctx.question = question
+        ctx.q_vec = q_vec
+        ctx.hits = hits
+        return ctx
+
+    def top(self, k: int):
+        return self.hits[:k]
+
+
+# ----------------------------------------------------
+# BUILD RAG AGENT (v2 + v3)
+# ----------------------------------------------------
 
 V2_DIR = os.path.join(BASE_PATH, "../embeddings/vector_store_v2")
 V3_DIR = os.path.join(BASE_PATH, "../embeddings/vector_store_v3")  # PDFs
 
-index_v2, mapping_v2 = load_store(V2_DIR)
-index_v3, mapping_v3 = load_store(V3_DIR)
+# One FAISS index over all stores (UnifiedStoreRAG) instead of one search per store
+UNIFIED_INDEX = os.environ.get("ESILV_UNIFIED_INDEX", "0") == "1"
+
+STORE_SPECS = [
+    ("v2_site", V2_DIR),
+    ("v3_pdf",  V3_DIR),
+]
+
+
+# Seconds between two checks of the store files on disk (0 = never): a rebuilt store is
+# reloaded on the next get_rag() after the check, which also clears the answer cache.
+STORE_CHECK_S = float(os.environ.get("ESILV_STORE_CHECK_S", "30"))
+
+
+class StoreRegistry:
+    """
+    Process-wide, lazily loaded stores.
+    Importing this module no longer reads any index: the stores are loaded
+    on first use (get_rag()), or ahead of time by preload(background=True).
+    Reloaded when the files change on disk (checked every check_interval seconds).
+    """
+
+    def __init__(self, specs, check_interval: float = STORE_CHECK_S):
+        self.specs = specs
+        self.check_interval = check_interval
+        self.timings = {}          # store name -> load seconds
+        self.error = None
+        self.fingerprint = None    # answer cache key of the loaded stores (answer_cache.store_fingerprint)
+        self.reloads = 0
+        self._checked_at = 0.0
+        self._rag = None
+        self._router = None
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _disk_fingerprint(self) -> str:
+        return store_fingerprint([vector_dir for _, vector_dir in self.specs])
+
+    def _load(self):
+        # taken before reading the files: a rebuild during the load changes it next time
+        fingerprint = self._disk_fingerprint()
+        stores, timings = [], {}
+        for name, vector_dir in self.specs:
+            t0 = time.perf_counter()
+            index, mapping = load_store(vector_dir)
+            timings[name] = round(time.perf_counter() - t0, 4)
+            stores.append({"name": name, "index": index, "mapping": mapping,
+                           "lexical": open_lexical(vector_dir, mapping),
+                           "router": open_router(vector_dir, index, mapping),
+                           "partitions": Partitions(mapping)})
+        if UNIFIED_INDEX:
+            t0 = time.perf_counter()
+            rag = UnifiedStoreRAG(stores)
+            timings["unified"] = round(time.perf_counter() - t0, 4)
+        else:
+            rag = MultiStoreRAG(stores)
+        # swapped only once everything loaded: a failed reload keeps the previous stores
+        self._stores = {s["name"]: s for s in stores}
+        self._router = AgentRouter.from_stores(stores)
+        self.timings = timings
+        self.fingerprint = fingerprint
+        self._checked_at = time.monotonic()
+        return rag
+
+    def _changed_on_disk(self) -> bool:
+        """True when the store files differ from the loaded ones (re-read at most every check_interval s)."""
+        if self.check_interval <= 0 or time.monotonic() - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = time.monotonic()
+        return self._disk_fingerprint() != self.fingerprint
+
+    def get_rag(self) -> MultiStoreRAG:
+        rag = self._rag
+        if rag is not None and not self._changed_on_disk():
+            return rag
+        with self._lock:
+            if self._rag is None:
+                try:
+                    self._rag = self._load()
+                    self.error = None
+                except Exception as e:
+                    self.error = repr(e)
+                    raise
+            elif self._rag is rag:   # changed on disk, not reloaded by another thread meanwhile
+                try:
+                    self._rag = self._load()
+                    self.reloads += 1
+                    self.error = None
+                    log.info("Stores reloaded (changed on disk)")
+                except Exception as e:
+                    # half-written rebuild: keep serving the loaded stores, retried at the next check
+                    self.error = repr(e)
+                    log.warning("Store reload failed, keeping the loaded stores: %r", e)
+            return self._rag
+
+    def store(self, name: str) -> dict:
+        self.get_rag()
+        return self._stores[name]
+
+    def router(self) -> AgentRouter:
+        self.get_rag()
+        return self._router
+
+    def preload(self, background: bool = True):
+        """Load the stores now (blocking) or in a daemon thread (app boot)."""
+        if not background:
+            self.get_rag()
+            return None
+        with self._lock:
+            if self._rag is not None or (self._thread is not None and self._thread.is_alive()):
+                return self._thread
+            self._thread = threading.Thread(target=self._preload_quietly, name="store-preload", daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def _preload_quietly(self):
+        try:
+            self.get_rag()
+        except Exception:
+            pass  # kept in self.error, raised again on the next get_rag()
+
+    @property
+    def loaded(self) -> bool:
+        return self._rag is not None
+
+    def status(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "loading": self._thread is not None and self._thread.is_alive(),
+            "stores": [name for name, _ in self.specs],
+            "timings": dict(self.timings),
+            "reloads": self.reloads,
+            "error": self.error,
+        }
+
+
+STORES = StoreRegistry(STORE_SPECS)
+
+
+def get_rag() -> MultiStoreRAG:
+    return STORES.get_rag()
 
-rag_agent = MultiStoreRAG([
-    {"name": "v2_site", "index": index_v2, "mapping": mapping_v2},
-    {"name": "v3_pdf",  "index": index_v3, "mapping": mapping_v3},
-])
 
 # Backward compatibility for old app code:
-# Some code still expects `rag_agent.index` and `rag_agent.mapping`.
-# We expose them here (pointing to v2).
-index = index_v2
-mapping = mapping_v2
+# `rag_agent`, `index`, `mapping` (v2), `index_v2`, ... are still module
+# attributes, resolved lazily through the registry (PEP 562).
+_LAZY_ATTRS = {
+    "rag_agent": lambda: get_rag(),
+    "index": lambda: STORES.store("v2_site")["index"],
+    "mapping": lambda: STORES.store("v2_site")["mapping"],
+    "index_v2": lambda: STORES.store("v2_site")["index"],
+    "mapping_v2": lambda: STORES.store("v2_site")["mapping"],
+    "index_v3": lambda: STORES.store("v3_pdf")["index"],
+    "mapping_v3": lambda: STORES.store("v3_pdf")["mapping"],
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return _LAZY_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ----------------------------------------------------
+# SEMANTIC ANSWER CACHE
+# ----------------------------------------------------
+
+# Same agent + same retrieved chunks + near-identical question => reuse the answer.
+# Cleared when the registry reloads the stores (rebuilt on disk, see STORE_CHECK_S): the
+# fingerprint is the one of the loaded stores, the files are not re-read on every lookup.
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ESILV_ANSWER_CACHE_THRESHOLD", "0.95"))
+
+ANSWER_CACHE = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=6 * 3600,
+    max_items=512,
+    fingerprint_fn=lambda: STORES.fingerprint,
+)
 
 
 # ----------------------------------------------------
 # SAFETY / GUARDRAILS
 # ----------------------------------------------------
 
+FALLBACK_ANSWER = "Je n'ai pas cette information dans les documents ESILV."
+
 PROCEDURE_HINTS = [
     "candidater", "candidature", "dossier", "étude de dossier", "entretien",
     "admission", "inscription", "modalités", "procédure"
@@ -147,14 +812,14 @@ def context_has_procedure(context: str) -> bool:
 
 def safe_answer(answer: str, context: str) -> str:
     if not answer:
-        return "Je n'ai pas cette information dans les documents ESILV."
+        return FALLBACK_ANSWER
 
     # extract urls (robust)
     urls = [tok.strip("()[],:") for tok in context.split() if "http" in tok or tok.startswith("pdf://")]
 
     # at least one URL must be present in answer (if context has urls)
     if urls and not any(u in answer for u in urls):
-        return "Je n'ai pas cette information dans les documents ESILV."
+        return FALLBACK_ANSWER
 
     return answer
 
@@ -187,49 +852,86 @@ Tu es l'expert mobilité internationale de l'ESILV.
 Tu n'inventes rien.
 """
 
+AGENT_PROMPTS = {
+    "Admissions": AGENT_ADMISSION,
+    "Formations": AGENT_FORMATION,
+    "International": AGENT_INTERNATIONAL,
+}
 
-# ----------------------------------------------------
-# AGENT DETECTION (multi-store)
-# ----------------------------------------------------
 
-def detect_agent(question: str, top_k_total: int = 8) -> str:
-    q_lower = question.lower()
+# Retrieval for an explicitly chosen agent restricted to its partition (chunks whose
+# rubric routes to it, see agent_router.agent_for_rubric); off by default because the
+# pdf store has a single rubric
+AGENT_PARTITION = os.environ.get("ESILV_AGENT_PARTITION", "0") == "1"
 
-    # Priority rules from the question itself
-    if "alternance" in q_lower or "apprentissage" in q_lower:
-        return "Admissions"
-    if "international" in q_lower or "mobilité" in q_lower or "échange" in q_lower:
-        return "International"
 
-    hits = rag_agent.search(question, top_k_per_store=4, top_k_total=top_k_total)
+def agent_where(agent: str):
+    """where filter of an agent's retrieval, or None (whole stores)."""
+    return {"agent": agent} if AGENT_PARTITION and agent in AGENT_PROMPTS else None
 
-    rubric_counts = {}
-    for h in hits:
-        rubric = (h["doc"].get("rubric") or "").lower()
 
-        if "admission" in rubric or "concour" in rubric:
-            agent = "Admissions"
-        elif "formation" in rubric or "programme" in rubric or "cursus" in rubric:
-            agent = "Formations"
-        elif "international" in rubric or "échange" in rubric or "mobilité" in rubric:
-            agent = "International"
-        else:
-            agent = "Admissions"
+# ----------------------------------------------------
+# AGENT DETECTION (multi-store)
+# ----------------------------------------------------
 
-        rubric_counts[agent] = rubric_counts.get(agent, 0) + 1
+def route_question(question: str, ctx: RetrievalContext = None, q_vec: np.ndarray = None,
+                   top_k_total: int = 8) -> dict:
+    """
+    {"agent", "confidence", "method"} without any search:
+    rule (priority keywords) > centroid (question vector vs agent prototypes, only once
+    calibrated: ROUTER_CALIBRATED) > keyword (rubric words in the question)
+    > vote (rubrics of the top_k_total ctx hits) > default.
+    q_vec: taken from ctx, else embedded here (not for keyword-only questions).
+    """
+    agent = priority_agent(question)
+    if agent is not None:
+        return {"agent": agent, "confidence": 1.0, "method": "rule"}
+
+    if not ROUTER_CALIBRATED:
+        q_vec = None
+    elif q_vec is None and ctx is not None:
+        q_vec = ctx.q_vec
+    elif q_vec is None and not get_rag().keyword_only(question):
+        q_vec = embed(question)
+
+    confidence = 0.0
+    if q_vec is not None:
+        agent, confidence = STORES.router().route(q_vec)
+        if confidence >= ROUTER_MIN_CONFIDENCE:
+            return {"agent": agent, "confidence": confidence, "method": "centroid"}
+
+    agent = keyword_agent(question)
+    if agent is not None:
+        return {"agent": agent, "confidence": confidence, "method": "keyword"}
+
+    hits = ctx.top(top_k_total) if ctx is not None else []
+    if hits:
+        votes = {}
+        for h in hits:
+            voted = agent_for_rubric(h["doc"].get("rubric"))
+            votes[voted] = votes.get(voted, 0) + 1
+        return {"agent": max(votes, key=votes.get), "confidence": confidence, "method": "vote"}
+
+    return {"agent": DEFAULT_AGENT, "confidence": confidence, "method": "default"}
 
-    if rubric_counts:
-        return max(rubric_counts, key=rubric_counts.get)
 
-    return "Admissions"
+@metrics.timed("detect_agent")
+def detect_agent(question: str, top_k_total: int = 8, ctx: RetrievalContext = None) -> str:
+    """Agent name for a question (route_question(), no search is run for routing)."""
+    routed = route_question(question, ctx=ctx, top_k_total=top_k_total)
+    metrics.inc("agent_route", method=routed["method"])
+    return routed["agent"]
 
 
 # ----------------------------------------------------
 # LLM GENERATION (Ollama)
 # ----------------------------------------------------
 
-def generate_answer(context: str, question: str, agent_prompt: str) -> str:
-    messages = [
+GEN_MODEL = "llama3.2:3b"
+
+
+def _build_messages(context: str, question: str, agent_prompt: str):
+    return [
         {"role": "system", "content": agent_prompt},
         {
             "role": "user",
@@ -245,55 +947,159 @@ def generate_answer(context: str, question: str, agent_prompt: str) -> str:
             ),
         },
     ]
-    resp = ollama.chat(model="llama3.2:3b", messages=messages)
+
+
+def generate_answer(context: str, question: str, agent_prompt: str) -> str:
+    messages = _build_messages(context, question, agent_prompt)
+    with metrics.stage("ollama.chat"):
+        resp = ollama.chat(model=GEN_MODEL, messages=messages)
     return resp["message"]["content"]
 
 
+def generate_answer_stream(context: str, question: str, agent_prompt: str):
+    """Yield the answer token by token (ollama.chat with stream=True)."""
+    messages = _build_messages(context, question, agent_prompt)
+    t0 = time.perf_counter()
+    first = True
+    for chunk in ollama.chat(model=GEN_MODEL, messages=messages, stream=True):
+        token = chunk["message"]["content"]
+        if token:
+            if first:
+                metrics.observe("ollama.chat.ttft", time.perf_counter() - t0)
+                first = False
+            yield token
+    metrics.observe("ollama.chat", time.perf_counter() - t0)
+
+
 # ----------------------------------------------------
 # RAG PIPELINE
 # ----------------------------------------------------
 
-def ask_agent(question: str, agent_prompt: str, top_k: int = 10):
-    hits = rag_agent.search(
-        question,
-        top_k_per_store=8,
-        top_k_total=top_k
-    )
-
-    print("---- RETRIEVAL DEBUG (MULTI-STORE) ----")
-    for h in hits:
-        doc = h["doc"]
-        print(
-            f'{h["score"]:.4f}',
-            "| store:", h["store"],
-            "|", doc.get("rubric"),
-            "|", doc.get("title"),
-            "|", doc.get("url"),
-        )
-    print("--------------------------------------")
+def _retrieve_for_answer(question: str, top_k: int, ctx: RetrievalContext = None, where: dict = None):
+    if ctx is not None:
+        return ctx.top(top_k), ctx.q_vec
+
+    ctx = get_rag().retrieve(question, top_k_per_store=8, top_k_total=top_k, where=where)
+    return ctx.top(top_k), ctx.q_vec
 
-    # Build context
-    context_lines = []
-    for h in hits:
-        doc = h["doc"]
-        snippet = (doc.get("content") or "")
-        snippet = snippet[:1100].replace("\n", " ")
-        url = doc.get("url", "")
-        store = h["store"]
-        context_lines.append(f"- [{store}] {snippet} (source: {url})")
 
-    context = "\n".join(context_lines)
+def _score_label(h: dict) -> str:
+    if h.get("score") is None:  # keyword-only question: BM25 hit, no cosine
+        return f'bm25 {h["bm25"]:.2f}'
+    return f'{h["score"]:.4f}'
 
-    answer = generate_answer(context, question, agent_prompt)
 
+@metrics.timed("context")
+def _build_context(hits) -> str:
+    if log.isEnabledFor(logging.DEBUG):
+        lines = ["---- RETRIEVAL DEBUG (MULTI-STORE) ----"]
+        for h in hits:
+            doc = h["doc"]
+            lines.append(
+                f'{_score_label(h)} | store: {h["store"]} | {doc.get("rubric")} '
+                f'| {doc.get("title")} | {doc.get("url")}'
+            )
+        lines.append("--------------------------------------")
+        log.debug("\n".join(lines))
+
+    # headers stripped, page parts merged, repeated sentences dropped, ESILV_CONTEXT_TOKENS budget
+    context = build_context(hits)
+    metrics.inc("context_tokens", estimate_tokens(context))
+    return context
+
+
+@metrics.timed("guardrails")
+def _check_answer(answer: str, context: str) -> str:
     # Optional: block "invented procedures"
     if (("1." in answer or "2." in answer or "étape" in answer.lower())
             and not context_has_procedure(context)):
-        return "Je n'ai pas cette information dans les documents ESILV."
+        return FALLBACK_ANSWER
 
     return safe_answer(answer, context)
 
 
+def ask_agent(question: str, agent_prompt: str, top_k: int = 10, ctx: RetrievalContext = None,
+              use_cache: bool = True, where: dict = None):
+    """where: metadata filter of the retrieval when ctx is None (e.g. agent_where(agent))."""
+    with metrics.trace("ask_agent"):
+        fingerprint = ANSWER_CACHE.current_fingerprint()
+        hits, q_vec = _retrieve_for_answer(question, top_k, ctx, where)
+
+        chunk_ids = [(h["store"], h["idx"]) for h in hits]
+        if use_cache:
+            cached = ANSWER_CACHE.lookup(q_vec, agent_prompt, chunk_ids, question=question)
+            metrics.inc("answer_cache", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                return cached
+
+        context = _build_context(hits)
+
+        answer = generate_answer(context, question, agent_prompt)
+        answer = _check_answer(answer, context)
+
+        if use_cache:
+            ANSWER_CACHE.store(q_vec, agent_prompt, chunk_ids, answer, question=question, fingerprint=fingerprint)
+        return answer
+
+
+class AnswerStream:
+    """
+    Iterate to get the raw tokens as they are generated.
+    Once exhausted:
+      - answer: final answer, after the guardrails (may differ from the tokens
+                if safe_answer / the procedure check rejected it)
+      - ttft: seconds until the first token
+      - cached: True if served by the semantic answer cache
+    """
+
+    def __init__(self, question: str, agent_prompt: str, top_k: int = 10,
+                 ctx: RetrievalContext = None, use_cache: bool = True, where: dict = None):
+        self.question = question
+        self.agent_prompt = agent_prompt
+        self.top_k = top_k
+        self.ctx = ctx
+        self.where = where
+        self.use_cache = use_cache
+        self.answer = None
+        self.ttft = None
+        self.cached = False
+
+    def __iter__(self):
+        start = time.perf_counter()
+        fingerprint = ANSWER_CACHE.current_fingerprint()
+        hits, q_vec = _retrieve_for_answer(self.question, self.top_k, self.ctx, self.where)
+
+        chunk_ids = [(h["store"], h["idx"]) for h in hits]
+        if self.use_cache:
+            cached = ANSWER_CACHE.lookup(q_vec, self.agent_prompt, chunk_ids, question=self.question)
+            metrics.inc("answer_cache", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                self.cached = True
+                self.ttft = time.perf_counter() - start
+                self.answer = cached
+                yield cached
+                return
+
+        context = _build_context(hits)
+
+        tokens = []
+        for token in generate_answer_stream(context, self.question, self.agent_prompt):
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - start
+            tokens.append(token)
+            yield token
+
+        self.answer = _check_answer("".join(tokens), context)
+        if self.use_cache:
+            ANSWER_CACHE.store(q_vec, self.agent_prompt, chunk_ids, self.answer,
+                               question=self.question, fingerprint=fingerprint)
+
+
+def ask_agent_stream(question: str, agent_prompt: str, top_k: int = 10,
+                     ctx: RetrievalContext = None, use_cache: bool = True, where: dict = None) -> AnswerStream:
+    return AnswerStream(question, agent_prompt, top_k=top_k, ctx=ctx, use_cache=use_cache, where=where)
+
+
 # ----------------------------------------------------
 # Quick manual test
 # ----------------------------------------------------
@@ -306,7 +1112,8 @@ if __name__ == "__main__":
     ]
 
     for q in qs:
-        agent = detect_agent(q)
+        ctx = get_rag().retrieve(q, top_k_per_store=8, top_k_total=10)
+        agent = detect_agent(q, ctx=ctx)
         if agent == "Admissions":
             prompt = AGENT_ADMISSION
         elif agent == "Formations":
@@ -316,4 +1123,4 @@ if __name__ == "__main__":
 
         print("\nQUESTION:", q)
         print("AGENT:", agent)
-        print(ask_agent(q, prompt, top_k=10))
+        print(ask_agent(q, prompt, top_k=10, ctx=ctx))
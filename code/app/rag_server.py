@@ -0,0 +1,451 @@
+# rag_server.py
+# HTTP API for the assistant (other front-ends, no Streamlit process per user)
+# - stdlib only: small asyncio HTTP/1.1 server on top of rag_service.RAGService
+# - JSON endpoints:
+#     POST /search   {"question", "top_k"?, "top_k_per_store"?, "where"?} -> {"hits": [...]}
+#                    where: {"rubric": ["admissions"], "store": "v3_pdf", "page": 3} (search_filter.py)
+#                    hit "score" is the cosine (null for keyword-only questions), "bm25" /
+#                    "fused_score" are added by the hybrid search
+#     POST /agent    {"question"}                                    -> {"agent", "confidence", "method"}
+#     POST /ask      {"question", "agent"?, "top_k"?, "stream"?}     -> {"answer", "agent", "sources", "cached"}
+#   GET variants with query parameters (?question=...), for EventSource clients
+# - token streaming as server-sent events: "stream": true or "Accept: text/event-stream"
+#   events: meta (agent + sources), token, done (final answer after the guardrails), error
+#   (any failure once the stream started: the 200 headers are already sent)
+# - GET /healthz (process alive), /readyz (stores loaded, 503 before), /metrics (Prometheus)
+# - /metrics is per worker: each forked worker counts its own requests, a scrape sees the one
+#   that accepted it (its pid in the X-Worker-Pid header and a leading comment); run --workers 1
+#   for service-wide totals
+# - prefork workers: the listening socket and the stores are created once in the parent,
+#   then shared by the forked workers (copy-on-write / memory-mapped docstores)
+#
+# Usage:
+#   python code/app/rag_server.py --port 8000 --workers 4
+#   curl -N localhost:8000/ask -d '{"question": "Comment candidater en alternance ?", "stream": true}'
+# Each worker has its own RAGService: Ollama sees up to workers x ESILV_MAX_GENERATE chats.
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+import rag_agent_v2
+import rag_service
+
+MAX_BODY = 64 * 1024
+SNIPPET_CHARS = 300
+CORS_ORIGIN = os.environ.get("ESILV_CORS_ORIGIN", "")
+
+REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+
+log = metrics.get_logger("esilv.server")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def hit_to_json(h: dict, full_content: bool = False) -> dict:
+    doc = h["doc"]
+    content = doc.get("content") or ""
+    out = {
+        "store": h["store"],
+        "idx": h["idx"],
+        "score": None if h.get("score") is None else round(h["score"], 6),
+        "title": doc.get("title"),
+        "url": doc.get("url"),
+        "rubric": doc.get("rubric"),
+    }
+    for field in ("bm25", "fused_score"):      # hybrid / keyword-only hits
+        if field in h:
+            out[field] = None if h[field] is None else round(h[field], 6)
+    if full_content:
+        out["content"] = content
+    else:
+        out["snippet"] = content[:SNIPPET_CHARS].replace("\n", " ")
+    return out
+
+
+# ----------------------------------------------------
+# HTTP PLUMBING
+# ----------------------------------------------------
+
+class Request:
+    def __init__(self, method: str, target: str, version: str, headers: dict, body: bytes):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def params(self) -> dict:
+        """JSON body (POST) or query parameters (GET)."""
+        if self.method == "GET":
+            return dict(self.query)
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HTTPError(400, "Body must be JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return data
+
+    @property
+    def keep_alive(self) -> bool:
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+
+async def read_request(reader: asyncio.StreamReader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None  # client closed the connection
+    except asyncio.LimitOverrunError:
+        raise HTTPError(413, "Headers too large") from None
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413, "Body too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, version, headers, body)
+
+
+def _head(status: int, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    if CORS_ORIGIN:
+        headers = {"Access-Control-Allow-Origin": CORS_ORIGIN, **headers}
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send(writer, status: int, body, content_type: str = "application/json", keep_alive: bool = True,
+               extra_headers: dict = None):
+    if not isinstance(body, bytes):
+        body = json.dumps(body, ensure_ascii=False).encode("utf-8") if content_type == "application/json" \
+            else str(body).encode("utf-8")
+    headers = {
+        "Content-Type": content_type + ("; charset=utf-8" if "charset" not in content_type else ""),
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+        **(extra_headers or {}),
+    }
+    writer.write(_head(status, headers) + body)
+    await writer.drain()
+
+
+def sse(event: str, data) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+# ----------------------------------------------------
+# API
+# ----------------------------------------------------
+
+class RAGServer:
+    def __init__(self, service: rag_service.RAGService):
+        self.service = service
+        self.started = time.time()
+
+    @staticmethod
+    def _question(p: dict) -> str:
+        q = p.get("question") or p.get("q")
+        if not isinstance(q, str) or not q.strip():
+            raise HTTPError(400, "Missing 'question'")
+        return q.strip()
+
+    @staticmethod
+    def _int(p: dict, name: str, default: int, lo: int = 1, hi: int = 50) -> int:
+        try:
+            v = int(p.get(name, default))
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"'{name}' must be an integer") from None
+        return max(lo, min(hi, v))
+
+    @staticmethod
+    def _where(p: dict):
+        w = p.get("where")
+        if isinstance(w, str):  # GET: ?where={"rubric": "admissions"}
+            try:
+                w = json.loads(w)
+            except ValueError:
+                raise HTTPError(400, "'where' must be a JSON object") from None
+        if w is None:
+            return None
+        scalar = (str, int, float)
+        if not isinstance(w, dict) or not all(
+                isinstance(v, scalar) or (isinstance(v, list) and all(isinstance(x, scalar) for x in v))
+                for v in w.values()):
+            raise HTTPError(400, "'where' must map columns to a value or a list of values")
+        return w
+
+    @staticmethod
+    def _flag(p: dict, name: str) -> bool:
+        v = p.get(name, False)
+        if isinstance(v, str):
+            return v.lower() in ("1", "true", "yes")
+        return bool(v)
+
+    async def handle(self, req: Request, writer):
+        route = (req.method, req.path.rstrip("/") or "/")
+
+        if req.method == "OPTIONS" and CORS_ORIGIN:
+            writer.write(_head(204, {
+                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                "Access-Control-Allow-Headers": "Content-Type, Accept",
+                "Content-Length": "0",
+            }))
+            await writer.drain()
+            return True
+
+        if route == ("GET", "/healthz"):
+            await send(writer, 200, {"status": "ok", "pid": os.getpid(),
+                                     "uptime_s": round(time.time() - self.started, 1)}, keep_alive=req.keep_alive)
+            return req.keep_alive
+        if route == ("GET", "/readyz"):
+            status = rag_agent_v2.STORES.status()
+            ready = status["loaded"]
+            if not ready and not status["loading"]:
+                rag_agent_v2.STORES.preload(background=True)
+            await send(writer, 200 if ready else 503,
+                       {"ready": ready, "stores": status, "service": self.service.stats()},
+                       keep_alive=req.keep_alive)
+            return req.keep_alive
+        if route == ("GET", "/metrics"):
+            text = f"# metrics of worker {os.getpid()} only (one registry per process)\n" + metrics.prometheus_text()
+            await send(writer, 200, text, content_type="text/plain; version=0.0.4",
+                       keep_alive=req.keep_alive, extra_headers={"X-Worker-Pid": str(os.getpid())})
+            return req.keep_alive
+
+        if req.path.rstrip("/") in ("/search", "/agent", "/ask") and req.method not in ("GET", "POST"):
+            raise HTTPError(405, "Use GET or POST")
+
+        p = req.params()
+        if route[1] == "/search":
+            question = self._question(p)
+            top_k = self._int(p, "top_k", 10)
+            hits = await self.service.search(question, top_k_per_store=self._int(p, "top_k_per_store", 8),
+                                             top_k_total=top_k, where=self._where(p))
+            full = self._flag(p, "content")
+            await send(writer, 200, {"question": question, "hits": [hit_to_json(h, full) for h in hits]},
+                       keep_alive=req.keep_alive)
+            return req.keep_alive
+
+        if route[1] == "/agent":
+            question = self._question(p)
+            routed = await self.service.route(question)
+            await send(writer, 200, {"question": question, **routed}, keep_alive=req.keep_alive)
+            return req.keep_alive
+
+        if route[1] == "/ask":
+            question = self._question(p)
+            agent = p.get("agent")
+            if agent is not None and agent not in rag_agent_v2.AGENT_PROMPTS:
+                raise HTTPError(400, f"'agent' must be one of {sorted(rag_agent_v2.AGENT_PROMPTS)}")
+            top_k = self._int(p, "top_k", 10)
+            stream = self._flag(p, "stream") or "text/event-stream" in req.headers.get("accept", "")
+            if stream:
+                await self._ask_stream(writer, question, agent, top_k)
+                return False
+            res = await self.service.ask(question, agent=agent, top_k=top_k)
+            await send(writer, 200, {
+                "question": question,
+                "answer": res["answer"],
+                "agent": res["agent"],
+                "cached": res["cached"],
+                "sources": [hit_to_json(h) for h in res["hits"]],
+            }, keep_alive=req.keep_alive)
+            return req.keep_alive
+
+        raise HTTPError(404, f"No route for {req.method} {req.path}")
+
+    async def _ask_stream(self, writer, question: str, agent: str, top_k: int):
+        writer.write(_head(200, {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "Connection": "close",
+            "X-Accel-Buffering": "no",
+        }))
+        events = self.service.ask_stream(question, agent=agent, top_k=top_k)
+        try:
+            async for ev in events:
+                if "hits" in ev:
+                    writer.write(sse("meta", {"agent": ev["agent"], "sources": [hit_to_json(h) for h in ev["hits"]]}))
+                elif "token" in ev:
+                    writer.write(sse("token", {"token": ev["token"]}))
+                else:
+                    writer.write(sse("done", {"answer": ev["answer"], "cached": ev["cached"]}))
+                await writer.drain()  # raises when the client disconnected -> generation stops
+        except (rag_service.ServiceBusy, rag_service.StageTimeout) as e:
+            writer.write(sse("error", {"error": str(e)}))
+            await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # the 200 headers are out: a 500 response would land inside the event stream
+            log.exception("stream failed")
+            writer.write(sse("error", {"error": repr(e)}))
+            await writer.drain()
+        finally:
+            await events.aclose()
+
+    async def on_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    req = await read_request(reader)
+                    if req is None:
+                        break
+                    keep_alive = await self.handle(req, writer)
+                except HTTPError as e:
+                    await send(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                except rag_service.ServiceBusy as e:
+                    await send(writer, 503, {"error": str(e)}, keep_alive=False, extra_headers={"Retry-After": "5"})
+                    break
+                except rag_service.StageTimeout as e:
+                    await send(writer, 504, {"error": str(e)}, keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            log.exception("request failed")
+            try:
+                await send(writer, 500, {"error": repr(e)}, keep_alive=False)
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+
+# ----------------------------------------------------
+# WORKERS
+# ----------------------------------------------------
+
+async def serve(sock: socket.socket):
+    server = RAGServer(rag_service.RAGService())
+    srv = await asyncio.start_server(server.on_connection, sock=sock, limit=MAX_BODY)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows
+    async with srv:
+        await stop.wait()
+
+
+def make_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(512)
+    sock.setblocking(False)
+    return sock
+
+
+def run_workers(sock: socket.socket, workers: int):
+    """Fork `workers` children sharing sock; restart the ones that die until SIGTERM/SIGINT."""
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                asyncio.run(serve(sock))
+            finally:
+                os._exit(0)
+        children[pid] = time.time()
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if not stopping and started is not None:
+            log.warning("worker %s exited (status %s), restarting", pid, status)
+            if time.time() - started < 1.0:
+                time.sleep(1.0)  # crash loop: do not spin
+            spawn()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ESILV assistant HTTP API")
+    parser.add_argument("--host", default=os.environ.get("ESILV_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("ESILV_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("ESILV_WORKERS", "0")),
+                        help="worker processes (0 = one per CPU, 1 = no fork)")
+    parser.add_argument("--no-preload", action="store_true", help="load the stores in each worker, lazily")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    if not hasattr(os, "fork"):
+        workers = 1
+
+    sock = make_socket(args.host, args.port)
+    if not args.no_preload:
+        # before fork: one copy of the indexes, shared by every worker
+        t0 = time.perf_counter()
+        rag_agent_v2.STORES.preload(background=False)
+        log.info("stores loaded in %.2fs: %s", time.perf_counter() - t0, rag_agent_v2.STORES.timings)
+
+    log.info("listening on http://%s:%s (%d worker%s)", args.host, args.port, workers, "s" if workers > 1 else "")
+    if workers == 1:
+        try:
+            asyncio.run(serve(sock))
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_workers(sock, workers)
+    sys.exit(0)
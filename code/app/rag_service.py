@@ -0,0 +1,328 @@
+# rag_service.py
+# Asyncio service layer around rag_agent_v2, shared by the UI and other clients
+# - identical in-flight questions are coalesced into one computation
+# - separate concurrency limits for Ollama embeddings and generation (semaphores):
+#   the local Ollama gets backpressure instead of every session at once
+# - waiting for a slot is bounded (queue timeout), so are the Ollama calls
+# - async entry points: search(), retrieve(), route(), ask(), ask_stream()
+# - sync callers (Streamlit) use the process-wide service on a background loop:
+#   get_service(), run_sync(), iter_sync()
+#
+# Settings: ESILV_MAX_EMBED (2), ESILV_MAX_GENERATE (1), ESILV_QUEUE_TIMEOUT (30 s),
+#           ESILV_EMBED_TIMEOUT (30 s), ESILV_GENERATE_TIMEOUT (180 s)
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import rag_agent_v2
+from embed_cache import normalize_text
+from search_filter import where_key
+
+MAX_EMBED = int(os.environ.get("ESILV_MAX_EMBED", "2"))
+MAX_GENERATE = int(os.environ.get("ESILV_MAX_GENERATE", "1"))
+QUEUE_TIMEOUT = float(os.environ.get("ESILV_QUEUE_TIMEOUT", "30"))
+EMBED_TIMEOUT = float(os.environ.get("ESILV_EMBED_TIMEOUT", "30"))
+GENERATE_TIMEOUT = float(os.environ.get("ESILV_GENERATE_TIMEOUT", "180"))
+
+
+class ServiceBusy(Exception):
+    """No embedding / generation slot freed within the queue timeout."""
+
+
+class StageTimeout(Exception):
+    """An Ollama call exceeded its timeout."""
+
+
+_DONE = object()
+
+
+class RAGService:
+    def __init__(self, max_embed: int = MAX_EMBED, max_generate: int = MAX_GENERATE,
+                 queue_timeout: float = QUEUE_TIMEOUT, embed_timeout: float = EMBED_TIMEOUT,
+                 generate_timeout: float = GENERATE_TIMEOUT, executor: ThreadPoolExecutor = None):
+        """
+        max_embed / max_generate: concurrent Ollama embedding / chat calls
+        queue_timeout: max wait for a slot (ServiceBusy)
+        embed_timeout / generate_timeout: max duration of one call (StageTimeout);
+          for streams, max wait between two tokens
+        Must be created inside the event loop that uses it.
+        """
+        self.max_embed = max_embed
+        self.max_generate = max_generate
+        self.queue_timeout = queue_timeout
+        self.embed_timeout = embed_timeout
+        self.generate_timeout = generate_timeout
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_embed + max_generate + 4, thread_name_prefix="rag-service")
+
+        self._embed_sem = asyncio.Semaphore(max_embed)
+        self._gen_sem = asyncio.Semaphore(max_generate)
+        self._inflight = {}   # key -> asyncio.Future shared by identical requests
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.waiting = {"embed": 0, "generate": 0}
+
+    # ---------- helpers ----------
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, metrics.bind(fn), *args)
+
+    async def _acquire(self, sem: asyncio.Semaphore, name: str):
+        self.waiting[name] += 1
+        try:
+            with metrics.stage("queue_wait", kind=name):
+                await asyncio.wait_for(sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            metrics.inc("service_rejected", kind=name)
+            raise ServiceBusy(f"No {name} slot available after {self.queue_timeout:g}s") from None
+        finally:
+            self.waiting[name] -= 1
+
+    async def _limited(self, sem: asyncio.Semaphore, name: str, timeout: float, fn, *args):
+        """Run fn in the executor holding a slot of sem until the call really ends."""
+        await self._acquire(sem, name)
+        loop = asyncio.get_running_loop()
+        try:
+            fut = loop.run_in_executor(self.executor, metrics.bind(fn), *args)
+        except BaseException:
+            sem.release()
+            raise
+        # released when the thread finishes, not on timeout: Ollama is still busy until then
+        fut.add_done_callback(lambda _: loop.call_soon_threadsafe(sem.release))
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            metrics.inc("service_timeouts", kind=name)
+            raise StageTimeout(f"{name} took more than {timeout:g}s") from None
+
+    async def _coalesced(self, key, make_coro):
+        """Identical in-flight requests share one computation."""
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            metrics.inc("service_coalesced", kind=key[0])
+            return await asyncio.shield(fut)
+
+        fut = asyncio.ensure_future(make_coro())
+        self._inflight[key] = fut
+
+        def done(f):
+            self._inflight.pop(key, None)
+            if not f.cancelled():
+                f.exception()  # retrieved even if every waiter was cancelled
+
+        fut.add_done_callback(done)
+        return await asyncio.shield(fut)
+
+    # ---------- pipeline steps ----------
+
+    async def embed(self, question: str):
+        cache = rag_agent_v2.EMBED_CACHE
+        v = cache.lookup(rag_agent_v2.EMBED_MODEL, question)
+        if v is not None:
+            return v
+        return await self._limited(self._embed_sem, "embed", self.embed_timeout, rag_agent_v2.embed, question)
+
+    async def retrieve(self, question: str, top_k_per_store: int = 8, top_k_total: int = 10,
+                       where: dict = None) -> rag_agent_v2.RetrievalContext:
+        """where: metadata filter, e.g. {"rubric": "admissions"} (see search_filter.py)"""
+        key = ("retrieve", normalize_text(question), top_k_per_store, top_k_total, where_key(where))
+
+        async def compute():
+            rag = await self._run(rag_agent_v2.get_rag)
+            if rag.keyword_only(question):
+                hits = await self._run(lambda: rag.search_lexical(
+                    question, top_k_per_store=top_k_per_store, top_k_total=top_k_total, where=where))
+                if hits:  # BM25 only, no embedding call
+                    return rag_agent_v2.RetrievalContext.from_hits(question, None, hits)
+            q_vec = await self.embed(question)
+            hits = await self._run(lambda: rag.search_vector(
+                q_vec, top_k_per_store=top_k_per_store, top_k_total=top_k_total, query_text=question,
+                where=where))
+            return rag_agent_v2.RetrievalContext.from_hits(question, q_vec, hits)
+
+        return await self._coalesced(key, compute)
+
+    async def route(self, question: str) -> dict:
+        """{"agent", "confidence", "method"}: embedding (cached) + agent prototypes, no search."""
+        rag = await self._run(rag_agent_v2.get_rag)
+        q_vec = None if rag.keyword_only(question) else await self.embed(question)
+        return await self._run(lambda: rag_agent_v2.route_question(question, q_vec=q_vec))
+
+    async def search(self, question: str, top_k_per_store: int = 8, top_k_total: int = 10, where: dict = None):
+        ctx = await self.retrieve(question, top_k_per_store=top_k_per_store, top_k_total=top_k_total, where=where)
+        return ctx.hits
+
+    async def _prepare(self, question: str, agent: str, top_k: int, ctx=None):
+        if ctx is None:
+            ctx = await self.retrieve(question, top_k_per_store=8, top_k_total=max(top_k, 8),
+                                      where=rag_agent_v2.agent_where(agent))
+        if agent is None:
+            agent = rag_agent_v2.detect_agent(question, ctx=ctx)
+        prompt = rag_agent_v2.AGENT_PROMPTS[agent]
+        hits = ctx.top(top_k)
+        chunk_ids = [(h["store"], h["idx"]) for h in hits]
+        return ctx, agent, prompt, hits, chunk_ids
+
+    async def ask(self, question: str, agent: str = None, top_k: int = 10, use_cache: bool = True) -> dict:
+        """
+        agent: "Admissions" / "Formations" / "International", or None (detect_agent)
+        Returns {"answer", "agent", "hits", "cached"}.
+        """
+        key = ("ask", normalize_text(question), agent, top_k, use_cache)
+
+        async def compute():
+            with metrics.trace("service.ask"):
+                ctx, agent_name, prompt, hits, chunk_ids = await self._prepare(question, agent, top_k)
+
+                if use_cache:
+                    cached = rag_agent_v2.ANSWER_CACHE.lookup(ctx.q_vec, prompt, chunk_ids, question=question)
+                    metrics.inc("answer_cache", result="hit" if cached is not None else "miss")
+                    if cached is not None:
+                        return {"answer": cached, "agent": agent_name, "hits": hits, "cached": True}
+
+                context = rag_agent_v2._build_context(hits)
+                answer = await self._limited(self._gen_sem, "generate", self.generate_timeout,
+                                             rag_agent_v2.generate_answer, context, question, prompt)
+                answer = rag_agent_v2._check_answer(answer, context)
+                if use_cache:
+                    rag_agent_v2.ANSWER_CACHE.store(ctx.q_vec, prompt, chunk_ids, answer, question=question)
+                return {"answer": answer, "agent": agent_name, "hits": hits, "cached": False}
+
+        return await self._coalesced(key, compute)
+
+    async def ask_stream(self, question: str, agent: str = None, top_k: int = 10, use_cache: bool = True,
+                         ctx: rag_agent_v2.RetrievalContext = None):
+        """
+        ctx: reuse a retrieve() result (the UI shows the sources before generating)
+        Async generator of events:
+          {"agent": ..., "hits": [...]}       once, before generation
+          {"token": "..."}                    raw tokens as generated
+          {"done": True, "answer": ..., "cached": bool}   final answer after the guardrails
+        """
+        ctx, agent_name, prompt, hits, chunk_ids = await self._prepare(question, agent, top_k, ctx)
+        yield {"agent": agent_name, "hits": hits}
+
+        if use_cache:
+            cached = rag_agent_v2.ANSWER_CACHE.lookup(ctx.q_vec, prompt, chunk_ids, question=question)
+            metrics.inc("answer_cache", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                yield {"token": cached}
+                yield {"done": True, "answer": cached, "cached": True}
+                return
+
+        context = rag_agent_v2._build_context(hits)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()   # client went away: stop pulling tokens from Ollama
+
+        def produce():
+            try:
+                for token in rag_agent_v2.generate_answer_stream(context, question, prompt):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+        await self._acquire(self._gen_sem, "generate")
+        try:
+            fut = loop.run_in_executor(self.executor, metrics.bind(produce))
+        except BaseException:
+            self._gen_sem.release()
+            raise
+        fut.add_done_callback(lambda _: loop.call_soon_threadsafe(self._gen_sem.release))
+
+        tokens = []
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), self.generate_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    metrics.inc("service_timeouts", kind="generate")
+                    raise StageTimeout(f"no token for {self.generate_timeout:g}s") from None
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                tokens.append(item)
+                yield {"token": item}
+        finally:
+            stop.set()
+
+        answer = rag_agent_v2._check_answer("".join(tokens), context)
+        if use_cache:
+            rag_agent_v2.ANSWER_CACHE.store(ctx.q_vec, prompt, chunk_ids, answer, question=question)
+        yield {"done": True, "answer": answer, "cached": False}
+
+    def stats(self) -> dict:
+        return {
+            "max_embed": self.max_embed,
+            "max_generate": self.max_generate,
+            "inflight": len(self._inflight),
+            "waiting": dict(self.waiting),
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+# ----------------------------------------------------
+# PROCESS-WIDE SERVICE FOR SYNC CALLERS
+# ----------------------------------------------------
+
+_loop = None
+_service = None
+_lock = threading.Lock()
+
+
+def get_service() -> RAGService:
+    """RAGService running on a daemon event-loop thread (one per process)."""
+    global _loop, _service
+    with _lock:
+        if _service is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rag-service-loop", daemon=True).start()
+
+            async def create():
+                return RAGService()
+
+            _service = asyncio.run_coroutine_threadsafe(create(), _loop).result()
+        return _service
+
+
+async def _in_trace(tr, awaitable):
+    # the caller's trace (contextvar) does not cross run_coroutine_threadsafe by itself
+    with metrics.attach(tr):
+        return await awaitable
+
+
+def run_sync(coro, timeout: float = None):
+    """Run a coroutine of the shared service from sync code and wait for its result."""
+    get_service()
+    return asyncio.run_coroutine_threadsafe(_in_trace(metrics.current_trace(), coro), _loop).result(timeout)
+
+
+def iter_sync(agen):
+    """Iterate an async generator of the shared service from sync code."""
+    get_service()
+    tr = metrics.current_trace()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(_in_trace(tr, agen.__anext__()), _loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), _loop).result()
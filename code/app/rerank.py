@@ -0,0 +1,153 @@
+# rerank.py
+# Optional second stage after the FAISS search (ESILV_RERANK=mmr | cross, off by default)
+# - the search over-fetches a candidate pool (pool_size(top_k)), the reranker keeps top_k
+# - mmr: maximal marginal relevance on the stored vectors (no Ollama call): each pick is
+#   relevant to the question and not redundant with the hits already picked, so
+#   near-identical pdf parts / site chunks stop crowding out other sources
+# - cross: relevance from a local cross-encoder (sentence-transformers, ESILV_RERANK_MODEL),
+#   then the same mmr selection; falls back to mmr when the package or model is missing
+#
+# Usage: ESILV_RERANK=mmr streamlit run code/app/streamlit_app.py
+#        rag.search_vector(q_vec, top_k_total=6, rerank="mmr")
+
+import os
+import threading
+
+import numpy as np
+
+import metrics
+from ann_index import base_index
+
+log = metrics.get_logger()
+
+RERANK = os.environ.get("ESILV_RERANK", "")          # "", "mmr" or "cross"
+MMR_LAMBDA = float(os.environ.get("ESILV_MMR_LAMBDA", "0.7"))
+POOL_FACTOR = int(os.environ.get("ESILV_RERANK_POOL", "3"))
+CROSS_MODEL = os.environ.get("ESILV_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+CROSS_MAX_CHARS = 1200
+
+MODES = ("mmr", "cross")
+
+
+def pool_size(top_k: int) -> int:
+    return max(POOL_FACTOR * top_k, top_k + 10)
+
+
+# ----------------------------------------------------
+# STORED VECTORS
+# ----------------------------------------------------
+
+_direct_map_lock = threading.Lock()
+
+
+def store_vectors(store: dict, ids) -> np.ndarray:
+    """[len(ids), d] float32 vectors of a store (ids as returned by its index.search)."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if store.get("vectors") is not None:
+        # float copy kept next to a compressed index
+        return np.asarray(store["vectors"][ids], dtype="float32")
+    index = store["index"]
+    try:
+        return index.reconstruct_batch(ids)
+    except RuntimeError:
+        # IVF: reconstruct needs the id -> list direct map (built once)
+        import faiss
+        ivf = faiss.extract_index_ivf(base_index(index))
+        with _direct_map_lock:
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                ivf.make_direct_map()
+        return index.reconstruct_batch(ids)
+
+
+def hit_vectors(hits, stores) -> np.ndarray:
+    by_name = {s["name"]: s for s in stores}
+    V = np.empty((len(hits), 0), dtype="float32")
+    rows = {}
+    for i, h in enumerate(hits):
+        rows.setdefault(h["store"], []).append(i)
+    for name, positions in rows.items():
+        vecs = store_vectors(by_name[name], [hits[i]["idx"] for i in positions])
+        if V.shape[1] == 0:
+            V = np.empty((len(hits), vecs.shape[1]), dtype="float32")
+        V[positions] = vecs
+    return V
+
+
+# ----------------------------------------------------
+# MMR
+# ----------------------------------------------------
+
+def mmr_select(V: np.ndarray, relevance: np.ndarray, k: int, lam: float = MMR_LAMBDA):
+    """
+    Greedy MMR: argmax lam * relevance - (1 - lam) * max similarity to the picked rows.
+    V: [n, d] L2-normalized, relevance: [n]. Returns the picked row indexes, in order.
+    """
+    n = V.shape[0]
+    k = min(k, n)
+    if k == 0:
+        return []
+    sim = V @ V.T                                   # [n, n], one matmul
+    redundancy = np.zeros(n, dtype="float32")      # max similarity to the picked rows
+    available = np.ones(n, dtype=bool)
+    picked = []
+    for _ in range(k):
+        score = lam * relevance - (1.0 - lam) * redundancy
+        score[~available] = -np.inf
+        j = int(np.argmax(score))
+        picked.append(j)
+        available[j] = False
+        np.maximum(redundancy, sim[:, j], out=redundancy)
+    return picked
+
+
+# ----------------------------------------------------
+# CROSS-ENCODER (optional)
+# ----------------------------------------------------
+
+_cross_model = None
+_cross_lock = threading.Lock()
+_cross_failed = False
+
+
+def get_cross_encoder():
+    """sentence-transformers CrossEncoder, or None when unavailable (then mmr only)."""
+    global _cross_model, _cross_failed
+    if _cross_model is not None or _cross_failed:
+        return _cross_model
+    with _cross_lock:
+        if _cross_model is None and not _cross_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                _cross_model = CrossEncoder(CROSS_MODEL)
+            except Exception as e:  # package missing, model not downloaded...
+                _cross_failed = True
+                log.warning("cross-encoder unavailable (%s), reranking with mmr only", e)
+    return _cross_model
+
+
+def cross_scores(question: str, hits):
+    model = get_cross_encoder()
+    if model is None or not question:
+        return None
+    pairs = [(question, (h["doc"].get("content") or "")[:CROSS_MAX_CHARS]) for h in hits]
+    scores = np.asarray(model.predict(pairs), dtype="float32")
+    return 1.0 / (1.0 + np.exp(-scores))            # logits -> [0, 1], comparable to cosine
+
+
+# ----------------------------------------------------
+# ENTRY POINT
+# ----------------------------------------------------
+
+def rerank_hits(q_vec: np.ndarray, hits, top_k: int, stores, mode: str = "mmr", question: str = None,
+                lam: float = MMR_LAMBDA):
+    """top_k hits of the candidate pool, reranked; scores are left as returned by FAISS."""
+    if len(hits) <= 1:
+        return hits[:top_k]
+    with metrics.stage("rerank", mode=mode):
+        V = hit_vectors(hits, stores)
+        relevance = V @ np.asarray(q_vec, dtype="float32").reshape(-1)
+        if mode == "cross":
+            ce = cross_scores(question, hits)
+            if ce is not None:
+                relevance = ce
+        return [hits[i] for i in mmr_select(V, relevance, top_k, lam)]
@@ -0,0 +1,166 @@
+# search_filter.py
+# Metadata filters applied inside the search, not on its results
+# - where={"rubric": {"admissions", "formations"}, "store": "v3_pdf", "page": 3}:
+#   column == value or column in {values}, several columns = AND
+#   columns: store, any mapping field (rubric, source_file, page, url...), and agent
+#   (chunks whose rubric routes to that agent, agent_router.agent_for_rubric)
+# - Partitions: per store, value -> sorted id array; rubric / source_file / page / agent are
+#   precomputed when the store is loaded, other columns on first use
+# - filtered_search(): the FAISS search only visits the partition (IDSelectorBatch in the
+#   SearchParameters) so a filtered query still returns a full top_k; partitions of at most
+#   ESILV_FILTER_EXACT_MAX chunks (and every partition of a PQ store, IndexPQ has no selector
+#   support) are scored exactly on their stored vectors instead, and HNSW gets an efSearch
+#   scaled by the selectivity (a graph walk finds few allowed nodes)
+#
+# Usage: rag.search_vector(q_vec, top_k_total=8, where={"rubric": "admissions"})
+#        rag.search_text("frais de scolarité", where={"store": "v3_pdf", "source_file": "brochure.pdf"})
+
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from agent_router import agent_for_rubric
+from ann_index import accepts_selector, base_index, search_params
+from docstore import INT_MISSING
+from rerank import store_vectors
+
+PARTITION_COLUMNS = ("rubric", "source_file", "page", "agent")
+EXACT_MAX = int(os.environ.get("ESILV_FILTER_EXACT_MAX", "256"))
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def normalize_where(where):
+    """{column: value or collection} -> {column: frozenset of str}, None when empty."""
+    if not where:
+        return None
+    norm = {}
+    for column, value in where.items():
+        values = value if isinstance(value, (set, frozenset, list, tuple)) else [value]
+        norm[column] = frozenset(str(v) for v in values)
+    return norm
+
+
+def where_key(where) -> tuple:
+    """Hashable form of a where (cache / coalescing keys)."""
+    norm = normalize_where(where) or {}
+    return tuple(sorted((c, tuple(sorted(v))) for c, v in norm.items()))
+
+
+def store_allowed(name: str, where) -> bool:
+    values = (where or {}).get("store")
+    return values is None or name in values
+
+
+# ----------------------------------------------------
+# PARTITIONS (per store)
+# ----------------------------------------------------
+
+class Partitions:
+    """value -> sorted ids of a store's mapping (dict or DocStore), per column."""
+
+    def __init__(self, mapping, columns=PARTITION_COLUMNS):
+        self.mapping = mapping
+        self._columns = {}
+        self._lock = threading.Lock()
+        for column in columns:
+            self.column(column)
+
+    def _values(self, column: str):
+        """(ids, values as str or None) of every chunk, columnar when the docstore has it."""
+        m = self.mapping
+        if hasattr(m, "columns") and column in m.columns():
+            ids = m.ids()
+            try:
+                raw = np.asarray(m.column(column))[ids]
+            except ValueError:  # text column
+                return ids, [m.field(int(i), column) for i in ids]
+            cats = m.categories(column)
+            if cats:
+                return ids, [cats[c] if c >= 0 else None for c in raw.tolist()]
+            return ids, [None if v == INT_MISSING else v for v in raw.tolist()]
+        ids, values = [], []
+        for key, doc in m.items():
+            ids.append(int(key))
+            values.append((doc or {}).get(column))
+        return np.asarray(ids, dtype=np.int64), values
+
+    def column(self, column: str) -> dict:
+        parts = self._columns.get(column)
+        if parts is not None:
+            return parts
+        with self._lock:
+            if column not in self._columns:
+                if column == "agent":
+                    ids, values = self._values("rubric")
+                    values = [agent_for_rubric(v) for v in values]
+                else:
+                    ids, values = self._values(column)
+                groups = {}
+                for i, v in zip(ids.tolist(), values):
+                    if v is not None:
+                        groups.setdefault(str(v), []).append(i)
+                self._columns[column] = {v: np.unique(np.asarray(g, dtype=np.int64)) for v, g in groups.items()}
+            return self._columns[column]
+
+    def select(self, where):
+        """Ids matching every non-store predicate of a normalized where, or None (no predicate)."""
+        selected = None
+        for column, values in (where or {}).items():
+            if column == "store":
+                continue
+            parts = self.column(column)
+            ids = [parts[v] for v in values if v in parts]
+            ids = np.unique(np.concatenate(ids)) if ids else _EMPTY
+            selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+        return selected
+
+
+def store_partitions(store: dict) -> Partitions:
+    parts = store.get("partitions")
+    if parts is None:
+        parts = store["partitions"] = Partitions(store["mapping"])
+    return parts
+
+
+# ----------------------------------------------------
+# FILTERED SEARCH
+# ----------------------------------------------------
+
+def id_selector(ids: np.ndarray):
+    return faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+
+
+def filtered_ef(index, k: int, n_allowed: int, ef_search: int = None):
+    """efSearch for an HNSW search restricted to n_allowed of index.ntotal vectors."""
+    inner = base_index(index)
+    if not isinstance(inner, faiss.IndexHNSW):
+        return ef_search
+    ef = ef_search or inner.hnsw.efSearch
+    return int(min(index.ntotal, max(ef, 2 * k * index.ntotal // max(n_allowed, 1))))
+
+
+def filtered_search(store: dict, Q: np.ndarray, k: int, ids: np.ndarray, nprobe: int = None,
+                    ef_search: int = None):
+    """
+    (D, I) [nq, k] of store["index"] restricted to ids (-1 padded when the
+    partition is smaller than k). Small partitions, and indexes without
+    selector support: exact inner products.
+    """
+    Q = np.ascontiguousarray(Q, dtype="float32").reshape(-1, store["index"].d)
+    if ids.size <= EXACT_MAX or not accepts_selector(store["index"]):
+        D = np.full((Q.shape[0], k), -np.inf, dtype="float32")
+        I = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        if ids.size == 0:
+            return D, I
+        S = Q @ store_vectors(store, ids).T                 # [nq, |partition|]
+        top = np.argsort(-S, axis=1, kind="stable")[:, :k]
+        D[:, :top.shape[1]] = np.take_along_axis(S, top, axis=1)
+        I[:, :top.shape[1]] = ids[top]
+        return D, I
+    index = store["index"]
+    params = search_params(index, nprobe=nprobe, ef_search=filtered_ef(index, k, ids.size, ef_search),
+                           sel=id_selector(ids))
+    return index.search(Q, k, params=params)
@@ -15,12 +15,29 @@ sys.path.append(os.path.dirname(__file__))
 
 try:
     import rag_agent_v2 as rag_agent
+    import rag_service
+    import metrics
 except Exception as e:
     st.error(f"Impossible d'importer le module rag_agent: {e}")
     st.stop()
 
 st.set_page_config(page_title="ESILV RAG Chatbot", layout="wide")
 
+# Index FAISS chargés une seule fois par process (partagés entre sessions).
+# Le préchargement tourne en arrière-plan pendant le rendu de la page.
+rag_agent.STORES.preload(background=True)
+# /metrics (Prometheus) + /metrics.json si ESILV_METRICS_PORT est défini
+metrics.start_http_exporter()
+
+
+@st.cache_resource(show_spinner="Chargement des index FAISS...")
+def get_rag():
+    return rag_agent.get_rag()
+
+
+# Service asyncio (boucle en arrière-plan) partagé par toutes les sessions du process
+service = rag_service.get_service()
+
 st.title("ESILV — Chatbot")
 
 # Styles pour bulles conversation (utilisateur à droite, agent à gauche)
@@ -136,11 +153,23 @@ section[data-testid="stSidebar"] h3 {
     unsafe_allow_html=True
 )
 
-agent_map = {
-    "Admissions": rag_agent.AGENT_ADMISSION,
-    "Formations": rag_agent.AGENT_FORMATION,
-    "International": rag_agent.AGENT_INTERNATIONAL,
-}
+def user_bubble(text: str) -> str:
+    html = text.replace('\n', '<br>')
+    return f"""
+        <div class="chat-row chat-right">
+            <div class="user">{html}</div>
+        </div>
+        """
+
+
+def bot_bubble(text: str) -> str:
+    html = text.replace('\n', '<br>')
+    return f"""
+        <div class="chat-row chat-left">
+            <div class="bot">{html}</div>
+        </div>
+        """
+
 
 def answer_uses_sources(answer: str, sources: list) -> bool:
     if not answer or not sources:
@@ -237,6 +266,7 @@ with st.sidebar:
                     'sources': [],
                     'retrieval_time': 0,
                     'gen_time': 0,
+                    'ttft': 0,
                     'found': False,
                 })
             except Exception as e:
@@ -255,7 +285,7 @@ with st.sidebar:
         else:
             buf = io.StringIO()
             writer = csv.writer(buf)
-            writer.writerow(["question", "answer", "agent", "found", "retrieval_time", "gen_time", "sources"])
+            writer.writerow(["question", "answer", "agent", "found", "retrieval_time", "gen_time", "ttft", "sources"])
             for item in hist:
                 sources_txt = " | ".join([f"{s.get('title','')}<{s.get('url','')}>" for s in item.get("sources", [])])
                 writer.writerow([
@@ -265,10 +295,28 @@ with st.sidebar:
                     item.get("found", False),
                     item.get("retrieval_time", ""),
                     item.get("gen_time", ""),
+                    item.get("ttft", ""),
                     sources_txt,
                 ])
             st.download_button("Download CSV", data=buf.getvalue(), file_name="history.csv", mime="text/csv")
 
+    with st.expander("Métriques (latence par étape)"):
+        snap = metrics.snapshot()
+        rows = [
+            {
+                "étape": h["name"] + "".join(f" [{v}]" for v in h["labels"].values()),
+                "n": h["count"],
+                "p50 ms": h["p50_ms"],
+                "p95 ms": h["p95_ms"],
+                "p99 ms": h["p99_ms"],
+            }
+            for h in snap["histograms"]
+        ]
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.caption("Aucune mesure pour l'instant.")
+
 # Paramètres fixes (non modifiables par l'utilisateur)
 top_k = 5
 truncate_chars = 180
@@ -280,62 +328,82 @@ question = st.chat_input("Posez votre question…")
 
 
 if question:
-    # Indiquer que l'agent tourne
-    with st.spinner("Agent en cours..."):
-        # 1) Détection d'agent (utilise FAISS en interne)
-        agent_choice = rag_agent.detect_agent(question)
-        agent_prompt = agent_map[agent_choice]
-
-        # 2) Retrieval (mesurer le temps)
-        retrieval_start = time.time()
-        sources = []
-        try:
-            q_vec = rag_agent.embed(question)
-            q_vec = np.expand_dims(q_vec, axis=0)
-            D, I = rag_agent.index.search(q_vec, top_k)
-            for score, idx in zip(D[0], I[0]):
-                key = str(int(idx))
-                if key in rag_agent.mapping:
-                    doc = rag_agent.mapping[key]
+    # Trace de la requête : une ligne JSON par question si ESILV_METRICS_JSONL est défini
+    with metrics.trace("question") as trace:
+        # Indiquer que l'agent tourne
+        with st.spinner("Agent en cours..."):
+            # 1) Retrieval unique (un seul embedding + une seule recherche multi-store)
+            retrieval_start = time.time()
+            ctx = None
+            sources = []
+            try:
+                get_rag()
+                # service partagé entre sessions : requêtes identiques fusionnées, Ollama limité
+                ctx = rag_service.run_sync(service.retrieve(question, top_k_per_store=8, top_k_total=max(top_k, 8)))
+                for h in ctx.top(top_k):
+                    doc = h["doc"]
                     snippet = doc.get("content", "")[: int(truncate_chars)].replace("\n", " ")
-                    sources.append({"score": float(score), "title": doc.get("title"), "url": doc.get("url"), "snippet": snippet, "rubric": doc.get("rubric","")})
-        except Exception as e:
-            st.warning(f"Impossible de récupérer les sources (FAISS/Ollama) : {e}")
-        retrieval_time = time.time() - retrieval_start
+                    sources.append({"score": h["score"], "title": doc.get("title"), "url": doc.get("url"), "snippet": snippet, "rubric": doc.get("rubric",""), "store": h["store"]})
+            except Exception as e:
+                st.warning(f"Impossible de récupérer les sources (FAISS/Ollama) : {e}")
+            retrieval_time = time.time() - retrieval_start
+
+            # 2) Détection d'agent (réutilise les hits du retrieval)
+            agent_choice = rag_agent.detect_agent(question, ctx=ctx)
 
-        # 3) Génération (mesurer le temps)
+        # 3) Génération en streaming (mesurer le temps total + time-to-first-token)
+        live = st.empty()
         gen_start = time.time()
+        ttft = None
         try:
-            answer = rag_agent.ask_agent(question, agent_prompt, top_k=top_k)
+            answer = None
+            partial = ""
+            events = rag_service.iter_sync(service.ask_stream(question, agent=agent_choice, top_k=top_k, ctx=ctx))
+            for event in events:
+                if "token" in event:
+                    if ttft is None:
+                        ttft = time.time() - gen_start
+                    partial += event["token"]
+                    live.markdown(user_bubble(question) + bot_bubble(partial + " ▌"), unsafe_allow_html=True)
+                elif event.get("done"):
+                    answer = event["answer"]
+        except rag_service.ServiceBusy:
+            st.error("L'assistant est très sollicité, merci de réessayer dans quelques instants.")
+            answer = None
         except Exception as e:
             st.error(f"Erreur lors de l'appel à l'agent : {e}")
             answer = None
         gen_time = time.time() - gen_start
-
-    # Déterminer si l'agent a trouvé la réponse pertinente
-    found = False
-    if answer:
-        a_lower = answer.lower()
-
-        if (
-                "je ne sais pas" in a_lower
-                or "je n'ai pas" in a_lower
-                or "je ne sais pas répondre" in a_lower
-        ):
-            found = False
-        else:
-            found = answer_uses_sources(answer, sources)
-
-    if answer is not None:
-        st.session_state.history.append({
-            "question": question,
-            "answer": answer,
-            "agent": agent_choice,
-            "sources": sources,
-            "retrieval_time": round(retrieval_time, 3),
-            "gen_time": round(gen_time, 3),
-            "found": found,
-        })
+        # La réponse finale (après garde-fous) est affichée par l'historique ci-dessous
+        live.empty()
+
+        # Déterminer si l'agent a trouvé la réponse pertinente
+        found = False
+        if answer:
+            a_lower = answer.lower()
+
+            if (
+                    "je ne sais pas" in a_lower
+                    or "je n'ai pas" in a_lower
+                    or "je ne sais pas répondre" in a_lower
+            ):
+                found = False
+            else:
+                found = answer_uses_sources(answer, sources)
+
+        if answer is not None:
+            st.session_state.history.append({
+                "question": question,
+                "answer": answer,
+                "agent": agent_choice,
+                "sources": sources,
+                "retrieval_time": round(retrieval_time, 3),
+                "gen_time": round(gen_time, 3),
+                "ttft": round(ttft, 3) if ttft is not None else None,
+                "found": found,
+            })
+        if trace is not None:
+            trace.attrs["agent"] = agent_choice
 
 # =========================
 # AFFICHAGE DU CHAT
@@ -343,25 +411,7 @@ if question:
 for turn in reversed(st.session_state.history):
 
     # Message utilisateur (droite)
-    st.markdown(
-        f"""
-        <div class="chat-row chat-right">
-            <div class="user">{turn['question'].replace('\n','<br>')}</div>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
+    st.markdown(user_bubble(turn['question']), unsafe_allow_html=True)
 
     # Message bot (gauche)
-    st.markdown(
-        f"""
-        <div class="chat-row chat-left">
-            <div class="bot">{turn['answer'].replace('\n','<br>')}</div>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-
-
-
-
+    st.markdown(bot_bubble(turn['answer']), unsafe_allow_html=True)
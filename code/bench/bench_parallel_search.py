@@ -0,0 +1,65 @@
+# bench_parallel_search.py
+# Sequential vs thread-pool multi-store search (MultiStoreRAG.search_vector)
+# Synthetic stores (random normalized vectors), no Ollama needed.
+#
+# Usage:
+#   python code/bench/bench_parallel_search.py --store-size 50000 --stores 1 2 4 8
+
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+os.environ.setdefault("ESILV_EMBED_CACHE_DIR", "")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import rag_agent_v2  # noqa: E402
+
+
+def synthetic_store(name: str, n: int, d: int, rng) -> dict:
+    x = rng.standard_normal((n, d)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(d)
+    index.add(x)
+    mapping = {str(i): {"url": f"{name}/{i}", "content": f"{name} doc {i}"} for i in range(n)}
+    return {"name": name, "index": index, "mapping": mapping}
+
+
+def time_queries(rag, queries, top_k_per_store: int, top_k_total: int) -> float:
+    """Mean ms per query."""
+    t0 = time.perf_counter()
+    for q in queries:
+        rag.search_vector(q, top_k_per_store=top_k_per_store, top_k_total=top_k_total)
+    return (time.perf_counter() - t0) * 1000.0 / len(queries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store-size", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--stores", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--omp-threads", type=int, default=1,
+                        help="FAISS OpenMP threads per search (1 = measure the pool alone)")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.omp_threads)
+    rng = np.random.default_rng(0)
+    all_stores = [synthetic_store(f"s{i}", args.store_size, args.dim, rng) for i in range(max(args.stores))]
+    queries = rng.standard_normal((args.queries, args.dim)).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"store_size={args.store_size} d={args.dim} pool={rag_agent_v2.SEARCH_THREADS} threads")
+    print(f"{'stores':>6} {'sequential ms':>14} {'parallel ms':>12} {'speedup':>8}")
+    for n in args.stores:
+        stores = all_stores[:n]
+        seq = rag_agent_v2.MultiStoreRAG(stores, parallel=False)
+        par = rag_agent_v2.MultiStoreRAG(stores, parallel=True)
+        assert [h["idx"] for h in seq.search_vector(queries[0], 8, 10)] == \
+               [h["idx"] for h in par.search_vector(queries[0], 8, 10)]
+        t_seq = time_queries(seq, queries, 8, 10)
+        t_par = time_queries(par, queries, 8, 10)
+        print(f"{n:>6} {t_seq:>14.2f} {t_par:>12.2f} {t_seq / t_par:>7.2f}x")
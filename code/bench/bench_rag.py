@@ -0,0 +1,206 @@
+# bench_rag.py
+# End-to-end RAG benchmark on the real v2/v3 stores, stage by stage:
+#   embed, index.search (per store), lexical.search, fusion, dedup, context, ollama.chat.ttft,
+#   ollama.chat, guardrails, total
+# The production calls (rag.search_text, _build_context, generate_answer_stream, _check_answer)
+# run inside a metrics.trace(); each stage is read from the spans they record themselves.
+# p50 / p95 / p99 latency per stage + throughput (questions / second)
+#
+# Questions: JSONL ({"question": ...}, or "q" / "text" / "title" keys) or one question per line.
+# --fake starts code/bench/fake_ollama.py in-process (deterministic, no network): numbers then
+# measure the pipeline itself, not Ollama (and fake query vectors make retrieval quality meaningless).
+#
+# Usage:
+#   python code/bench/bench_rag.py --fake --questions code/bench/questions.jsonl --repeat 5
+#   python code/bench/bench_rag.py --questions requests.jsonl --no-generate --out bench_rag.json
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, "..", "app"))
+
+STAGES = ["embed", "ollama.embeddings", "index.search", "lexical.search", "fusion", "dedup", "context",
+          "ollama.chat.ttft", "ollama.chat", "guardrails", "total"]
+
+
+def load_questions(path: str):
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                row = json.loads(line)
+                q = next((row[k] for k in ("question", "q", "text", "title") if row.get(k)), None)
+                if q:
+                    questions.append(q)
+            else:
+                questions.append(line)
+    return questions
+
+
+def percentiles(values_ms) -> dict:
+    a = np.array(values_ms, dtype="float64")
+    if a.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(a.size),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "mean_ms": round(float(a.mean()), 3),
+        "max_ms": round(float(a.max()), 3),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}          # stage -> latencies (ms)
+        self.counts = {}           # name -> values (not latencies: context_chars...)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds * 1000.0)
+
+    def add_trace(self, tr):
+        """Spans of one question, summed per stage (and store)."""
+        per_stage = {}
+        for span in tr.spans:
+            key = f'{span["stage"]}:{span["store"]}' if "store" in span else span["stage"]
+            per_stage[key] = per_stage.get(key, 0.0) + span["ms"] / 1000.0
+        for key, seconds in per_stage.items():
+            self.add(key, seconds)
+
+    def count(self, name: str, value: float):
+        with self._lock:
+            self.counts.setdefault(name, []).append(float(value))
+
+    def mean(self, name: str) -> float:
+        values = self.counts.get(name)
+        return float(np.mean(values)) if values else 0.0
+
+    def report(self) -> dict:
+        def rank(stage):
+            base = stage.split(":", 1)[0]
+            return (STAGES.index(base) if base in STAGES else len(STAGES), stage)
+        return {s: percentiles(self.samples[s]) for s in sorted(self.samples, key=rank)}
+
+
+# ----------------------------------------------------
+# ONE QUESTION, STAGE BY STAGE
+# ----------------------------------------------------
+
+def run_question(rag_mod, rag, question: str, rec: Recorder, top_k: int, top_k_per_store: int,
+                 generate: bool, warm_cache: bool):
+    import metrics
+
+    if not warm_cache:
+        rag_mod.EMBED_CACHE.clear()
+    t_start = time.perf_counter()
+    with metrics.trace("bench") as tr:
+        # same retrieval as the app: embedding (or BM25 only), per-store search, fusion, dedup
+        _, hits = rag.search_text(question, top_k_per_store=top_k_per_store, top_k_total=top_k)
+        context = rag_mod._build_context(hits)
+
+        if generate:
+            tokens = list(rag_mod.generate_answer_stream(context, question, rag_mod.AGENT_ADMISSION))
+            rag_mod._check_answer("".join(tokens), context)
+    rec.add("total", time.perf_counter() - t_start)
+    rec.add_trace(tr)
+    rec.count("context_chars", len(context))
+
+
+def run_bench(questions, repeat: int = 1, concurrency: int = 1, top_k: int = 10, top_k_per_store: int = 8,
+              generate: bool = True, warm_cache: bool = False) -> dict:
+    import metrics
+    import rag_agent_v2
+
+    if not metrics.ENABLED:
+        raise RuntimeError("bench_rag reads the metrics spans: unset ESILV_METRICS=0")
+    t0 = time.perf_counter()
+    rag = rag_agent_v2.get_rag()
+    load_s = time.perf_counter() - t0
+
+    # warm-up (FAISS / HTTP connection setup), not recorded
+    run_question(rag_agent_v2, rag, questions[0], Recorder(), top_k, top_k_per_store, generate, warm_cache)
+
+    rec = Recorder()
+    work = [q for _ in range(repeat) for q in questions]
+    t0 = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+            list(pool.map(lambda q: run_question(rag_agent_v2, rag, q, rec, top_k, top_k_per_store,
+                                                 generate, warm_cache), work))
+    else:
+        for q in work:
+            run_question(rag_agent_v2, rag, q, rec, top_k, top_k_per_store, generate, warm_cache)
+    wall = time.perf_counter() - t0
+
+    return {
+        "questions": len(questions),
+        "requests": len(work),
+        "concurrency": concurrency,
+        "generate": generate,
+        "warm_cache": warm_cache,
+        "stores": {s["name"]: int(s["index"].ntotal) for s in rag.stores},
+        "store_load_s": round(load_s, 3),
+        "wall_s": round(wall, 3),
+        "throughput_qps": round(len(work) / wall, 3) if wall else 0.0,
+        "context_chars_mean": round(rec.mean("context_chars"), 1),
+        "stages": rec.report(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage RAG latency benchmark")
+    parser.add_argument("--questions", default=os.path.join(BENCH_DIR, "questions.jsonl"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--top-k-per-store", type=int, default=8)
+    parser.add_argument("--no-generate", action="store_true", help="retrieval + context only")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the query embedding LRU between questions")
+    parser.add_argument("--fake", action="store_true", help="use an in-process fake Ollama (no network)")
+    parser.add_argument("--fake-embed-ms", type=float, default=0.0)
+    parser.add_argument("--fake-token-ms", type=float, default=0.0)
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+
+    # before importing rag_agent_v2 (the ollama client reads OLLAMA_HOST at import)
+    os.environ.setdefault("ESILV_EMBED_CACHE_DIR", "")
+    os.environ.setdefault("ESILV_LOG_LEVEL", "WARNING")  # no retrieval debug output per question
+    if args.fake:
+        from fake_ollama import start_server
+        server, url = start_server(embed_ms=args.fake_embed_ms, token_ms=args.fake_token_ms)
+        os.environ["OLLAMA_HOST"] = url
+
+    questions = load_questions(args.questions)
+    if not questions:
+        sys.exit(f"No questions in {args.questions}")
+
+    rep = run_bench(questions, repeat=args.repeat, concurrency=args.concurrency, top_k=args.top_k,
+                    top_k_per_store=args.top_k_per_store, generate=not args.no_generate,
+                    warm_cache=args.warm_cache)
+    rep["ollama"] = "fake" if args.fake else os.environ.get("OLLAMA_HOST", "default")
+
+    print(f"{rep['requests']} requests ({rep['questions']} questions), concurrency={rep['concurrency']}, "
+          f"stores={rep['stores']}, load={rep['store_load_s']}s")
+    print(f"{'stage':24s} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for stage, s in rep["stages"].items():
+        print(f"{stage:24s} {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f} {s['mean_ms']:>9.3f}")
+    print(f"throughput: {rep['throughput_qps']} q/s, context: {rep['context_chars_mean']} chars/question")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+        print("Saved:", args.out)
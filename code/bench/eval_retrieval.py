@@ -0,0 +1,227 @@
+# eval_retrieval.py
+# Retrieval quality + speed of each vector store and MultiStoreRAG combo
+# - labelled set: JSONL {"question": ..., "expected_urls": [...]} (default: code/bench/questions.jsonl)
+# - recall@k, MRR, nDCG@k on distinct URLs (a page split in several chunks counts once)
+# - search latency per query (query embeddings computed once, shared cache)
+# - JSON report; --baseline gates a rebuild: exit 1 if quality drops or p95 latency grows
+# - --rerank mmr: same configs with the rerank stage (compare against a report without it)
+# - hybrid BM25 + vector rank fusion (stores' lexical/ indexes) as the app runs it (rag_agent_v2.HYBRID,
+#   ESILV_HYBRID); --hybrid / --no-hybrid force one mode, the baseline must have been made in the same mode
+#
+# Usage:
+#   python code/bench/eval_retrieval.py --out eval_baseline.json
+#   python code/bench/eval_retrieval.py --baseline eval_baseline.json --out eval_new.json
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, "..", "app"))
+
+from bench_rag import percentiles  # noqa: E402
+
+EMB_DIR = os.path.join(BENCH_DIR, "..", "embeddings")
+STORE_DIRS = {
+    "v1_site": os.path.join(EMB_DIR, "vector_store"),
+    "v2_site": os.path.join(EMB_DIR, "vector_store_v2"),
+    "v3_pdf": os.path.join(EMB_DIR, "vector_store_v3"),
+}
+DEFAULT_COMBOS = ["v2_site+v3_pdf"]
+KS = (1, 3, 5, 10)
+
+
+def load_dataset(path: str):
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get("question") and row.get("expected_urls"):
+                rows.append((row["question"], set(row["expected_urls"])))
+    return rows
+
+
+# ----------------------------------------------------
+# METRICS
+# ----------------------------------------------------
+
+def distinct_urls(hits):
+    out = []
+    for h in hits:
+        url = (h["doc"].get("url") or "").strip()
+        if url and url not in out:
+            out.append(url)
+    return out
+
+
+def recall_at_k(ranked, expected: set, k: int) -> float:
+    return len(set(ranked[:k]) & expected) / len(expected)
+
+
+def reciprocal_rank(ranked, expected: set) -> float:
+    for i, url in enumerate(ranked):
+        if url in expected:
+            return 1.0 / (i + 1)
+    return 0.0
+
+
+def ndcg_at_k(ranked, expected: set, k: int) -> float:
+    dcg = sum(1.0 / math.log2(i + 2) for i, url in enumerate(ranked[:k]) if url in expected)
+    idcg = sum(1.0 / math.log2(i + 2) for i in range(min(len(expected), k)))
+    return dcg / idcg if idcg else 0.0
+
+
+# ----------------------------------------------------
+# EVALUATION
+# ----------------------------------------------------
+
+def evaluate_config(rag, Q: np.ndarray, dataset, k: int, rerank: str = "", hybrid: bool = False) -> dict:
+    per_query = {m: [] for m in [f"recall@{x}" for x in KS if x <= k] + ["mrr", f"ndcg@{k}"]}
+    lat = []
+    for q_vec, (question, expected) in zip(Q, dataset):
+        t0 = time.perf_counter()
+        hits = rag.search_vector(q_vec, top_k_per_store=k, top_k_total=k, rerank=rerank,
+                                 query_text=question, hybrid=hybrid)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+
+        ranked = distinct_urls(hits)
+        for x in KS:
+            if x <= k:
+                per_query[f"recall@{x}"].append(recall_at_k(ranked, expected, x))
+        per_query["mrr"].append(reciprocal_rank(ranked, expected))
+        per_query[f"ndcg@{k}"].append(ndcg_at_k(ranked, expected, k))
+
+    out = {m: round(float(np.mean(v)), 4) for m, v in per_query.items()}
+    out["latency"] = percentiles(lat)
+    return out
+
+
+def run_eval(dataset, combos=DEFAULT_COMBOS, store_names=None, k: int = 10, rerank: str = "",
+             hybrid: bool = None) -> dict:
+    """hybrid=None: the mode the app runs in (rag_agent_v2.HYBRID)."""
+    import faiss
+    import rag_agent_v2
+    from lexical_index import open_lexical
+
+    if hybrid is None:
+        hybrid = rag_agent_v2.HYBRID
+
+    store_names = store_names or [n for n, d in STORE_DIRS.items() if os.path.exists(d)]
+    stores = {}
+    for name in store_names:
+        index, mapping = rag_agent_v2.load_store(STORE_DIRS[name])
+        stores[name] = {"name": name, "index": index, "mapping": mapping,
+                        "lexical": open_lexical(STORE_DIRS[name], mapping) if hybrid else None}
+
+    t0 = time.perf_counter()
+    Q = rag_agent_v2.embed_batch([q for q, _ in dataset])
+    embed_s = time.perf_counter() - t0
+
+    configs = [[n] for n in store_names] + [c.split("+") for c in combos]
+    report = {
+        "n_questions": len(dataset),
+        "k": k,
+        "embed_model": rag_agent_v2.EMBED_MODEL,
+        "embed_batch_s": round(embed_s, 3),
+        "rerank": rerank or None,
+        "hybrid": hybrid,
+        "configs": {},
+    }
+    for names in configs:
+        selected = [stores[n] for n in names if n in stores]
+        if len(selected) != len(names):
+            continue
+        metrics = {s["index"].metric_type for s in selected}
+        if len(selected) > 1 and faiss.METRIC_L2 in metrics:
+            # L2 distances and inner products cannot be merged on one score
+            print(f"skip {'+'.join(names)}: mixes L2 and inner-product stores")
+            continue
+        rag = rag_agent_v2.MultiStoreRAG(selected)
+        report["configs"]["+".join(names)] = {
+            "stores": names,
+            "ntotal": int(sum(s["index"].ntotal for s in selected)),
+            **evaluate_config(rag, Q, dataset, k, rerank=rerank, hybrid=hybrid),
+        }
+    return report
+
+
+def gate(report: dict, baseline: dict, max_quality_drop: float = 0.02, max_latency_increase: float = 0.25,
+         min_latency_ms: float = 0.5):
+    """
+    Regressions of report vs baseline, as human-readable strings (empty = pass).
+    Latency: p95 must not grow by more than max_latency_increase (relative)
+    AND min_latency_ms (absolute, sub-millisecond searches are noisy).
+    """
+    failures = []
+    for name, base in baseline.get("configs", {}).items():
+        cur = report["configs"].get(name)
+        if cur is None:
+            failures.append(f"{name}: missing from the new report")
+            continue
+        for m in base:
+            if not (m == "mrr" or m.startswith(("recall@", "ndcg@"))):
+                continue
+            if m in cur and cur[m] < base[m] - max_quality_drop:
+                failures.append(f"{name}: {m} {base[m]:.4f} -> {cur[m]:.4f}")
+        b95, c95 = base["latency"].get("p95_ms"), cur["latency"].get("p95_ms")
+        if b95 is not None and c95 is not None and c95 > b95 * (1 + max_latency_increase) \
+                and c95 - b95 > min_latency_ms:
+            failures.append(f"{name}: p95 latency {b95:.3f}ms -> {c95:.3f}ms")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval quality / latency evaluation + regression gate")
+    parser.add_argument("--dataset", default=os.path.join(BENCH_DIR, "questions.jsonl"))
+    parser.add_argument("--stores", nargs="+", choices=list(STORE_DIRS), default=None)
+    parser.add_argument("--combo", nargs="*", default=DEFAULT_COMBOS, help='e.g. "v2_site+v3_pdf"')
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", choices=["", "mmr", "cross"], default="", help="rerank stage (rerank.py)")
+    parser.add_argument("--hybrid", action=argparse.BooleanOptionalAction, default=None,
+                        help="fuse BM25 and vector rankings (RRF); default: as the app (ESILV_HYBRID)")
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="fail (exit 1) on regressions vs this report")
+    parser.add_argument("--max-quality-drop", type=float, default=0.02)
+    parser.add_argument("--max-latency-increase", type=float, default=0.25)
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset)
+    if not dataset:
+        sys.exit(f"No labelled questions in {args.dataset}")
+
+    rep = run_eval(dataset, combos=args.combo, store_names=args.stores, k=args.k, rerank=args.rerank,
+                   hybrid=args.hybrid)
+    rep["dataset"] = args.dataset
+
+    print(f"{len(dataset)} questions, k={args.k}, hybrid={rep['hybrid']}, embeddings: {rep['embed_batch_s']}s")
+    print(f"{'config':18s} {'R@1':>6} {'R@5':>6} {'R@10':>6} {'MRR':>6} {'nDCG':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, c in rep["configs"].items():
+        print(f"{name:18s} {c.get('recall@1', 0):>6.3f} {c.get('recall@5', 0):>6.3f} {c.get('recall@10', 0):>6.3f} "
+              f"{c['mrr']:>6.3f} {c.get(f'ndcg@{args.k}', 0):>6.3f} "
+              f"{c['latency']['p50_ms']:>8.3f} {c['latency']['p95_ms']:>8.3f}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+        print("Saved:", args.out)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("hybrid", False) != rep["hybrid"]:
+            sys.exit(f"{args.baseline} was made with hybrid={baseline.get('hybrid', False)}, "
+                     f"this run has hybrid={rep['hybrid']}: rerun with --{'' if baseline.get('hybrid') else 'no-'}hybrid")
+        failures = gate(rep, baseline, args.max_quality_drop, args.max_latency_increase)
+        if failures:
+            print("REGRESSIONS:")
+            for msg in failures:
+                print("  -", msg)
+            sys.exit(1)
+        print("No regression vs", args.baseline)
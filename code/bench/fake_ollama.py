@@ -0,0 +1,221 @@
+# fake_ollama.py
+# Deterministic stand-in for the Ollama HTTP API (benchmarks / CI, no network, no GPU)
+# - POST /api/embeddings, /api/embed: hashed bag-of-words vectors (same text => same vector,
+#   shared words => similar vectors), L2-normalized, EMBED_DIM dims
+# - POST /api/chat: extractive answer citing the first URL of the CONTEXTE, streamed as NDJSON
+# - GET /, /api/version, /api/tags: enough for the ollama python client
+# - optional simulated latencies (embedding call, prompt processing, per token)
+#
+# Usage:
+#   python code/bench/fake_ollama.py --port 11435 --token-ms 5
+#   OLLAMA_HOST=http://127.0.0.1:11435 streamlit run code/app/streamlit_app.py
+# In-process: server, url = start_server(port=0)
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBED_DIM = 1024
+MODELS = ["mxbai-embed-large", "llama3.2:3b"]
+
+URL_RE = re.compile(r"(https?://[^\s)\]]+|pdf://[^\s)\]]+)")
+WORD_RE = re.compile(r"\w+")
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=200_000)
+def _token_vector(token: str, dim: int) -> np.ndarray:
+    seed = int(hashlib.sha1(token.encode("utf-8")).hexdigest()[:16], 16)
+    return np.random.default_rng(seed).standard_normal(dim).astype("float32")
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> list:
+    tokens = WORD_RE.findall(_fold(text or ""))
+    v = np.zeros(dim, dtype="float32")
+    for t in tokens:
+        v += _token_vector(t, dim)
+    if not tokens:
+        v = _token_vector("<empty>", dim).copy()
+    v /= (np.linalg.norm(v) + 1e-12)
+    return v.tolist()
+
+
+def fake_answer(messages) -> str:
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    context = user.split("QUESTION:", 1)[0]
+    urls = URL_RE.findall(context)
+    if not urls:
+        return "Je n'ai pas cette information dans les documents ESILV."
+    first = context.split("\n- ", 2)
+    snippet = first[1] if len(first) > 1 else context
+    snippet = re.sub(r"^\[[^\]]*\]\s*", "", snippet)
+    snippet = " ".join(snippet.split()[:40])
+    return f"D'après les documents ESILV : {snippet} (source: {urls[0]})"
+
+
+# ----------------------------------------------------
+# HTTP HANDLER
+# ----------------------------------------------------
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "fake-ollama/1.0"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, obj, status: int = 200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def do_GET(self):
+        if self.path in ("/", ""):
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "model": m} for m in MODELS]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        try:
+            req = self._read_json()
+        except ValueError:
+            return self._send_json({"error": "invalid JSON"}, 400)
+
+        cfg = self.server
+        with cfg.lock:
+            cfg.calls[self.path] = cfg.calls.get(self.path, 0) + 1
+
+        if self.path == "/api/embeddings":
+            time.sleep(cfg.embed_ms / 1000.0)
+            return self._send_json({"embedding": fake_embedding(req.get("prompt", ""), cfg.dim)})
+
+        if self.path == "/api/embed":
+            inputs = req.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+            time.sleep(cfg.embed_ms / 1000.0)
+            return self._send_json({
+                "model": req.get("model"),
+                "embeddings": [fake_embedding(t, cfg.dim) for t in inputs],
+            })
+
+        if self.path == "/api/chat":
+            return self._chat(req)
+
+        self._send_json({"error": "not found"}, 404)
+
+    def _chat(self, req: dict):
+        cfg = self.server
+        messages = req.get("messages") or []
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        time.sleep(cfg.prefill_ms_per_kchar * prompt_chars / 1000.0 / 1000.0)
+
+        answer = fake_answer(messages)
+        final = {
+            "model": req.get("model"),
+            "created_at": "1970-01-01T00:00:00Z",
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_chars // 4,
+        }
+
+        if not req.get("stream", True):
+            time.sleep(cfg.token_ms * len(answer.split()) / 1000.0)
+            return self._send_json({**final, "message": {"role": "assistant", "content": answer},
+                                    "eval_count": len(answer.split())})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(obj):
+            data = (json.dumps(obj) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        words = answer.split(" ")
+        for i, w in enumerate(words):
+            time.sleep(cfg.token_ms / 1000.0)
+            token = w if i == 0 else " " + w
+            chunk({"model": req.get("model"), "created_at": final["created_at"],
+                   "message": {"role": "assistant", "content": token}, "done": False})
+        chunk({**final, "message": {"role": "assistant", "content": ""}, "eval_count": len(words)})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, dim: int = EMBED_DIM, embed_ms: float = 0.0, token_ms: float = 0.0,
+                 prefill_ms_per_kchar: float = 0.0, verbose: bool = False):
+        """
+        embed_ms: latency of one embedding request
+        token_ms: latency per generated token (word)
+        prefill_ms_per_kchar: prompt processing latency per 1000 prompt characters
+        """
+        super().__init__(addr, FakeOllamaHandler)
+        self.dim = dim
+        self.embed_ms = embed_ms
+        self.token_ms = token_ms
+        self.prefill_ms_per_kchar = prefill_ms_per_kchar
+        self.verbose = verbose
+        self.calls = {}
+        self.lock = threading.Lock()
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **kwargs):
+    """Serve in a daemon thread. Returns (server, base_url); port=0 picks a free port."""
+    server = FakeOllamaServer((host, port), **kwargs)
+    t = threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True)
+    t.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=EMBED_DIM)
+    parser.add_argument("--embed-ms", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    parser.add_argument("--prefill-ms-per-kchar", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer((args.host, args.port), dim=args.dim, embed_ms=args.embed_ms,
+                              token_ms=args.token_ms, prefill_ms_per_kchar=args.prefill_ms_per_kchar,
+                              verbose=args.verbose)
+    print(f"fake Ollama on http://{args.host}:{server.server_address[1]} (OLLAMA_HOST)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
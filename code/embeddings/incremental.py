@@ -0,0 +1,240 @@
+# incremental.py
+# Incremental, content-hashed re-indexing of a vector store
+# - every chunk is keyed by stable_id(embedding input) (same sha1 scheme as cleaning_pdf.ipynb)
+# - only new / changed chunks are embedded
+# - vectors of deleted chunks are removed from an ID-mapped index (IndexIDMap2)
+# - identical chunks are stored once (no more query-time duplicates)
+# - manifest.json: chunk key -> vector id, model, counters
+#
+# Usage:
+#   python code/embeddings/incremental.py v3 --input data/scraping_esilv/full_pdfs_improved.json --out code/embeddings/vector_store_v3
+#   python code/embeddings/incremental.py v2 --input data/chunks_esilv --out code/embeddings/vector_store_v2
+# An existing store without manifest is adopted (its vectors are reused, duplicates dropped).
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from indexing import (
+    DEFAULT_CACHE_DIR, DOCSTORE_DIRNAME, EMBED_MODEL, LEXICAL_DIRNAME, ROUTER_DIRNAME, BatchEmbedder, embed_full_texts,
+    index_vectors, store_rubrics, v2_chunks, v3_chunks, write_docstore, write_lexical, write_router,
+)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def stable_id(*parts: str) -> str:
+    h = hashlib.sha1("||".join(parts).encode("utf-8")).hexdigest()
+    return h[:16]
+
+
+# Embedding input of an existing mapping entry (to adopt stores built before manifests)
+def v2_key_text(meta: dict) -> str:
+    return f"TITLE: {meta.get('title', '')}\nRUBRIC: {meta.get('rubric', '')}\nCONTENT:\n{meta.get('content', '')}"
+
+
+def v3_key_text(meta: dict) -> str:
+    return meta.get("content", "")
+
+
+# ----------------------------------------------------
+# MANIFEST / STORE IO
+# ----------------------------------------------------
+
+def _write_json_atomic(path: str, obj, indent=2):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp, path)
+
+
+def load_manifest(out_dir: str):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {path}")
+    return manifest
+
+
+def adopt_store(out_dir: str, key_text, model: str):
+    """
+    Wrap an existing store (plain IndexFlatIP + mapping.json, no manifest)
+    into an IndexIDMap2 + manifest, without embedding anything.
+    Ids stay the mapping positions; duplicated chunks keep their first id.
+    """
+    index = faiss.read_index(os.path.join(out_dir, "faiss_index.bin"))
+    with open(os.path.join(out_dir, "mapping.json"), "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+
+    vecs = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype="float32")
+    idmap = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+
+    chunks, keep_ids, kept_mapping = {}, [], {}
+    for i in range(index.ntotal):
+        meta = mapping.get(str(i))
+        if meta is None:
+            continue
+        key = stable_id(key_text(meta))
+        if key in chunks:
+            continue
+        chunks[key] = i
+        keep_ids.append(i)
+        kept_mapping[str(i)] = meta
+
+    if keep_ids:
+        ids = np.array(keep_ids, dtype=np.int64)
+        idmap.add_with_ids(vecs[ids], ids)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "model": model,
+        "dim": int(index.d),
+        "next_id": int(index.ntotal),
+        "chunks": chunks,
+    }
+    return idmap, kept_mapping, manifest
+
+
+def open_store(out_dir: str, key_text, model: str, dim: int = None):
+    manifest = load_manifest(out_dir)
+    index_path = os.path.join(out_dir, "faiss_index.bin")
+    map_path = os.path.join(out_dir, "mapping.json")
+
+    if manifest is not None:
+        if manifest.get("model") != model:
+            raise ValueError(f"{out_dir} was built with {manifest.get('model')!r}, not {model!r}: rebuild it")
+        index = faiss.read_index(index_path)
+        with open(map_path, "r", encoding="utf-8") as f:
+            mapping = json.load(f)
+        return index, mapping, manifest
+
+    if os.path.exists(index_path) and os.path.exists(map_path):
+        return adopt_store(out_dir, key_text, model)
+
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim or 1024))
+    manifest = {"version": MANIFEST_VERSION, "model": model, "dim": dim or 1024, "next_id": 0, "chunks": {}}
+    return index, {}, manifest
+
+
+def save_store(out_dir: str, index, mapping: dict, manifest: dict):
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_index = os.path.join(out_dir, "faiss_index.bin.tmp")
+    faiss.write_index(index, tmp_index)
+    os.replace(tmp_index, os.path.join(out_dir, "faiss_index.bin"))
+
+    map_path = os.path.join(out_dir, "mapping.json")
+    ordered = {k: mapping[k] for k in sorted(mapping, key=int)}
+    _write_json_atomic(map_path, ordered)
+    write_docstore(ordered, os.path.join(out_dir, DOCSTORE_DIRNAME), source_path=map_path)
+    write_lexical(ordered, os.path.join(out_dir, LEXICAL_DIRNAME), source_path=map_path)
+    ids, vectors = index_vectors(index)
+    write_router(vectors, store_rubrics(ordered, ids), os.path.join(out_dir, ROUTER_DIRNAME), source_path=map_path)
+    _write_json_atomic(os.path.join(out_dir, MANIFEST_NAME), manifest)
+
+
+# ----------------------------------------------------
+# INCREMENTAL UPDATE
+# ----------------------------------------------------
+
+def incremental_update(out_dir: str, chunks, embed_fn, key_text, model: str = EMBED_MODEL) -> dict:
+    """
+    chunks: iterable of (embedding input, meta) describing the *whole* current corpus
+    embed_fn: list of texts -> [n, d] normalized float32 (called once, new chunks only)
+    key_text: meta -> embedding input (only used to adopt a store without manifest)
+    """
+    t0 = time.perf_counter()
+    index, mapping, manifest = open_store(out_dir, key_text, model)
+    known = manifest["chunks"]
+
+    current = {}
+    duplicates = 0
+    for text, meta in chunks:
+        key = stable_id(text)
+        if key in current:
+            duplicates += 1
+            continue
+        current[key] = (text, meta)
+
+    new_keys = [k for k in current if k not in known]
+    deleted_keys = [k for k in known if k not in current]
+
+    # 1) remove vectors of deleted / changed chunks
+    if deleted_keys:
+        del_ids = np.array([known[k] for k in deleted_keys], dtype=np.int64)
+        index.remove_ids(faiss.IDSelectorBatch(del_ids))
+        for k in deleted_keys:
+            mapping.pop(str(known.pop(k)), None)
+
+    # 2) embed + add new chunks only
+    if new_keys:
+        vectors = np.ascontiguousarray(embed_fn([current[k][0] for k in new_keys]), dtype="float32")
+        start = manifest["next_id"]
+        ids = np.arange(start, start + len(new_keys), dtype=np.int64)
+        index.add_with_ids(vectors, ids)
+        for k, i in zip(new_keys, ids.tolist()):
+            known[k] = i
+        manifest["next_id"] = int(start + len(new_keys))
+
+    # 3) metadata refresh (title, url, ... may change without the embedded text changing)
+    for k, (_, meta) in current.items():
+        mapping[str(known[k])] = meta
+
+    elapsed = time.perf_counter() - t0
+    manifest["updated_at"] = datetime.datetime.utcnow().isoformat()
+    manifest["last_update"] = {
+        "added": len(new_keys),
+        "removed": len(deleted_keys),
+        "unchanged": len(current) - len(new_keys),
+        "duplicates_skipped": duplicates,
+        "ntotal": int(index.ntotal),
+        "seconds": round(elapsed, 3),
+    }
+    save_store(out_dir, index, mapping, manifest)
+    return dict(manifest["last_update"])
+
+
+def update_v3_store(pdf_json_path: str, out_dir: str, embedder: BatchEmbedder) -> dict:
+    with open(pdf_json_path, "r", encoding="utf-8") as f:
+        pdf_root = json.load(f)
+    report = incremental_update(out_dir, v3_chunks(pdf_root), embedder.embed, v3_key_text, model=embedder.model)
+    return {**report, "embed": embedder.stats()}
+
+
+def update_v2_store(chunks_dir: str, out_dir: str, embedder: BatchEmbedder) -> dict:
+    report = incremental_update(out_dir, v2_chunks(chunks_dir), lambda texts: embed_full_texts(embedder, texts),
+                                v2_key_text, model=embedder.model)
+    return {**report, "embed": embedder.stats()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental (content-hashed) vector store update")
+    parser.add_argument("store", choices=["v2", "v3"])
+    parser.add_argument("--input", required=True, help="v2: chunks dir / v3: full_pdfs_improved.json")
+    parser.add_argument("--out", required=True, help="vector store directory")
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="shared embedding cache ('' = disabled)")
+    args = parser.parse_args()
+
+    embedder = BatchEmbedder(model=args.model, host=args.host, batch_size=args.batch_size, max_workers=args.workers,
+                             cache_dir=args.cache_dir or None)
+    if args.store == "v3":
+        report = update_v3_store(args.input, args.out, embedder)
+    else:
+        report = update_v2_store(args.input, args.out, embedder)
+
+    print(f"{args.out}: +{report['added']} -{report['removed']} ={report['unchanged']} "
+          f"(duplicates skipped: {report['duplicates_skipped']}), ntotal={report['ntotal']}, {report['seconds']}s")
+    print("embedding:", report["embed"])
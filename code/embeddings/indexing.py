@@ -0,0 +1,357 @@
+# indexing.py
+# Batched, concurrent embedding pipeline for building the vector stores
+# (replaces the one-call-per-chunk loops of embed_esilv_v2 / embed_esilv_v3)
+# - texts sent to Ollama in batches (client.embed with list input)
+# - bounded pool of concurrent requests, retries on transient failures
+# - vectors added to FAISS in bulk (contiguous float32)
+# - throughput report (chunks / second)
+# - shared on-disk embedding cache (embed_cache.VectorFileStore, also used by the app):
+#   unchanged chunks are never re-embedded across runs / notebooks
+# - BM25 postings (lexical_index.py) written next to the FAISS index for hybrid search
+# - per-agent prototypes (agent_router.py) written next to it for agent routing
+#
+# Usage:
+#   python code/embeddings/indexing.py v3 --input data/scraping_esilv/full_pdfs_improved.json --out code/embeddings/vector_store_v3
+#   python code/embeddings/indexing.py v2 --input data/chunks_esilv --out code/embeddings/vector_store_v2
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from ollama import Client
+
+try:
+    import httpx
+    _TRANSPORT_ERRORS = (httpx.TransportError,)
+except ImportError:  # httpx ships with ollama, but stay importable without it
+    _TRANSPORT_ERRORS = ()
+
+# docstore.py / embed_cache.py live with the app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from docstore import DOCSTORE_DIRNAME, write_docstore  # noqa: E402
+from embed_cache import DEFAULT_CACHE_DIR, VectorFileStore, text_key  # noqa: E402
+from lexical_index import LEXICAL_DIRNAME, write_lexical  # noqa: E402
+from agent_router import ROUTER_DIRNAME, store_rubrics, write_router  # noqa: E402
+from ann_index import index_vectors  # noqa: E402
+
+EMBED_MODEL = "mxbai-embed-large"
+EMBED_DIM = 1024
+
+# v3 (PDF) chunking, same as embed_esilv_v3.ipynb
+MAX_CHARS = 1100
+MIN_CHARS = 200
+
+# v2 (site) parts, same as embed_esilv_v2.ipynb
+MAX_CHARS_PER_PART = 1200
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def normalize_rows(m: np.ndarray) -> np.ndarray:
+    m = np.ascontiguousarray(m, dtype="float32")
+    m /= (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+    return m
+
+
+def is_transient(e: Exception) -> bool:
+    if isinstance(e, (ConnectionError, TimeoutError) + _TRANSPORT_ERRORS):
+        return True
+    return getattr(e, "status_code", None) in RETRY_STATUS
+
+
+# ----------------------------------------------------
+# BATCHED EMBEDDER
+# ----------------------------------------------------
+
+class BatchEmbedder:
+    def __init__(self, model: str = EMBED_MODEL, host: str = None, batch_size: int = 32,
+                 max_workers: int = 4, max_retries: int = 4, backoff: float = 0.5,
+                 cache_dir: str = DEFAULT_CACHE_DIR):
+        """
+        batch_size: texts per Ollama request
+        max_workers: concurrent requests (keep it small: one local Ollama)
+        max_retries / backoff: retries on transient errors, exponential backoff (seconds)
+        cache_dir: shared embedding cache (None = always call Ollama)
+        """
+        self.model = model
+        self.client = Client(host=host) if host else Client()
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = VectorFileStore(cache_dir) if cache_dir else None
+
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.texts_embedded = 0
+        self.requests = 0
+        self.retries = 0
+        self.seconds = 0.0
+
+    def _call(self, batch):
+        # Ollama python client recent versions: client.embed (list input);
+        # older ones only have client.embeddings (one prompt per call)
+        if hasattr(self.client, "embed"):
+            resp = self.client.embed(model=self.model, input=batch)
+            emb = resp["embeddings"] if isinstance(resp, dict) else resp.embeddings
+            return np.array(emb, dtype="float32")
+        rows = []
+        for text in batch:
+            resp = self.client.embeddings(model=self.model, prompt=text)
+            rows.append(resp["embedding"] if isinstance(resp, dict) else resp.embedding)
+        return np.array(rows, dtype="float32")
+
+    def _embed_batch(self, batch):
+        attempt = 0
+        while True:
+            try:
+                m = self._call(batch)
+                with self._lock:
+                    self.requests += 1
+                return m
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+
+    def _embed_uncached(self, texts) -> np.ndarray:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embed") as pool:
+            parts = list(pool.map(self._embed_batch, batches))
+        return normalize_rows(np.vstack(parts))
+
+    def embed(self, texts) -> np.ndarray:
+        """[n, d] L2-normalized float32 embeddings, in input order."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, EMBED_DIM), dtype="float32")
+
+        t0 = time.perf_counter()
+        cached = self.cache.get_many(self.model, texts) if self.cache is not None else [None] * len(texts)
+
+        # misses only, each distinct text (same cache key) once
+        todo = {}
+        for i, v in enumerate(cached):
+            if v is None:
+                todo.setdefault(text_key(texts[i]), []).append(i)
+        if todo:
+            firsts = [texts[ids[0]] for ids in todo.values()]
+            new = self._embed_uncached(firsts)
+            if self.cache is not None:
+                self.cache.put_many(self.model, firsts, new)
+            for row, ids in zip(new, todo.values()):
+                for i in ids:
+                    cached[i] = row
+        elapsed = time.perf_counter() - t0
+
+        with self._lock:
+            self.cache_hits += len(texts) - sum(len(ids) for ids in todo.values())
+            self.texts_embedded += len(texts)
+            self.seconds += elapsed
+        return np.ascontiguousarray(np.vstack(cached), dtype="float32")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "texts": self.texts_embedded,
+                "cache_hits": self.cache_hits,
+                "requests": self.requests,
+                "retries": self.retries,
+                "seconds": round(self.seconds, 3),
+                "chunks_per_s": round(self.texts_embedded / self.seconds, 2) if self.seconds else 0.0,
+            }
+
+
+# ----------------------------------------------------
+# CHUNKING (same rules as the notebooks)
+# ----------------------------------------------------
+
+def smart_split(text: str, max_chars: int = MAX_CHARS):
+    text = re.sub(r"\s+", " ", text).strip()
+    if len(text) <= max_chars:
+        return [text]
+
+    parts = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        # try split on sentence boundary
+        cut = text.rfind(". ", start, end)
+        if cut == -1 or cut < start + MIN_CHARS:
+            cut = text.rfind(" ", start, end)
+        if cut == -1 or cut < start + MIN_CHARS:
+            cut = end
+        part = text[start:cut].strip()
+        if part:
+            parts.append(part)
+        start = cut + 1
+    return parts
+
+
+def split_text(text: str, max_chars: int):
+    text = (text or "").strip()
+    if not text:
+        return []
+    return [text[i:i+max_chars] for i in range(0, len(text), max_chars)]
+
+
+def v3_chunks(pdf_root: dict):
+    """(embed_input, meta) for every part of every page of full_pdfs_improved.json."""
+    documents = pdf_root.get("documents", [])
+    rubric = pdf_root.get("rubric", "pdf")
+
+    for doc in documents:
+        pdf_name = doc.get("pdf_name", "")
+        pdf_id = doc.get("id_pdf", doc.get("pdf_id", ""))
+
+        for p in doc.get("pages", []):
+            page_num = p.get("page")
+            text = p.get("text_norm_wo_footer") or p.get("text_norm") or p.get("text_raw") or ""
+            if not text.strip():
+                continue
+
+            header = f"SOURCE: pdf\nPDF_NAME: {pdf_name}\nPDF_ID: {pdf_id}\nPAGE: {page_num}\nRUBRIC: {rubric}\nTEXT:\n"
+            parts = smart_split(header + text, MAX_CHARS)
+
+            for part_i, part in enumerate(parts):
+                yield part, {
+                    "title": f"{pdf_name} - page {page_num} - part {part_i+1}/{len(parts)}",
+                    "content": part,  # keep what was embedded (important for debugging)
+                    "rubric": rubric,
+                    "url": f"pdf://{pdf_id}#page={page_num}",
+                    "source_file": pdf_id,
+                    "pdf_name": pdf_name,
+                    "page": page_num,
+                    "part_index": part_i,
+                    "parts_count": len(parts),
+                    "embedding_input_chars": len(part),
+                }
+
+
+def v2_chunks(chunks_dir: str):
+    """(embed_input, meta) for every chunk of data/chunks_esilv/*.json."""
+    for fn in sorted(os.listdir(chunks_dir)):
+        if not fn.endswith(".json"):
+            continue
+
+        with open(os.path.join(chunks_dir, fn), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+
+        for chunk in chunks:
+            content = (chunk.get("content") or "").strip()
+            if not content:
+                continue
+
+            title = (chunk.get("title") or "").strip()
+            rubric = (chunk.get("rubric") or "").strip()
+            embed_input = f"TITLE: {title}\nRUBRIC: {rubric}\nCONTENT:\n{content}"
+
+            yield embed_input, {
+                "title": title,
+                "content": content,  # on conserve TOUT
+                "rubric": rubric,
+                "url": chunk.get("url"),
+                "source_file": fn,
+                "embedding_input_chars": len(embed_input),
+                "parts_count": int(np.ceil(len(embed_input) / MAX_CHARS_PER_PART)),
+                "max_chars_per_part": MAX_CHARS_PER_PART,
+            }
+
+
+def embed_full_texts(embedder: BatchEmbedder, texts) -> np.ndarray:
+    """
+    v2 "zero loss" embedding: every text is split in MAX_CHARS_PER_PART parts,
+    all parts are embedded in one batched pass, then averaged per text.
+    """
+    parts, owner = [], []
+    for i, text in enumerate(texts):
+        for p in split_text(text, MAX_CHARS_PER_PART):
+            parts.append(p)
+            owner.append(i)
+    if not parts:
+        return np.zeros((0, EMBED_DIM), dtype="float32")
+
+    part_vecs = embedder.embed(parts)
+    owner = np.array(owner)
+    sums = np.zeros((len(texts), part_vecs.shape[1]), dtype="float32")
+    np.add.at(sums, owner, part_vecs)
+    counts = np.bincount(owner, minlength=len(texts)).astype("float32")
+    return normalize_rows(sums / np.maximum(counts, 1.0)[:, None])
+
+
+# ----------------------------------------------------
+# STORE WRITER
+# ----------------------------------------------------
+
+def write_store(out_dir: str, vectors: np.ndarray, metas) -> faiss.Index:
+    """IndexFlatIP + mapping.json + docstore/ + lexical/ (BM25) + router/, vectors added in one bulk call."""
+    os.makedirs(out_dir, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+
+    index = faiss.IndexFlatIP(vectors.shape[1] if vectors.size else EMBED_DIM)
+    if vectors.shape[0]:
+        index.add(vectors)
+    mapping = {str(i): meta for i, meta in enumerate(metas)}
+
+    map_path = os.path.join(out_dir, "mapping.json")
+    faiss.write_index(index, os.path.join(out_dir, "faiss_index.bin"))
+    with open(map_path, "w", encoding="utf-8") as f:
+        json.dump(mapping, f, ensure_ascii=False, indent=2)
+    write_docstore(mapping, os.path.join(out_dir, DOCSTORE_DIRNAME), source_path=map_path)
+    write_lexical(mapping, os.path.join(out_dir, LEXICAL_DIRNAME), source_path=map_path)
+    write_router(vectors, [meta.get("rubric") for meta in metas], os.path.join(out_dir, ROUTER_DIRNAME),
+                 source_path=map_path)
+    return index
+
+
+def build_v3_store(pdf_json_path: str, out_dir: str, embedder: BatchEmbedder) -> dict:
+    with open(pdf_json_path, "r", encoding="utf-8") as f:
+        pdf_root = json.load(f)
+    texts, metas = zip(*v3_chunks(pdf_root)) if pdf_root.get("documents") else ((), ())
+    vectors = embedder.embed(texts)
+    index = write_store(out_dir, vectors, metas)
+    return {"out_dir": out_dir, "ntotal": int(index.ntotal), **embedder.stats()}
+
+
+def build_v2_store(chunks_dir: str, out_dir: str, embedder: BatchEmbedder) -> dict:
+    pairs = list(v2_chunks(chunks_dir))
+    texts = [t for t, _ in pairs]
+    metas = [m for _, m in pairs]
+    vectors = embed_full_texts(embedder, texts)
+    index = write_store(out_dir, vectors, metas)
+    return {"out_dir": out_dir, "ntotal": int(index.ntotal), **embedder.stats()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a vector store with batched Ollama embeddings")
+    parser.add_argument("store", choices=["v2", "v3"])
+    parser.add_argument("--input", required=True, help="v2: chunks dir / v3: full_pdfs_improved.json")
+    parser.add_argument("--out", required=True, help="vector store directory")
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--host", default=None, help="Ollama host (default: OLLAMA_HOST or localhost)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="shared embedding cache ('' = disabled)")
+    args = parser.parse_args()
+
+    embedder = BatchEmbedder(model=args.model, host=args.host, batch_size=args.batch_size,
+                             max_workers=args.workers, max_retries=args.retries, cache_dir=args.cache_dir or None)
+    if args.store == "v3":
+        report = build_v3_store(args.input, args.out, embedder)
+    else:
+        report = build_v2_store(args.input, args.out, embedder)
+
+    print(f"Saved {report['ntotal']} vectors -> {report['out_dir']}")
+    print(f"{report['texts']} texts in {report['seconds']}s ({report['chunks_per_s']} chunks/s), "
+          f"{report['requests']} requests, {report['retries']} retries, {report['cache_hits']} cache hits")
@@ -0,0 +1,313 @@
+# pdf_extract.py
+# Parallel, cached PDF extraction stage (replaces the pdfplumber cells of Scraping_PDF.ipynb
+# + improve_pdf_json() of cleaning_pdf.ipynb)
+# - pages of every PDF extracted with pdfplumber on a process pool; long PDFs are split in
+#   page ranges so one brochure does not keep a single worker busy
+# - cache per PDF content (sha1 of the bytes): <cache>/<sha1>.json holds the page texts,
+#   unchanged PDFs are never re-parsed (renamed / moved files included)
+# - output: the page-level schema of full_pdfs_improved.json read by embed_esilv_v3.ipynb and
+#   indexing.py v3 (documents[].pages[].text_raw / text_norm / text_norm_wo_footer /
+#   footer_candidates / stats_*), streamed to disk document by document
+# - per-document timing (extraction seconds, wall_s since the run started, pages, cached) in
+#   documents[].extract and on stdout; cached documents keep the timing of the run that
+#   extracted them, the summary's extract_s only counts this run's work
+#
+# Usage:
+#   python code/scraping/pdf_extract.py pdfs/entreprises --rubric entreprises --out data/scraping_esilv/full_pdfs_improved.json
+#   python code/scraping/pdf_extract.py pdfs/entreprises --names pdf_names.json --workers 8
+# (--names: optional {"download_10873.pdf": "diplome ingénieur esilv", ...}, default: file stem)
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import pdfplumber
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BASE_PATH, "cache", "pdf_pages")
+
+EXTRACT_VERSION = 1        # bump when the page text extraction changes (invalidates the cache)
+PAGES_PER_TASK = int(os.environ.get("ESILV_PDF_PAGES_PER_TASK", "8"))
+
+
+# ----------------------------------------------------
+# TEXT CLEANING (same as Scraping_PDF.ipynb / cleaning_pdf.ipynb)
+# ----------------------------------------------------
+
+FOOTER_RE = re.compile(r"(I\s*DE\s*VINCI\s*ENGINEERING\s*SCHOOL\s*ESILV\s*\d+)", re.IGNORECASE)
+
+
+def clean_text(text: str) -> str:
+    text = re.sub(r"\s+", " ", text)   # espaces multiples
+    text = text.replace("•", "-")      # puces
+    return text.strip()
+
+
+def normalize_spaces(s: str) -> str:
+    s = s.replace("\u00a0", " ")  # NBSP
+    s = re.sub(r"[ \t]+", " ", s)
+    s = re.sub(r"\s*\n\s*", "\n", s)
+    s = re.sub(r"\n{3,}", "\n\n", s)
+    return s.strip()
+
+
+def extract_footer_candidates(text: str) -> Tuple[str, List[str]]:
+    """(text without the detected footers, footers); the raw text is kept as is."""
+    footers = FOOTER_RE.findall(text)
+    text_wo = text
+    for f in set(footers):
+        text_wo = re.sub(re.escape(f), " ", text_wo, flags=re.IGNORECASE)
+    return normalize_spaces(text_wo), sorted(set(footers))
+
+
+def basic_stats(s: str) -> Dict[str, int]:
+    words = re.findall(r"\b\w+\b", s, flags=re.UNICODE)
+    return {
+        "chars": len(s),
+        "words": len(words),
+        "lines": s.count("\n") + (1 if s else 0),
+    }
+
+
+def enrich_page(page: int, raw: str) -> dict:
+    """Page entry of full_pdfs_improved.json (improve_pdf_json)."""
+    raw_norm = normalize_spaces(raw)
+    wo_footer_norm, footer_hits = extract_footer_candidates(raw_norm)
+    return {
+        "page": page,
+        "text_raw": raw,
+        "text_norm": raw_norm,
+        "text_norm_wo_footer": wo_footer_norm,
+        "footer_candidates": footer_hits,
+        "stats_raw": basic_stats(raw),
+        "stats_norm": basic_stats(raw_norm),
+    }
+
+
+# ----------------------------------------------------
+# WORKERS (process pool)
+# ----------------------------------------------------
+
+def _page_count(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_pages(path: str, start: int, end: int):
+    """(pages [(page number, cleaned text)], seconds) for pages start..end-1 (0-based)."""
+    t0 = time.perf_counter()
+    pages = []
+    with pdfplumber.open(path) as pdf:
+        for i in range(start, end):
+            raw = pdf.pages[i].extract_text()
+            if raw:
+                pages.append((i + 1, clean_text(raw)))
+    return pages, time.perf_counter() - t0
+
+
+# ----------------------------------------------------
+# CACHE (per PDF content)
+# ----------------------------------------------------
+
+def file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PageCache:
+    """<cache_dir>/<sha1>.json: page texts of one PDF content."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, sha1: str) -> str:
+        return os.path.join(self.cache_dir, f"{sha1}.json")
+
+    def get(self, sha1: str):
+        """(pages, timing of the extraction that filled the entry), or None."""
+        try:
+            with open(self._path(sha1), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("extract_version") != EXTRACT_VERSION:
+            return None
+        timing = {"seconds": entry.get("seconds", 0.0), "wall_s": entry.get("wall_s")}
+        return [(p["page"], p["text"]) for p in entry["pages"]], timing
+
+    def put(self, sha1: str, pages, n_pages: int, seconds: float, wall_s: float = None):
+        entry = {
+            "extract_version": EXTRACT_VERSION,
+            "n_pages": n_pages,
+            "seconds": round(seconds, 4),
+            "wall_s": None if wall_s is None else round(wall_s, 4),
+            "pages": [{"page": p, "text": t} for p, t in pages],
+        }
+        tmp = self._path(sha1) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, self._path(sha1))
+
+
+# ----------------------------------------------------
+# EXTRACTION
+# ----------------------------------------------------
+
+def list_pdfs(pdf_dirs) -> List[str]:
+    paths = []
+    for d in pdf_dirs:
+        for fn in sorted(os.listdir(d)):
+            if fn.lower().endswith(".pdf"):
+                paths.append(os.path.join(d, fn))
+    return paths
+
+
+def iter_extracted(paths, cache: PageCache, workers: int = None, pages_per_task: int = PAGES_PER_TASK):
+    """
+    Yields (path, sha1, pages [(page, text)], timing) in the order of paths,
+    each document as soon as it and the ones before it are done.
+    """
+    t_start = time.perf_counter()
+    hashes = [file_sha1(p) for p in paths]
+    done = {}
+    todo = {}                               # sha1 -> first path with that content
+    for path, sha1 in zip(paths, hashes):
+        entry = cache.get(sha1)
+        if entry is not None:
+            pages, timing = entry
+            done[sha1] = (pages, {**timing, "cached": True})
+        elif sha1 not in todo:
+            todo[sha1] = path
+
+    next_i = 0
+
+    def ready():
+        nonlocal next_i
+        while next_i < len(paths) and hashes[next_i] in done:
+            pages, timing = done[hashes[next_i]]
+            yield paths[next_i], hashes[next_i], pages, timing
+            next_i += 1
+
+    yield from ready()
+    if not todo:
+        return
+
+    def finish(sha1, pages, timing):
+        done[sha1] = (pages, timing)
+        for state in (pending, parts, busy):
+            state.pop(sha1, None)
+        return ready()
+
+    pending, parts, busy = {}, {}, {}      # per PDF being extracted: ranges left, pages, seconds
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = {pool.submit(_page_count, path): sha1 for sha1, path in todo.items()}
+        ranges, n_pages = {}, {}
+        for fut in as_completed(counts):
+            sha1 = counts[fut]
+            try:
+                n_pages[sha1] = fut.result()
+            except Exception as e:  # unreadable PDF: empty document, not cached
+                yield from finish(sha1, [], {"seconds": 0.0, "cached": False, "error": repr(e)})
+                continue
+            starts = list(range(0, n_pages[sha1], pages_per_task)) or [0]
+            pending[sha1], parts[sha1], busy[sha1] = len(starts), [], 0.0
+            for a in starts:
+                f = pool.submit(_extract_pages, todo[sha1], a, min(a + pages_per_task, n_pages[sha1]))
+                ranges[f] = sha1
+
+        for fut in as_completed(ranges):
+            sha1 = ranges[fut]
+            if sha1 in done:
+                continue  # an earlier range of this PDF failed
+            try:
+                pages, seconds = fut.result()
+            except Exception as e:
+                yield from finish(sha1, [], {"seconds": 0.0, "cached": False, "error": repr(e)})
+                continue
+            parts[sha1].extend(pages)
+            busy[sha1] += seconds
+            pending[sha1] -= 1
+            if pending[sha1] == 0:
+                pages, seconds = sorted(parts[sha1]), busy[sha1]
+                wall_s = time.perf_counter() - t_start
+                cache.put(sha1, pages, n_pages[sha1], seconds, wall_s)
+                yield from finish(sha1, pages, {"seconds": round(seconds, 4), "cached": False,
+                                                "wall_s": round(wall_s, 4)})
+
+
+def build_document(path: str, sha1: str, pages, timing: dict, names: dict) -> dict:
+    fn = os.path.basename(path)
+    return {
+        "pdf_name": names.get(fn, os.path.splitext(fn)[0]),
+        "id_pdf": fn,
+        "pages": [enrich_page(p, text) for p, text in pages],
+        "extract": {"sha1": sha1, "pages": len(pages), **timing},
+    }
+
+
+def extract_to_json(pdf_dirs, out_path: str, rubric: str, names: dict = None, cache_dir: str = DEFAULT_CACHE_DIR,
+                    workers: int = None, pages_per_task: int = PAGES_PER_TASK) -> dict:
+    """
+    Writes {"rubric", "documents": [...], "extract": summary} to out_path, one
+    document at a time (never the whole corpus in memory). Returns the summary.
+    """
+    names = names or {}
+    paths = list_pdfs(pdf_dirs)
+    cache = PageCache(cache_dir)
+    t0 = time.perf_counter()
+    summary = {"documents": 0, "pages": 0, "cached": 0, "errors": 0, "extract_s": 0.0}
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('{\n  "rubric": %s,\n  "documents": [' % json.dumps(rubric, ensure_ascii=False))
+        for path, sha1, pages, timing in iter_extracted(paths, cache, workers=workers,
+                                                         pages_per_task=pages_per_task):
+            doc = build_document(path, sha1, pages, timing, names)
+            f.write(("\n" if summary["documents"] == 0 else ",\n") + json.dumps(doc, ensure_ascii=False))
+            summary["documents"] += 1
+            summary["pages"] += len(pages)
+            summary["cached"] += int(timing["cached"])
+            summary["errors"] += int("error" in timing)
+            if not timing["cached"]:
+                summary["extract_s"] += timing["seconds"]
+            state = timing.get("error") or f'{timing["seconds"]:.2f}s'
+            if timing["cached"]:
+                state = f"cache, extracted in {state}"
+            print(f'  {os.path.basename(path)}: {len(pages)} pages ({state})')
+        summary["extract_s"] = round(summary["extract_s"], 3)
+        summary["wall_s"] = round(time.perf_counter() - t0, 3)
+        f.write('\n  ],\n  "extract": %s\n}\n' % json.dumps(summary))
+    os.replace(tmp, out_path)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel, cached PDF -> page JSON extraction (pdfplumber)")
+    parser.add_argument("pdf_dirs", nargs="+", help="directories of PDFs (e.g. pdfs/entreprises)")
+    parser.add_argument("--rubric", default="entreprises")
+    parser.add_argument("--out", default=os.path.join(BASE_PATH, "../../data/scraping_esilv/full_pdfs_improved.json"))
+    parser.add_argument("--names", default=None, help="JSON {file name: pdf_name}")
+    parser.add_argument("--cache-dir", default=os.environ.get("ESILV_PDF_CACHE_DIR", DEFAULT_CACHE_DIR))
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK)
+    args = parser.parse_args()
+
+    names = None
+    if args.names:
+        with open(args.names, "r", encoding="utf-8") as f:
+            names = json.load(f)
+
+    summary = extract_to_json(args.pdf_dirs, args.out, args.rubric, names=names, cache_dir=args.cache_dir,
+                              workers=args.workers, pages_per_task=args.pages_per_task)
+    print(f'OK -> {args.out} | docs={summary["documents"]} pages={summary["pages"]} '
+          f'cached={summary["cached"]} extract={summary["extract_s"]}s wall={summary["wall_s"]}s')
@@ -0,0 +1,30 @@
+# conftest.py
+# Regression tests for the app / indexing / scraping modules
+# - the modules import each other by flat name (run from their own folder), so their
+#   folders go on sys.path here
+# - Ollama / pdfplumber are not needed: tests that would call them are skipped or use
+#   small in-process fakes
+#
+# Usage: python -m pytest -q
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for sub in ("app", "embeddings", "scraping", "bench"):
+    sys.path.insert(0, os.path.join(CODE_DIR, sub))
+
+
+def unit_vectors(n: int, d: int = 64, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    v = rng.standard_normal((n, d)).astype("float32")
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return v
+
+
+@pytest.fixture
+def vectors():
+    return unit_vectors(2000)
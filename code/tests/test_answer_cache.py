@@ -0,0 +1,101 @@
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from answer_cache import SemanticAnswerCache, store_fingerprint
+from conftest import unit_vectors
+
+
+def make_store_dir(root):
+    for sub in ("docstore", "lexical", "router"):
+        os.makedirs(root / sub)
+        (root / sub / "meta.json").write_text("{}")
+    (root / "faiss_index.bin").write_bytes(b"index")
+    (root / "mapping.json").write_text("{}")
+
+
+@pytest.mark.parametrize("sub", ["docstore", "lexical", "router"])
+def test_fingerprint_covers_sub_manifests(tmp_path, sub):
+    make_store_dir(tmp_path)
+    before = store_fingerprint([str(tmp_path)])
+    path = tmp_path / sub / "meta.json"
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert store_fingerprint([str(tmp_path)]) != before
+
+
+def test_cache_cleared_when_fingerprint_changes():
+    fp = ["a"]
+    cache = SemanticAnswerCache(fingerprint_fn=lambda: fp[0])
+    q = np.ones(4, dtype="float32") / 2
+    cache.store(q, "prompt", [("s", 1)], "réponse")
+    assert cache.lookup(q, "prompt", [("s", 1)]) == "réponse"
+    fp[0] = "b"
+    assert cache.lookup(q, "prompt", [("s", 1)]) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+rag_agent_v2 = pytest.importorskip("rag_agent_v2")
+
+
+def test_fingerprint_taken_once_per_registry_load(monkeypatch):
+    calls = []
+
+    def counting(dirs):
+        calls.append(list(dirs))
+        return "fp"
+
+    monkeypatch.setattr(rag_agent_v2, "store_fingerprint", counting)
+    registry = rag_agent_v2.StoreRegistry(rag_agent_v2.STORE_SPECS)
+    cache = SemanticAnswerCache(fingerprint_fn=lambda: registry.fingerprint)
+    registry.get_rag()
+    q = np.ones(4, dtype="float32") / 2
+    for _ in range(3):
+        cache.store(q, "prompt", [("s", 1)], "réponse")
+        cache.lookup(q, "prompt", [("s", 1)])
+    assert len(calls) == 1 and registry.fingerprint == "fp"
+
+
+def test_answer_of_replaced_stores_is_not_stored():
+    fp = ["a"]
+    cache = SemanticAnswerCache(fingerprint_fn=lambda: fp[0])
+    q = np.ones(4, dtype="float32") / 2
+    before = cache.current_fingerprint()
+    fp[0] = "b"                                   # stores reloaded during the generation
+    cache.store(q, "prompt", [("s", 1)], "réponse", fingerprint=before)
+    assert cache.lookup(q, "prompt", [("s", 1)]) is None
+    cache.store(q, "prompt", [("s", 1)], "réponse", fingerprint=cache.current_fingerprint())
+    assert cache.lookup(q, "prompt", [("s", 1)]) == "réponse"
+
+
+def write_flat_store(out_dir, n, seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    index = faiss.IndexFlatIP(64)
+    index.add(unit_vectors(n, 64, seed=seed))
+    faiss.write_index(index, os.path.join(out_dir, "faiss_index.bin"))
+    with open(os.path.join(out_dir, "mapping.json"), "w", encoding="utf-8") as f:
+        json.dump({str(i): {"content": f"chunk {seed}-{i}", "rubric": "admissions"} for i in range(n)}, f)
+
+
+def test_rebuilt_store_is_reloaded_and_clears_the_cache(tmp_path, monkeypatch):
+    store_dir = str(tmp_path / "store")
+    write_flat_store(store_dir, 5)
+    registry = rag_agent_v2.StoreRegistry([("s", store_dir)], check_interval=60)
+    first = registry.get_rag()
+    cache = SemanticAnswerCache(fingerprint_fn=lambda: registry.fingerprint)
+    q = np.ones(4, dtype="float32") / 2
+    cache.store(q, "prompt", [("s", 1)], "réponse")
+
+    write_flat_store(store_dir, 8, seed=1)
+    assert registry.get_rag() is first                      # not re-checked before check_interval
+    monkeypatch.setattr(registry, "_checked_at", registry._checked_at - 61)
+    rag = registry.get_rag()
+    assert rag is not first and registry.store("s")["index"].ntotal == 8 and registry.reloads == 1
+    assert cache.lookup(q, "prompt", [("s", 1)]) is None and cache.stats()["invalidations"] == 1
+
+    os.remove(os.path.join(store_dir, "faiss_index.bin"))   # half-written rebuild: keep serving
+    monkeypatch.setattr(registry, "_checked_at", registry._checked_at - 61)
+    assert registry.get_rag() is rag and registry.error
@@ -0,0 +1,78 @@
+import pytest
+
+import context_builder
+from context_builder import SentenceDeduper, _fit, build_context, estimate_tokens, merge_page_parts
+
+
+def hit(idx, content, score, store="v2_site", url=None, **doc):
+    return {"store": store, "idx": idx, "score": score,
+            "doc": {"content": content, "url": url or f"https://www.esilv.fr/{idx}", **doc}}
+
+
+def pdf_part(idx, part, parts, score, content, page=3):
+    header = "SOURCE: pdf PDF_NAME: brochure.pdf RUBRIC: entreprises TEXT: "
+    return hit(idx, header + content, score, store="v3_pdf", url=f"brochure.pdf#page={page}",
+               source_file="brochure.pdf", page=page, part_index=part, parts_count=parts)
+
+
+def test_parts_of_a_page_are_merged_in_order_at_their_best_rank():
+    hits = [
+        pdf_part(11, 1, 2, 0.9, "Deuxième partie de la page."),
+        hit(5, "Un chunk du site.", 0.8),
+        pdf_part(10, 0, 2, 0.7, "Première partie de la page."),
+        pdf_part(20, 0, 2, 0.6, "Autre page.", page=4),
+    ]
+    groups = merge_page_parts(hits)
+    assert [(g["store"], g["url"]) for g in groups] == [
+        ("v3_pdf", "brochure.pdf#page=3"), ("v2_site", "https://www.esilv.fr/5"), ("v3_pdf", "brochure.pdf#page=4")]
+    assert groups[0]["text"] == "Première partie de la page. Deuxième partie de la page."
+    assert groups[0]["score"] == 0.9 and "SOURCE:" not in groups[2]["text"]
+
+
+def test_near_duplicate_sentences_are_dropped():
+    dedup = SentenceDeduper()
+    dedup.add("Les frais de scolarité du cycle ingénieur sont de 9 000 euros par an.")
+    assert not dedup.is_new("Les frais de scolarité du cycle ingénieur sont de 9 000 € par an.")
+    assert not dedup.is_new("les  FRAIS de scolarite du cycle ingenieur sont de 9 000 euros par an")
+    assert dedup.is_new("Les frais de scolarité du cycle préparatoire sont différents.")
+    # short sentences only repeat on an exact match
+    dedup.add("ESILV Paris")
+    assert not dedup.is_new("ESILV, Paris.") and dedup.is_new("ESILV Nantes")
+
+
+def test_context_skips_sentences_given_by_a_better_chunk():
+    hits = [
+        hit(0, "Le concours Avenir comprend des épreuves écrites. Les inscriptions ouvrent en janvier.", 0.9),
+        hit(1, "Les inscriptions ouvrent en janvier. Les résultats sont publiés en avril.", 0.8),
+        hit(2, "Le concours Avenir comprend des épreuves écrites !", 0.7),
+    ]
+    context = build_context(hits, budget_tokens=500)
+    lines = context.split("\n")
+    assert lines[0] == ("- [v2_site] Le concours Avenir comprend des épreuves écrites. Les inscriptions ouvrent "
+                        "en janvier. (source: https://www.esilv.fr/0)")
+    assert lines[1] == "- [v2_site] Les résultats sont publiés en avril. (source: https://www.esilv.fr/1)"
+    assert len(lines) == 2 and context.count("janvier") == 1
+
+
+def test_fit_keeps_leading_sentences_and_cuts_a_long_first_one():
+    sentences = ["Une phrase courte.", "Une deuxième phrase.", "Une troisième phrase, bien plus longue encore."]
+    room = estimate_tokens(sentences[0]) + estimate_tokens(sentences[1]) + 2
+    assert _fit(sentences, room) == sentences[:2]
+    cut = _fit(["mot " * 100], 10)
+    assert len(cut) == 1 and cut[0].endswith(" …") and len(cut[0]) <= 10 * context_builder.CHARS_PER_TOKEN + 2
+
+
+@pytest.mark.parametrize("budget", [60, 120, 400])
+def test_context_stays_within_the_token_budget(budget):
+    text = " ".join(f"Phrase numéro {i} sur le programme ingénieur de l'école." for i in range(40))
+    hits = [hit(i, f"Chunk {i}. " + text, 1.0 - i / 100) for i in range(8)]
+    context = build_context(hits, budget_tokens=budget, chunk_tokens=80)
+    assert 0 < estimate_tokens(context) <= budget
+    assert all(estimate_tokens(line) <= 80 + estimate_tokens("- [v2_site]  (source: https://www.esilv.fr/0)") + 1
+               for line in context.split("\n"))
+    # by score: the best chunk comes first, lower ones only while the budget lasts
+    assert context.startswith("- [v2_site] Chunk 0.")
+
+
+def test_no_room_for_a_useful_chunk_gives_an_empty_context():
+    assert build_context([hit(0, "Texte. " * 50, 0.9)], budget_tokens=context_builder.MIN_FILL_TOKENS) == ""
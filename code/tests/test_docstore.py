@@ -0,0 +1,57 @@
+import json
+import os
+
+from docstore import DOCSTORE_DIRNAME, DocStore, convert_mapping, open_docstore, pdf_header
+
+MAPPING = {
+    "0": {"title": "Admissions", "content": "Concours Avenir.", "rubric": "admissions", "url": "u0", "page": None},
+    "1": {"title": "Brochure", "rubric": "formations", "pdf_name": "brochure.pdf", "source_file": "b.pdf",
+          "page": 3, "content": pdf_header("formations", "brochure.pdf", "b.pdf", 3) + "Cycle ingénieur.",
+          "tags": ["a", "b"]},
+    "3": {"title": "Échange", "content": "Semestre à l'étranger.", "rubric": "admissions", "url": "u3"},
+    "4": {"title": "Vide", "content": "", "rubric": "formations", "page": 7},
+}
+
+
+def write_store(tmp_path, mapping=MAPPING):
+    with open(tmp_path / "mapping.json", "w", encoding="utf-8") as f:
+        json.dump(mapping, f, ensure_ascii=False)
+    convert_mapping(str(tmp_path))
+
+
+def test_round_trip(tmp_path):
+    write_store(tmp_path)
+    store = open_docstore(str(tmp_path))
+    assert isinstance(store, DocStore)
+    assert len(store) == 4
+    assert sorted(store.keys(), key=int) == ["0", "1", "3", "4"]
+    for key, doc in MAPPING.items():
+        assert store.get(key) == doc                      # header, nulls, absent keys, json values
+    assert store.get("2") is None and "2" not in store
+    assert store.ids().tolist() == [0, 1, 3, 4]
+    assert store.field(1, "page") == 3
+
+
+def test_rewritten_mapping_same_size_is_stale(tmp_path):
+    write_store(tmp_path)
+    changed = dict(MAPPING)
+    changed["0"] = {**MAPPING["0"], "url": "u9"}               # same length, other content
+    with open(tmp_path / "mapping.json", "w", encoding="utf-8") as f:
+        json.dump(changed, f, ensure_ascii=False)
+    assert open_docstore(str(tmp_path)) is None
+
+
+def test_touched_mapping_same_content_is_fresh(tmp_path):
+    write_store(tmp_path)
+    st = os.stat(tmp_path / "mapping.json")
+    os.utime(tmp_path / "mapping.json", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))   # git checkout, copy
+    assert open_docstore(str(tmp_path)) is not None
+
+
+def test_docstore_without_stamp_is_stale(tmp_path):
+    write_store(tmp_path)
+    meta_path = tmp_path / DOCSTORE_DIRNAME / "meta.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    meta.pop("source")
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+    assert open_docstore(str(tmp_path)) is None
@@ -0,0 +1,52 @@
+import numpy as np
+
+from embed_cache import EmbeddingCache, VectorFileStore, text_key
+from indexing import BatchEmbedder
+
+MODEL = "test-embed"
+
+
+def fake_vectors(texts):
+    # distinct unit vector per text length, enough to tell texts apart
+    out = np.zeros((len(texts), 8), dtype="float32")
+    for row, t in enumerate(texts):
+        out[row, len(t) % 8] = 1.0
+    return out
+
+
+def test_text_key_normalizes_whitespace_and_nfc_only():
+    assert text_key("Frais  de\nscolarité ") == text_key("Frais de scolarité")
+    assert text_key("échange") == text_key("échange")
+    assert text_key("BTS alternance") != text_key("bts alternance")
+
+
+def test_indexer_vectors_are_hit_by_the_query_path(tmp_path):
+    embedder = BatchEmbedder(model=MODEL, cache_dir=str(tmp_path))
+    calls = []
+
+    def embed_uncached(texts):
+        calls.append(list(texts))
+        return fake_vectors(texts)
+
+    embedder._embed_uncached = embed_uncached
+    chunk = "Admissions :\n  concours  Avenir"
+    stored = embedder.embed([chunk, "Admissions : concours Avenir", "autre"])
+    assert calls == [[chunk, "autre"]]                        # whitespace variants embedded once
+    assert np.array_equal(stored[0], stored[1])
+
+    cache = EmbeddingCache(persistent=VectorFileStore(str(tmp_path)))
+    v = cache.lookup(MODEL, "Admissions : concours Avenir")
+    assert v is not None and np.array_equal(v, stored[0])
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.lookup(MODEL, "admissions : concours avenir") is None
+
+
+def test_query_vectors_are_hit_by_the_indexer(tmp_path):
+    cache = EmbeddingCache(persistent=VectorFileStore(str(tmp_path)))
+    cache.get_or_compute_many(MODEL, ["Double diplôme", "Double  diplôme"], fake_vectors)
+    assert cache.stats()["misses"] == 1
+
+    embedder = BatchEmbedder(model=MODEL, cache_dir=str(tmp_path))
+    embedder._embed_uncached = lambda texts: (_ for _ in ()).throw(AssertionError(texts))
+    embedder.embed(["Double diplôme"])
+    assert embedder.cache_hits == 1
@@ -0,0 +1,98 @@
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+incremental = pytest.importorskip("incremental")
+
+
+class FakeEmbedder:
+    """embed_fn recording every text it is asked for (one vector per text, seeded by it)."""
+
+    def __init__(self, d=1024):                 # new stores are created at the model dimension
+        self.d = d
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.vstack([self.vector(t) for t in texts])
+
+    def vector(self, text):
+        rng = np.random.default_rng(int(incremental.stable_id(text), 16) % (2 ** 32))
+        v = rng.standard_normal(self.d).astype("float32")
+        return v / np.linalg.norm(v)
+
+
+def corpus(*texts, rubric="admissions"):
+    return [(t, {"content": t, "rubric": rubric, "url": f"https://www.esilv.fr/{i}"}) for i, t in enumerate(texts)]
+
+
+def read_mapping(out_dir):
+    with open(os.path.join(out_dir, "mapping.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update(out_dir, chunks, embed):
+    return incremental.incremental_update(str(out_dir), chunks, embed, incremental.v3_key_text, model="fake")
+
+
+def test_only_changed_chunks_are_embedded(tmp_path):
+    embed = FakeEmbedder()
+    report = update(tmp_path, corpus("a", "b", "c"), embed)
+    assert report["added"] == 3 and embed.calls == [["a", "b", "c"]]
+
+    report = update(tmp_path, corpus("a", "c", "d"), embed)
+    assert embed.calls[-1] == ["d"]
+    assert (report["added"], report["removed"], report["unchanged"], report["ntotal"]) == (1, 1, 2, 3)
+
+    calls = len(embed.calls)
+    report = update(tmp_path, corpus("a", "c", "d"), embed)
+    assert len(embed.calls) == calls and report["added"] == report["removed"] == 0
+
+
+def test_ids_stay_stable_and_vectors_match_the_text(tmp_path):
+    embed = FakeEmbedder()
+    update(tmp_path, corpus("a", "b", "c"), embed)
+    first = read_mapping(tmp_path)
+    update(tmp_path, corpus("a", "c", "d"), embed)
+    mapping = read_mapping(tmp_path)
+
+    ids = {m["content"]: int(i) for i, m in mapping.items()}
+    assert ids["a"] == 0 and ids["c"] == 2 and ids["d"] == 3 and "b" not in ids
+    assert {m["content"] for m in first.values()} == {"a", "b", "c"}
+    index = faiss.read_index(os.path.join(tmp_path, "faiss_index.bin"))
+    for text, i in ids.items():
+        np.testing.assert_allclose(index.reconstruct(i), embed.vector(text), atol=1e-6)
+
+
+def test_metadata_refresh_and_duplicates(tmp_path):
+    embed = FakeEmbedder()
+    update(tmp_path, corpus("a", "b"), embed)
+    calls = len(embed.calls)
+    chunks = corpus("a", "b", rubric="formations") + corpus("a")
+    report = update(tmp_path, chunks, embed)
+    assert len(embed.calls) == calls and report["duplicates_skipped"] == 1
+    assert {m["rubric"] for m in read_mapping(tmp_path).values()} == {"formations"}
+
+
+def test_store_without_manifest_is_adopted(tmp_path):
+    embed = FakeEmbedder()
+    texts = ["a", "b", "a"]
+    flat = faiss.IndexFlatIP(embed.d)
+    flat.add(np.vstack([embed.vector(t) for t in texts]))
+    faiss.write_index(flat, os.path.join(tmp_path, "faiss_index.bin"))
+    with open(os.path.join(tmp_path, "mapping.json"), "w", encoding="utf-8") as f:
+        json.dump({str(i): {"content": t, "rubric": "admissions"} for i, t in enumerate(texts)}, f)
+
+    report = update(tmp_path, corpus("a", "b", "c"), embed)
+    assert embed.calls == [["c"]]
+    assert report["ntotal"] == 3 and sorted(read_mapping(tmp_path), key=int) == ["0", "1", "3"]
+
+
+def test_other_model_is_refused(tmp_path):
+    update(tmp_path, corpus("a"), FakeEmbedder())
+    with pytest.raises(ValueError):
+        incremental.incremental_update(str(tmp_path), corpus("a"), FakeEmbedder(), incremental.v3_key_text,
+                                       model="other")
@@ -0,0 +1,130 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from answer_cache import SemanticAnswerCache
+from ann_index import build_index
+from conftest import unit_vectors
+from lexical_index import LexicalIndex, is_keyword_query, open_lexical, rrf_fuse, tokenize, write_lexical
+
+DOCS = {
+    "0": {"title": "Admissions", "content": "Admission en alternance après un BTS ou un BUT.", "url": "u0"},
+    "1": {"title": "Frais", "content": "Les frais de scolarité du cycle ingénieur.", "url": "u1"},
+    "2": {"title": "Échanges", "content": "Semestre d'échange à l'international.", "url": "u2"},
+    "3": {"title": "Cycle ingénieur", "content": "Le cycle ingénieur de l'école en cinq ans.", "url": "u3"},
+}
+
+
+def test_tokenize_folds_accents_elisions_and_plurals():
+    assert tokenize("L'école d'ingénieurs et les échanges") == ["ecole", "ingenieur", "echange"]
+
+
+def test_bm25_ranks_rare_terms_and_honours_ids():
+    lx = LexicalIndex.from_mapping(DOCS)
+    scores, ids = lx.search("BTS alternance", 3)
+    assert ids.tolist() == [0]
+    scores, ids = lx.search("cycle ingénieur", 4)
+    assert set(ids.tolist()) == {1, 3} and (np.diff(scores) <= 0).all()
+    assert lx.search("cycle ingénieur", 4, ids=np.array([1]))[1].tolist() == [1]
+    assert lx.term_idf("bts") > lx.term_idf("ingenieur") > 0.0
+    assert lx.term_idf("inconnu") == 0.0
+
+
+def write_store(tmp_path, docs):
+    with open(tmp_path / "mapping.json", "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    write_lexical(docs, str(tmp_path / "lexical"), source_path=str(tmp_path / "mapping.json"))
+
+
+def test_open_lexical_rebuilds_a_rechunked_store(tmp_path):
+    write_store(tmp_path, DOCS)
+    assert open_lexical(str(tmp_path), DOCS).search("BTS", 1)[1].tolist() == [0]
+
+    # same doc count, other content: the stored postings are stale
+    rechunked = {**DOCS, "0": {**DOCS["0"], "content": "Stage de fin d'études."}}
+    with open(tmp_path / "mapping.json", "w", encoding="utf-8") as f:
+        json.dump(rechunked, f, ensure_ascii=False)
+    lx = open_lexical(str(tmp_path), rechunked)
+    assert lx.search("BTS", 1)[1].tolist() == [] and lx.search("stage", 1)[1].tolist() == [0]
+
+
+def test_open_lexical_without_stamp_is_stale(tmp_path):
+    write_store(tmp_path, DOCS)
+    write_lexical(DOCS, str(tmp_path / "lexical"))
+    os.utime(tmp_path / "mapping.json")
+    assert "source" not in LexicalIndex.load(str(tmp_path / "lexical")).meta
+    assert open_lexical(str(tmp_path), None) is None
+
+
+def test_is_keyword_query():
+    assert is_keyword_query("BTS alternance")
+    assert not is_keyword_query("Comment candidater en alternance ?")
+    assert not is_keyword_query("quels sont les frais")
+
+
+def test_rrf_fuse_keeps_cosine_and_bm25():
+    vector = [{"store": "s", "idx": 1, "score": 0.9}, {"store": "s", "idx": 2, "score": 0.8}]
+    bm25 = [{"store": "s", "idx": 2, "score": None, "bm25": 7.0}, {"store": "s", "idx": 3, "score": None, "bm25": 5.0}]
+    fused = rrf_fuse({"vector": vector, "bm25": bm25}, 3)
+    assert [h["idx"] for h in fused] == [2, 1, 3]
+    by_idx = {h["idx"]: h for h in fused}
+    assert by_idx[2]["score"] == 0.8 and by_idx[2]["bm25"] == 7.0
+    assert by_idx[1]["score"] == 0.9 and "bm25" not in by_idx[1]
+    assert by_idx[3]["score"] is None
+    assert by_idx[2]["fused_score"] == pytest.approx(1 / 62 + 1 / 61)
+
+
+def test_answer_cache_keyword_only_keyed_on_text():
+    cache = SemanticAnswerCache()
+    ids = [("s", 0)]
+    assert cache.lookup(None, "prompt", ids, question="BTS  alternance") is None
+    cache.store(None, "prompt", ids, "réponse", question="BTS alternance")
+    assert cache.lookup(None, "prompt", ids, question="BTS  alternance") == "réponse"
+    assert cache.lookup(None, "prompt", ids, question="BUT alternance") is None
+    assert cache.lookup(None, "autre prompt", ids, question="BTS alternance") is None
+    assert cache.lookup(None, "prompt", ids) is None
+
+
+rag_agent_v2 = pytest.importorskip("rag_agent_v2")
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    # 4 chunks: idf values are small, "bts" (1 chunk) still clears 1.0, "ingenieur" (2) does not
+    monkeypatch.setattr(rag_agent_v2, "KEYWORD_MIN_IDF", 1.0)
+    store = {"name": "s", "index": build_index(unit_vectors(len(DOCS), seed=7), kind="flat"),
+             "mapping": DOCS, "lexical": LexicalIndex.from_mapping(DOCS)}
+    return rag_agent_v2.MultiStoreRAG([store])
+
+
+def test_keyword_only_needs_a_rare_term(rag):
+    assert rag.keyword_only("BTS alternance", hybrid=True)
+    assert not rag.keyword_only("cycle ingénieur", hybrid=True)          # in half the chunks
+    assert not rag.keyword_only("Comment candidater ?", hybrid=True)
+
+
+def test_hybrid_is_off_by_default(rag):
+    assert not rag_agent_v2.HYBRID
+    assert not rag.keyword_only("BTS alternance")
+    hits = rag.search_vector(unit_vectors(1, seed=8)[0], top_k_total=3, query_text="BTS alternance", rerank="")
+    assert all("fused_score" not in h for h in hits)
+
+
+def test_keyword_only_hits_have_bm25_not_cosine(rag):
+    q_vec, hits = rag.search_text("BTS alternance", top_k_total=3, hybrid=True)
+    assert q_vec is None
+    assert hits[0]["idx"] == 0 and hits[0]["score"] is None and hits[0]["bm25"] > 0
+
+
+def test_fused_hits_score_is_cosine(rag):
+    V = rag.stores[0]["index"].reconstruct_n(0, len(DOCS))
+    q = unit_vectors(1, seed=8)[0]
+    hits = rag.search_vector(q, top_k_per_store=4, top_k_total=4, query_text="frais de scolarité",
+                             hybrid=True, rerank="")
+    assert len(hits) == 4
+    for h in hits:
+        assert h["score"] == pytest.approx(float(V[h["idx"]] @ q), abs=1e-5)
+        assert "fused_score" in h and "bm25" in h
+    assert next(h for h in hits if h["idx"] == 1)["bm25"] > 0
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import threading
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    """Fresh process registry, metrics on, traces appended to a temp JSONL."""
+    reg = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", reg)
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "JSONL_PATH", str(tmp_path / "traces.jsonl"))
+    return reg
+
+
+def histogram(reg, name, **labels):
+    return reg.histograms[(name, metrics._label_key(labels))]
+
+
+def read_traces(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_stage_and_timed_fill_histograms(registry):
+    with metrics.stage("index.search", store="v2_site"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.stage("index.search", store="v2_site"):
+            raise ValueError("timed anyway")
+
+    @metrics.timed("context")
+    def build(x):
+        return x * 2
+
+    assert build(21) == 42 and build.__name__ == "build"
+    assert histogram(registry, "index.search", store="v2_site").count == 2
+    assert histogram(registry, "context").count == 1
+    metrics.inc("answer_cache", result="hit")
+    metrics.inc("answer_cache", 2, result="hit")
+    assert registry.counters[("answer_cache", (("result", "hit"),))] == 3.0
+
+
+def test_histogram_buckets_and_quantiles():
+    h = metrics.Histogram()
+    for s in (0.0002, 0.003, 0.003, 0.2, 100.0):
+        h.observe(s)
+    assert h.count == 5 and h.counts[0] == 1 and h.counts[-1] == 1
+    assert h.counts[metrics.BUCKETS.index(0.005)] == 2
+    assert 0.0025 <= h.quantile(0.5) <= 0.005
+    assert h.quantile(0.99) == metrics.BUCKETS[-1] and metrics.Histogram().quantile(0.5) == 0.0
+
+
+def test_trace_collects_spans_and_writes_one_jsonl_line(registry, tmp_path):
+    with metrics.trace("ask_agent", agent="Admissions") as tr:
+        with metrics.stage("embed"):
+            pass
+        with metrics.trace("nested") as inner:           # joins the outer trace
+            assert inner is tr
+            metrics.observe("index.search", 0.002, store="v3_pdf")
+        assert metrics.current_trace() is tr
+    assert metrics.current_trace() is None
+
+    traces = read_traces(tmp_path / "traces.jsonl")
+    assert len(traces) == 1
+    line = traces[0]
+    assert line["trace"] == "ask_agent" and line["agent"] == "Admissions" and line["total_ms"] >= 0
+    assert [s["stage"] for s in line["spans"]] == ["embed", "index.search"]
+    assert line["spans"][1] == {"stage": "index.search", "ms": 2.0, "store": "v3_pdf"}
+    assert histogram(registry, "ask_agent").count == 1 and ("nested", ()) not in registry.histograms
+
+
+def test_trace_follows_bound_threads_and_attach(registry, tmp_path):
+    with metrics.trace("service.ask") as tr:
+        worker = threading.Thread(target=metrics.bind(lambda: metrics.observe("ollama.chat", 0.5)))
+        worker.start()
+        worker.join()
+    with metrics.attach(tr):
+        assert metrics.current_trace() is tr
+    assert metrics.current_trace() is None
+    assert [s["stage"] for s in read_traces(tmp_path / "traces.jsonl")[0]["spans"]] == ["ollama.chat"]
+
+
+def test_disabled_metrics_are_no_ops(registry, monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    with metrics.trace("ask_agent") as tr, metrics.stage("embed"):
+        metrics.inc("answer_cache", result="miss")
+    assert tr is None and not registry.histograms and not registry.counters
+    assert not (tmp_path / "traces.jsonl").exists()
+
+
+def test_prometheus_text(registry):
+    metrics.observe("index.search", 0.003, store="v2_site")
+    metrics.observe("index.search", 7.0, store="v2_site")
+    metrics.inc("service_rejected", kind="generate")
+    lines = metrics.prometheus_text().splitlines()
+    assert "# TYPE esilv_index_search_seconds histogram" in lines
+    assert 'esilv_index_search_seconds_bucket{store="v2_site",le="0.0025"} 0' in lines
+    assert 'esilv_index_search_seconds_bucket{store="v2_site",le="0.005"} 1' in lines
+    assert 'esilv_index_search_seconds_bucket{store="v2_site",le="+Inf"} 2' in lines
+    assert 'esilv_index_search_seconds_sum{store="v2_site"} 7.003000' in lines
+    assert 'esilv_index_search_seconds_count{store="v2_site"} 2' in lines
+    assert lines[-2:] == ["# TYPE esilv_service_rejected_total counter", 'esilv_service_rejected_total{kind="generate"} 1']
+    snap = metrics.snapshot()
+    assert snap["histograms"][0]["count"] == 2 and snap["counters"][0]["value"] == 1.0
+
+
+def test_log_level_defaults_to_info():
+    if "ESILV_LOG_LEVEL" not in os.environ:
+        assert metrics.LOG_LEVEL == "INFO"
+    log = metrics.get_logger("esilv.test")
+    assert log is metrics.get_logger("esilv.test") and len(log.handlers) == 1
+    assert log.level == getattr(logging, metrics.LOG_LEVEL, logging.INFO)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from ann_index import build_index
+from conftest import unit_vectors
+
+rag_agent_v2 = pytest.importorskip("rag_agent_v2")
+MultiStoreRAG = rag_agent_v2.MultiStoreRAG
+UnifiedStoreRAG = rag_agent_v2.UnifiedStoreRAG
+
+
+def make_store(name, vectors, rubrics):
+    mapping = {
+        str(i): {"rubric": r, "url": f"https://{name}/{i}", "content": f"{name} chunk {i}"}
+        for i, r in enumerate(rubrics)
+    }
+    return {"name": name, "index": build_index(vectors, kind="flat"), "mapping": mapping}
+
+
+@pytest.fixture
+def stores():
+    a = unit_vectors(300, seed=1)
+    b = unit_vectors(200, seed=2)
+    return [
+        make_store("v2_site", a, ["admissions" if i % 2 else "formations" for i in range(300)]),
+        make_store("v3_pdf", b, ["international"] * 200),
+    ]
+
+
+def ranked(hits):
+    return [(h["store"], h["idx"]) for h in hits]
+
+
+def test_single_store_partition_returns_top_k_total(stores):
+    q = unit_vectors(1, seed=3)[0]
+    multi = MultiStoreRAG(stores)
+    unified = UnifiedStoreRAG(stores)
+    for where in ({"rubric": "admissions"}, {"store": "v3_pdf"}):
+        hits = multi.search_vector(q, top_k_per_store=6, top_k_total=10, rerank="", hybrid=False, where=where)
+        assert len(hits) == 10
+        assert ranked(hits) == ranked(unified.search_vector(q, top_k_total=10, rerank="", hybrid=False, where=where))
+
+
+def test_filtered_batch_matches_single(stores):
+    Q = unit_vectors(4, seed=4)
+    multi = MultiStoreRAG(stores)
+    where = {"rubric": ["formations", "international"]}
+    batch = multi.search_vectors(Q, top_k_per_store=6, top_k_total=8, rerank="", where=where)
+    for q, hits in zip(Q, batch):
+        assert ranked(hits) == ranked(multi.search_vector(q, top_k_per_store=6, top_k_total=8, rerank="",
+                                                          hybrid=False, where=where))
+        assert all(h["doc"]["rubric"] in ("formations", "international") for h in hits)
+
+
+def test_search_batch_passes_where(stores, monkeypatch):
+    Q = unit_vectors(3, seed=5)
+    monkeypatch.setattr(rag_agent_v2, "embed_batch", lambda questions: Q[:len(questions)])
+    multi = MultiStoreRAG(stores)
+    results = multi.search_batch(["a", "b", "c"], top_k_total=5, where={"store": "v3_pdf"})
+    assert [len(hits) for hits in results] == [5, 5, 5]
+    assert all(h["store"] == "v3_pdf" for hits in results for h in hits)
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+
+pdf_extract = pytest.importorskip("pdf_extract")
+
+
+def write_pdf(path, texts):
+    """Minimal PDF with one page per text (Helvetica, no compression)."""
+    n = len(texts)
+    font = 3 + 2 * n
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>",
+            "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{3 + 2 * i} 0 R" for i in range(n)), n)]
+    for i, text in enumerate(texts):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                    f"/Resources << /Font << /F1 {font} 0 R >> >> >>")
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream.decode('latin-1')}\nendstream")
+    objs.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, obj in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+@pytest.fixture
+def pdf_dir(tmp_path):
+    d = tmp_path / "pdfs"
+    d.mkdir()
+    write_pdf(d / "a.pdf", [f"Page {i} brochure ESILV" for i in range(1, 6)])
+    write_pdf(d / "b.pdf", ["Admissions"])
+    (d / "broken.pdf").write_bytes(b"not a pdf")
+    return d
+
+
+def extract(pdf_dir, tmp_path):
+    out = tmp_path / "out.json"
+    summary = pdf_extract.extract_to_json([str(pdf_dir)], str(out), "entreprises", cache_dir=str(tmp_path / "cache"),
+                                          workers=2, pages_per_task=2)
+    with open(out, "r", encoding="utf-8") as f:
+        return summary, {d["id_pdf"]: d for d in json.load(f)["documents"]}
+
+
+def test_extracts_in_ranges_and_isolates_a_broken_pdf(pdf_dir, tmp_path):
+    summary, docs = extract(pdf_dir, tmp_path)
+    assert list(docs) == ["a.pdf", "b.pdf", "broken.pdf"]
+    assert [p["page"] for p in docs["a.pdf"]["pages"]] == [1, 2, 3, 4, 5]
+    assert docs["a.pdf"]["pages"][2]["text_raw"] == "Page 3 brochure ESILV"
+    assert "error" in docs["broken.pdf"]["extract"] and docs["broken.pdf"]["pages"] == []
+    assert summary["errors"] == 1 and summary["cached"] == 0
+
+
+def test_cached_documents_keep_their_original_timing(pdf_dir, tmp_path):
+    _, first = extract(pdf_dir, tmp_path)
+    summary, again = extract(pdf_dir, tmp_path)
+    for name in ("a.pdf", "b.pdf"):
+        timing, original = again[name]["extract"], first[name]["extract"]
+        assert timing["cached"] and not original["cached"]
+        assert timing["seconds"] == original["seconds"] > 0.0
+        assert timing["wall_s"] == original["wall_s"] > 0.0
+        assert again[name]["pages"] == first[name]["pages"]
+    assert summary["cached"] == 2 and summary["extract_s"] == 0.0
+    assert not again["broken.pdf"]["extract"]["cached"]        # errors are never cached
+
+
+def test_failed_range_fails_only_that_pdf_and_is_not_cached(pdf_dir, tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def flaky(path, start, end):
+        if path.endswith("a.pdf") and start == 2:
+            raise RuntimeError("bad page range")
+        return real(path, start, end)
+
+    real = pdf_extract._extract_pages
+    monkeypatch.setattr(pdf_extract, "_extract_pages", flaky)
+    monkeypatch.setattr(pdf_extract, "ProcessPoolExecutor", ThreadPoolExecutor)
+    cache = pdf_extract.PageCache(str(tmp_path / "cache"))
+    paths = pdf_extract.list_pdfs([str(pdf_dir)])
+    results = {os.path.basename(p): timing
+               for p, _, _, timing in pdf_extract.iter_extracted(paths, cache, workers=2, pages_per_task=2)}
+
+    assert "bad page range" in results["a.pdf"]["error"]
+    assert not results["b.pdf"].get("error")
+    assert cache.get(pdf_extract.file_sha1(paths[0])) is None
@@ -0,0 +1,28 @@
+import faiss
+import numpy as np
+
+from ann_index import build_index, measure, pq_bits, recall_at_k
+from conftest import unit_vectors
+from quantized_index import RescoredIndex, build_quantized
+
+
+def test_pq_bits_follow_the_store_size():
+    assert pq_bits(533) == 5 and pq_bits(410) == 4
+    assert pq_bits(100_000) == 8 and pq_bits(10) == 1
+
+
+def test_small_store_pq_compresses_without_clustering_warnings(capfd):
+    vectors = unit_vectors(533, d=256, seed=3)
+    codes = build_quantized(vectors, kind="pq")
+    ivf_pq = build_index(vectors, kind="ivf_pq", pq_m=32)
+    assert "WARNING clustering" not in capfd.readouterr().err
+
+    flat = build_index(vectors, kind="flat")
+    assert faiss.serialize_index(flat).nbytes > 8 * faiss.serialize_index(codes).nbytes
+    assert ivf_pq.ntotal == 533
+
+    queries = vectors[:50] + 0.05 * unit_vectors(50, d=256, seed=4)
+    truth, _ = measure(flat, queries, 10)
+    found, _ = measure(RescoredIndex(codes, vectors, rescore_factor=4), queries, 10)
+    assert recall_at_k(truth, found, 10) > 0.9
+    assert np.array_equal(found[:, 0], truth[:, 0])
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+import pytest
+
+rag_agent_v2 = pytest.importorskip("rag_agent_v2")
+import rag_server  # noqa: E402
+import rag_service  # noqa: E402
+from answer_cache import SemanticAnswerCache  # noqa: E402
+from embed_cache import EmbeddingCache  # noqa: E402
+
+QUESTION = "Comment se passe le concours Avenir ?"
+ANSWER = "Le concours Avenir comprend des épreuves écrites."
+
+
+@pytest.fixture
+def target():
+    """(store, idx) of a stored v2 chunk about the concours Avenir, used as the question vector."""
+    store = rag_agent_v2.STORES.store("v2_site")
+    for key, doc in store["mapping"].items():
+        if "concours-avenir" in (doc.get("url") or ""):
+            return store, int(key)
+    pytest.skip("no concours-avenir chunk in the v2 store")
+
+
+@pytest.fixture
+def fake_ollama(monkeypatch, target):
+    """Real stores and server; embeddings / generation replaced, caches kept in memory."""
+    store, idx = target
+    calls = {"embed": 0, "generate": 0}
+
+    def embed(text):
+        calls["embed"] += 1
+        return np.asarray(store["index"].reconstruct(idx), dtype="float32")
+
+    def generate_stream(context, question, prompt):
+        calls["generate"] += 1
+        yield from ANSWER.split(" ")[:1] + [" " + w for w in ANSWER.split(" ")[1:]]
+
+    monkeypatch.setattr(rag_agent_v2, "EMBED_CACHE", EmbeddingCache(max_items=16))
+    monkeypatch.setattr(rag_agent_v2, "ANSWER_CACHE", SemanticAnswerCache(fingerprint_fn=lambda: "test"))
+    monkeypatch.setattr(rag_agent_v2, "embed", embed)
+    monkeypatch.setattr(rag_agent_v2, "generate_answer", lambda c, q, p: "".join(generate_stream(c, q, p)))
+    monkeypatch.setattr(rag_agent_v2, "generate_answer_stream", generate_stream)
+    monkeypatch.setattr(rag_agent_v2, "_check_answer", lambda answer, context: answer)
+    return calls
+
+
+def request(raw: bytes):
+    """(status, headers, body) of the response to a raw request, on a fresh server."""
+    async def run():
+        server = rag_server.RAGServer(rag_service.RAGService())
+        srv = await asyncio.start_server(server.on_connection, "127.0.0.1", 0, limit=rag_server.MAX_BODY)
+        port = srv.sockets[0].getsockname()[1]
+        async with srv:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(), 30)
+            writer.close()
+            return data
+
+    data = asyncio.run(run())
+    head, _, body = data.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split(" ")[1]), headers, body
+
+
+def post(path: str, payload) -> bytes:
+    body = json.dumps(payload).encode("utf-8") if not isinstance(payload, bytes) else payload
+    return (f"POST {path} HTTP/1.1\r\nHost: t\r\nConnection: close\r\nContent-Length: {len(body)}\r\n"
+            "\r\n").encode("latin-1") + body
+
+
+def test_healthz_and_unknown_route():
+    status, _, body = request(b"GET /healthz HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert status == 200 and json.loads(body)["status"] == "ok"
+    status, _, body = request(b"GET /nope HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert status == 404
+
+
+def test_bad_requests_are_rejected():
+    assert request(post("/search", b"not json"))[0] == 400
+    assert request(post("/search", {"top_k": 3}))[0] == 400
+    assert request(post("/search", {"question": "x", "where": {"rubric": {"a": 1}}}))[0] == 400
+    assert request(post("/ask", {"question": "x", "agent": "Cafétéria"}))[0] == 400
+    assert request(b"PUT /search HTTP/1.1\r\nConnection: close\r\n\r\n")[0] == 405
+
+
+def test_search_returns_the_nearest_chunk(fake_ollama, target):
+    _, idx = target
+    status, _, body = request(post("/search", {"question": QUESTION, "top_k": 3}))
+    hits = json.loads(body)["hits"]
+    assert status == 200 and len(hits) == 3
+    assert (hits[0]["store"], hits[0]["idx"]) == ("v2_site", idx)
+    assert hits[0]["score"] == pytest.approx(1.0, abs=1e-4)
+    assert fake_ollama["embed"] == 1
+
+    status, _, body = request(post("/search", {"question": QUESTION, "top_k": 5, "where": {"store": "v3_pdf"}}))
+    assert status == 200 and {h["store"] for h in json.loads(body)["hits"]} == {"v3_pdf"}
+
+
+def test_agent_route(fake_ollama):
+    status, _, body = request(post("/agent", {"question": "Quelle mobilité en 4e année ?"}))
+    routed = json.loads(body)
+    assert status == 200 and routed == {"question": "Quelle mobilité en 4e année ?", "agent": "International",
+                                        "confidence": 1.0, "method": "rule"}
+
+
+def test_ask_then_cached(fake_ollama, target):
+    status, _, body = request(post("/ask", {"question": QUESTION, "agent": "Admissions", "top_k": 4}))
+    res = json.loads(body)
+    assert status == 200 and res["answer"] == ANSWER and res["agent"] == "Admissions" and not res["cached"]
+    assert len(res["sources"]) == 4 and (res["sources"][0]["store"], res["sources"][0]["idx"]) == ("v2_site", target[1])
+
+    status, _, body = request(post("/ask", {"question": QUESTION, "agent": "Admissions", "top_k": 4}))
+    assert json.loads(body)["cached"] and fake_ollama["generate"] == 1
+
+
+def test_ask_stream_events(fake_ollama):
+    status, headers, body = request(post("/ask", {"question": QUESTION, "agent": "Formations", "stream": True}))
+    assert status == 200 and headers["Content-Type"].startswith("text/event-stream")
+    events = []
+    for block in body.decode("utf-8").strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    assert events[0][0] == "meta" and events[0][1]["agent"] == "Formations"
+    assert "".join(d["token"] for e, d in events if e == "token") == ANSWER
+    assert events[-1] == ("done", {"answer": ANSWER, "cached": False})
+
+
+def test_stream_failure_is_an_error_event(fake_ollama, monkeypatch):
+    def broken(context, question, prompt):
+        yield "Le"
+        raise RuntimeError("ollama disconnected")
+
+    monkeypatch.setattr(rag_agent_v2, "generate_answer_stream", broken)
+    status, _, body = request(post("/ask", {"question": QUESTION, "agent": "Formations", "stream": True}))
+    blocks = body.decode("utf-8").strip().split("\n\n")
+    assert status == 200 and "HTTP/1.1" not in body.decode("utf-8")
+    assert blocks[-1].startswith("event: error") and "ollama disconnected" in blocks[-1]
+
+
+def test_metrics_name_their_worker():
+    status, headers, body = request(b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert status == 200 and headers["X-Worker-Pid"] == str(os.getpid())
+    assert body.decode("utf-8").startswith(f"# metrics of worker {os.getpid()} only")
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+rag_agent_v2 = pytest.importorskip("rag_agent_v2")
+import metrics  # noqa: E402
+import rag_service  # noqa: E402
+from embed_cache import EmbeddingCache  # noqa: E402
+
+HITS = [{"store": "v2_site", "idx": i, "score": 1.0 - i / 10, "doc": {"rubric": "admissions"}} for i in range(3)]
+
+
+class StubRAG:
+    """get_rag() stand-in: every question is embedded, the search returns HITS."""
+
+    def keyword_only(self, question):
+        return False
+
+    def search_vector(self, q_vec, top_k_per_store=8, top_k_total=10, query_text=None, where=None):
+        return HITS[:top_k_total]
+
+
+@pytest.fixture
+def stub_rag(monkeypatch):
+    """Stubbed stores; embed() blocks on calls["release"] (set by default) and counts its calls."""
+    rag = StubRAG()
+    calls = {"embed": 0, "release": threading.Event()}
+    calls["release"].set()
+
+    def embed(text):
+        calls["embed"] += 1
+        calls["release"].wait(5)
+        return np.ones(4, dtype="float32") / 2
+
+    monkeypatch.setattr(rag_agent_v2, "get_rag", lambda: rag)
+    monkeypatch.setattr(rag_agent_v2, "embed", embed)
+    monkeypatch.setattr(rag_agent_v2, "EMBED_CACHE", EmbeddingCache(max_items=16))
+    return calls
+
+
+def test_identical_inflight_requests_are_coalesced(stub_rag):
+    async def run():
+        service = rag_service.RAGService()
+        stub_rag["release"].clear()
+        first = asyncio.ensure_future(service.retrieve("Comment candidater ?"))
+        second = asyncio.ensure_future(service.retrieve(" Comment  candidater ?"))   # same normalized text
+        await asyncio.sleep(0.05)
+        stub_rag["release"].set()
+        return service, await first, await second
+
+    service, first, second = asyncio.run(run())
+    assert first is second and first.hits == HITS
+    assert stub_rag["embed"] == 1 and service.coalesced == 1 and service.stats()["inflight"] == 0
+
+
+def test_slot_is_released_when_the_timed_out_call_ends():
+    release = threading.Event()
+
+    async def run():
+        service = rag_service.RAGService(max_embed=1, queue_timeout=1.0)
+        with pytest.raises(rag_service.StageTimeout):
+            await service._limited(service._embed_sem, "embed", 0.05, release.wait, 5)
+        held = service._embed_sem.locked()      # the thread is still running: Ollama is still busy
+        release.set()
+        await asyncio.sleep(0.05)
+        result = await service._limited(service._embed_sem, "embed", 1.0, lambda: "ok")
+        return service, held, result
+
+    service, held, result = asyncio.run(run())
+    assert held and result == "ok" and service.timeouts == 1
+    assert not service._embed_sem.locked()
+
+
+def test_full_queue_is_service_busy():
+    release = threading.Event()
+
+    async def run():
+        service = rag_service.RAGService(max_generate=1, queue_timeout=0.05)
+        busy = asyncio.ensure_future(service._limited(service._gen_sem, "generate", 5, release.wait, 5))
+        await asyncio.sleep(0.02)
+        try:
+            with pytest.raises(rag_service.ServiceBusy):
+                await service._limited(service._gen_sem, "generate", 5, lambda: "never")
+        finally:
+            release.set()
+            await busy
+        return service
+
+    service = asyncio.run(run())
+    assert service.rejected == 1 and service.waiting == {"embed": 0, "generate": 0}
+
+
+def test_run_sync_and_iter_sync_keep_the_callers_trace(stub_rag):
+    service = rag_service.get_service()
+    assert rag_service.get_service() is service
+
+    async def current():
+        return metrics.current_trace()
+
+    with metrics.trace("test") as tr:
+        assert rag_service.run_sync(current()) is tr
+    assert rag_service.run_sync(service.search("Quels frais ?", top_k_total=2)) == HITS[:2]
+
+    closed = []
+
+    async def numbers():
+        try:
+            for i in range(10):
+                yield i, metrics.current_trace()
+        finally:
+            closed.append(True)
+
+    with metrics.trace("test") as tr:
+        it = rag_service.iter_sync(numbers())
+        assert [next(it) for _ in range(3)] == [(0, tr), (1, tr), (2, tr)]
+        it.close()                              # stopped early: the generator is closed on its loop
+    assert closed == [True]
+    assert list(rag_service.iter_sync(numbers()))[-1][0] == 9
+
+
+def test_stream_tokens_then_final_answer(stub_rag, monkeypatch):
+    monkeypatch.setattr(rag_agent_v2, "generate_answer_stream", lambda c, q, p: iter(["Oui", ",", " bien sûr"]))
+    monkeypatch.setattr(rag_agent_v2, "_check_answer", lambda answer, context: answer)
+
+    async def run():
+        service = rag_service.RAGService()
+        events = [ev async for ev in service.ask_stream("Quels frais ?", agent="Admissions", use_cache=False)]
+        await asyncio.sleep(0.01)
+        return service, events
+
+    t0 = time.perf_counter()
+    service, events = asyncio.run(run())
+    assert events[0] == {"agent": "Admissions", "hits": HITS}
+    assert [e["token"] for e in events if "token" in e] == ["Oui", ",", " bien sûr"]
+    assert events[-1] == {"done": True, "answer": "Oui, bien sûr", "cached": False}
+    assert not service._gen_sem.locked() and time.perf_counter() - t0 < 5
@@ -0,0 +1,48 @@
+import numpy as np
+
+import rerank
+from ann_index import build_index
+from conftest import unit_vectors
+from rerank import mmr_select, rerank_hits
+
+
+def near(v, noise, seed):
+    rng = np.random.default_rng(seed)
+    w = v + noise * rng.standard_normal(v.shape).astype("float32")
+    return w / np.linalg.norm(w)
+
+
+def test_mmr_picks_the_best_then_a_different_one():
+    a, b = unit_vectors(2, 32, seed=3)
+    V = np.vstack([a, near(a, 0.01, 1), near(a, 0.01, 2), b]).astype("float32")
+    relevance = np.array([0.90, 0.89, 0.88, 0.70], dtype="float32")
+    assert mmr_select(V, relevance, 2, lam=1.0) == [0, 1]       # relevance only: the near-copies
+    assert mmr_select(V, relevance, 2, lam=0.7) == [0, 3]       # the other direction goes second
+    assert mmr_select(V, relevance, 10, lam=0.7)[:2] == [0, 3] and len(mmr_select(V, relevance, 10)) == 4
+    assert mmr_select(V[:0], relevance[:0], 3) == []
+
+
+def test_rerank_hits_diversifies_the_pool():
+    a, b, _ = unit_vectors(3, 32, seed=4)
+    q = (0.8 * a + 0.6 * b) / np.linalg.norm(0.8 * a + 0.6 * b)
+    vectors = np.vstack([near(a, 0.01, i) for i in range(4)] + [b]).astype("float32")
+    store = {"name": "s", "index": build_index(vectors, kind="flat")}
+    hits = [{"store": "s", "idx": i, "score": float(vectors[i] @ q), "doc": {}} for i in range(5)]
+    kept = rerank_hits(q, hits, 2, [store], mode="mmr", lam=0.5)
+    best = max(range(4), key=lambda i: hits[i]["score"])
+    assert hits[4]["score"] < min(h["score"] for h in hits[:4])   # plain ranking: 4 copies of a first
+    assert [h["idx"] for h in kept] == [best, 4]
+    assert kept[0]["score"] == hits[kept[0]["idx"]]["score"]   # FAISS scores left untouched
+
+
+def test_cross_mode_without_a_cross_encoder_is_mmr(monkeypatch):
+    monkeypatch.setattr(rerank, "_cross_model", None)
+    monkeypatch.setattr(rerank, "_cross_failed", True)          # package or model missing
+    vectors = unit_vectors(6, 32, seed=5)
+    store = {"name": "s", "index": build_index(vectors, kind="flat")}
+    q = vectors[2]
+    hits = [{"store": "s", "idx": i, "score": float(vectors[i] @ q), "doc": {"content": str(i)}} for i in range(6)]
+    assert rerank.cross_scores("question", hits) is None
+    cross = rerank_hits(q, hits, 3, [store], mode="cross", question="question")
+    assert cross == rerank_hits(q, hits, 3, [store], mode="mmr") and cross[0]["idx"] == 2
+    assert rerank_hits(q, hits[:1], 3, [store], mode="cross") == hits[:1]
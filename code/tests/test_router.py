@@ -0,0 +1,153 @@
+import json
+
+import numpy as np
+import pytest
+
+import agent_router
+from agent_router import (AGENTS, AgentRouter, build_prototypes, calibrate, fold_ids, open_router, read_labelled,
+                          routing_stats, softmax_confidence, write_router)
+from ann_index import build_index
+from conftest import unit_vectors
+
+
+def clustered(n_per: int, rubrics, d: int = 64, noise: float = 0.6, seed: int = 0):
+    """Rows around one random direction per rubric: (vectors [n_per * len(rubrics), d], rubric of each row)."""
+    rng = np.random.default_rng(seed)
+    centers = unit_vectors(len(rubrics), d, seed=seed + 1)
+    rows, labels = [], []
+    for center, rubric in zip(centers, rubrics):
+        v = center + noise * rng.standard_normal((n_per, d)).astype("float32") / np.sqrt(d)
+        rows.append(v / np.linalg.norm(v, axis=1, keepdims=True))
+        labels.extend([rubric] * n_per)
+    return np.vstack(rows).astype("float32"), labels, centers
+
+
+def test_one_prototype_per_agent_and_unmapped_rubrics_left_out():
+    vectors, rubrics, _ = clustered(50, ["admissions", "formations", "international", "lecole"])
+    sums, agents, counts, excluded = build_prototypes(vectors, rubrics)
+    assert agents == list(AGENTS) and sums.shape == (3, 64)
+    assert counts == {"Admissions": 50, "Formations": 50, "International": 50}
+    assert excluded == {"lecole": 50}
+
+    # a huge unmapped rubric (the pdf store) used to default to Admissions: no weight now
+    big, big_rubrics, _ = clustered(700, ["entreprises"], seed=5)
+    sums, agents, counts, excluded = build_prototypes(big, big_rubrics)
+    assert agents == [] and sums.shape == (0, 64) and excluded == {"entreprises": 700}
+
+
+def test_from_stores_adds_sums_of_every_store(tmp_path):
+    vectors, rubrics, _ = clustered(60, ["admissions", "formations", "international"])
+    half = 90
+    stores = []
+    for i, (v, r) in enumerate([(vectors[:half], rubrics[:half]), (vectors[half:], rubrics[half:])]):
+        out = tmp_path / f"s{i}"
+        write_router(v, r, str(out / agent_router.ROUTER_DIRNAME))
+        stores.append({"router": open_router(str(out), build_index(v, kind="flat"), {})})
+    router = AgentRouter.from_stores(stores)
+    whole = AgentRouter.from_stores([{"router": build_prototypes(vectors, rubrics)[:2]}])
+    assert len(router) == 3
+    np.testing.assert_allclose(router.prototypes, whole.prototypes, atol=1e-5)
+
+
+def test_stale_router_files_are_rebuilt(tmp_path):
+    vectors, rubrics, _ = clustered(40, ["admissions", "formations"])
+    write_router(vectors[:10], rubrics[:10], str(tmp_path / agent_router.ROUTER_DIRNAME))
+    mapping = {str(i): {"rubric": r} for i, r in enumerate(rubrics)}
+    sums, agents = open_router(str(tmp_path), build_index(vectors, kind="flat"), mapping)
+    assert agents == ["Admissions", "Formations"]
+    np.testing.assert_allclose(sums, build_prototypes(vectors, rubrics)[0], atol=1e-4)
+
+
+def test_router_of_a_relabelled_store_is_rebuilt(tmp_path):
+    vectors, rubrics, _ = clustered(40, ["admissions", "formations"])
+    map_path = tmp_path / "mapping.json"
+    map_path.write_text(json.dumps({str(i): {"rubric": r} for i, r in enumerate(rubrics)}))
+    write_router(vectors, rubrics, str(tmp_path / agent_router.ROUTER_DIRNAME), source_path=str(map_path))
+    index = build_index(vectors, kind="flat")
+    assert open_router(str(tmp_path), index, None)[1] == ["Admissions", "Formations"]
+
+    # same doc count, other rubrics: the stored sums are stale
+    relabelled = {str(i): {"rubric": "international"} for i in range(len(rubrics))}
+    map_path.write_text(json.dumps(relabelled))
+    assert open_router(str(tmp_path), index, relabelled)[1] == ["International"]
+
+
+def test_route_confidence_follows_the_temperature():
+    vectors, rubrics, centers = clustered(50, ["admissions", "formations", "international"])
+    sums, agents, _, _ = build_prototypes(vectors, rubrics)
+    q = centers[1]
+    sharp = AgentRouter.from_stores([{"router": (sums, agents)}], temperature=0.01)
+    soft = AgentRouter.from_stores([{"router": (sums, agents)}], temperature=10.0)
+    assert sharp.route(q)[0] == soft.route(q)[0] == "Formations"
+    assert sharp.route(q)[1] > 0.99 and soft.route(q)[1] < 0.4
+    assert sharp.scores(np.vstack([q, q])).shape == (2, len(AGENTS))
+    assert AgentRouter.from_stores([{"router": (sums[:0], [])}]).route(q) == ("Admissions", 0.0)
+
+
+def test_missing_agent_gets_no_probability():
+    probs = softmax_confidence(np.array([0.2, -np.inf, 0.1]), 0.05)
+    assert probs[1] == 0.0 and probs.sum() == pytest.approx(1.0)
+
+
+def test_folds_are_stratified():
+    expected = ["Admissions"] * 12 + ["Formations"] * 7 + ["International"] * 6
+    fold = fold_ids(expected, 5)
+    assert np.bincount(fold).tolist() == [5] * 5
+    for agent in AGENTS:
+        per_fold = np.bincount(fold[np.array(expected) == agent], minlength=5)
+        assert per_fold.max() - per_fold.min() <= 1
+
+
+def test_calibration_is_cross_validated():
+    vectors, rubrics, _ = clustered(60, ["admissions", "formations", "international"])
+    sums, agents, _, _ = build_prototypes(vectors, rubrics)
+    router = AgentRouter.from_stores([{"router": (sums, agents)}])
+    # labelled questions: noisier draws around the same directions, some mislabelled-looking
+    held, held_rubrics, _ = clustered(30, ["admissions", "formations", "international"], noise=2.5, seed=0)
+    expected = [agent_router.keyword_agent(r) for r in held_rubrics]
+    questions = ["question"] * len(expected)
+    scores = router.scores(held)
+
+    cal = calibrate(scores, questions, expected, folds=5)
+    assert cal["folds"] == 5 and cal["n"] == len(expected)
+    assert cal["temperature"] == pytest.approx(np.median([p["temperature"] for p in cal["fold_params"]]), abs=1e-5)
+    assert cal["min_confidence"] == pytest.approx(np.median([p["min_confidence"] for p in cal["fold_params"]]),
+                                                  abs=1e-3)
+    assert 0.002 <= cal["temperature"] <= 0.5 and 0.0 < cal["accuracy"] <= 1.0
+
+    # the out-of-fold accuracy is not the in-sample one: a threshold tuned on these very
+    # questions scores at least as well as the one that generalizes
+    in_sample = max(routing_stats(scores, questions, expected, cal["temperature"], t)["accuracy"]
+                    for t in np.arange(0.34, 1.0, 0.01))
+    assert in_sample >= routing_stats(scores, questions, expected, cal["temperature"],
+                                      cal["min_confidence"])["accuracy"]
+    # a far too cold temperature makes every route look certain
+    cold = routing_stats(scores, questions, expected, 0.001, cal["min_confidence"])
+    assert cold["confident_share"] == 1.0
+
+
+def test_labelled_questions_file():
+    import os
+    labelled = read_labelled(os.path.join(os.path.dirname(__file__), "..", "bench", "agent_questions.jsonl"))
+    assert {a for _, a in labelled} == set(AGENTS) and len(labelled) >= 50
+
+
+def test_route_question_falls_back_below_the_threshold(monkeypatch):
+    rag_agent_v2 = pytest.importorskip("rag_agent_v2")
+    vectors, rubrics, centers = clustered(50, ["admissions", "formations", "international"])
+    sums, agents, _, _ = build_prototypes(vectors, rubrics)
+    router = AgentRouter.from_stores([{"router": (sums, agents)}], temperature=0.01)
+    monkeypatch.setattr(rag_agent_v2.STORES, "router", lambda: router)
+
+    # no calibration: the centroid stage is skipped, the keyword rules route
+    monkeypatch.setattr(rag_agent_v2, "ROUTER_CALIBRATED", False)
+    routed = rag_agent_v2.route_question("Quels cours en troisième année ?", q_vec=centers[2])
+    assert routed["method"] == "default" and routed["agent"] == "Admissions"
+
+    monkeypatch.setattr(rag_agent_v2, "ROUTER_CALIBRATED", True)
+    routed = rag_agent_v2.route_question("Quels cours en troisième année ?", q_vec=centers[2])
+    assert routed["method"] == "centroid" and routed["agent"] == "International"
+
+    tie = np.linalg.lstsq(router.prototypes, np.ones(3, dtype="float32"), rcond=None)[0]  # same score for every agent
+    routed = rag_agent_v2.route_question("Quel cursus choisir ?", q_vec=tie)
+    assert routed["method"] == "keyword" and routed["agent"] == "Formations"
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from ann_index import build_index
+from quantized_index import RescoredIndex, build_quantized
+from search_filter import EXACT_MAX, Partitions, filtered_search, normalize_where
+
+KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "fp16", "pq")
+
+
+def make_index(kind, vectors, ids=None):
+    if kind in ("sq8", "fp16", "pq"):
+        return RescoredIndex(build_quantized(vectors, kind=kind, pq_m=16, ids=ids), vectors, ids=ids)
+    return build_index(vectors, kind=kind, pq_m=16, ids=ids)
+
+
+@pytest.mark.parametrize("kind", KINDS)
+@pytest.mark.parametrize("n_allowed", [40, 700])
+def test_filtered_search_every_kind(kind, n_allowed, vectors):
+    # 700 ids: above ESILV_FILTER_EXACT_MAX -> the IDSelector path (IndexPQ used to crash there)
+    assert (n_allowed > EXACT_MAX) == (n_allowed == 700)
+    index = make_index(kind, vectors)
+    ids = np.arange(0, vectors.shape[0], vectors.shape[0] // n_allowed, dtype=np.int64)[:n_allowed]
+    Q = vectors[ids[:5]]
+
+    D, I = filtered_search({"index": index}, Q, 8, ids, nprobe=64, ef_search=256)
+
+    assert I.shape == (5, 8)
+    assert np.isin(I, ids).all()
+    # every query is a member of the partition: it finds itself first
+    assert (I[:, 0] == ids[:5]).all()
+    assert (np.diff(D, axis=1) <= 1e-5).all()
+
+
+def test_filtered_search_id_mapped_pq(vectors):
+    ids = np.arange(vectors.shape[0], dtype=np.int64) * 3 + 7        # incremental store: holes
+    index = make_index("pq", vectors, ids=ids)
+    allowed = ids[::2]
+    D, I = filtered_search({"index": index}, vectors[:4], 8, allowed)
+    assert np.isin(I, allowed).all()
+    assert I[0, 0] == ids[0] and I[2, 0] == ids[2]
+
+
+def test_filtered_search_small_partition_pads(vectors):
+    D, I = filtered_search({"index": build_index(vectors, kind="flat")}, vectors[3:4], 8,
+                           np.array([3, 9], dtype=np.int64))
+    assert I[0].tolist() == [3, 9] + [-1] * 6
+    assert np.isinf(D[0, 2:]).all()
+
+
+def test_partitions_select():
+    mapping = {
+        "0": {"rubric": "admissions", "page": 1},
+        "1": {"rubric": "formations", "page": 1},
+        "2": {"rubric": "admissions", "page": 2},
+        "3": {"rubric": "entreprises"},
+    }
+    parts = Partitions(mapping)
+    assert parts.select(normalize_where({"rubric": "admissions"})).tolist() == [0, 2]
+    assert parts.select(normalize_where({"rubric": ["admissions", "formations"], "page": 1})).tolist() == [0, 1]
+    assert parts.select(normalize_where({"agent": "Formations"})).tolist() == [1]
+    assert parts.select(normalize_where({"rubric": "nope"})).size == 0
+    assert parts.select(normalize_where({"store": "v2_site"})) is None